@@ -0,0 +1,156 @@
+# cdk_backend/bench/bench_hot_paths.py
+"""
+Micro-benchmarks for the pure-Python paths that run on every answer.
+
+Covers markdown post-processing (_emphasize_stats, _linkify_bare_urls,
+_annotate_sentences_with_links, the streaming transformer) on 1-20 KB
+synthetic answers, plus routing (_pick_reference_url,
+_runtime_relevant_resources, _match_personal/_match_runtime,
+_dedupe_sources_best) against synthetic KBs of growing size. Reports ops/s
+(best of --repeats) and the peak memory allocated by a single call
+(tracemalloc). Runs offline: the AWS clients are lazy and never touched.
+
+    python cdk_backend/bench/bench_hot_paths.py [--quick] [--only emphasize] [--json out.json]
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+HERE = os.path.dirname(__file__)
+sys.path.insert(0, HERE)
+sys.path.insert(0, os.path.join(HERE, "..", "lambda", "lambdaXbedrock"))
+sys.path.insert(0, os.path.join(HERE, "..", "lambda", "shared", "python"))
+
+import index  # noqa: E402
+import synthetic  # noqa: E402
+
+FOOTNOTE_URL = "https://hivpreventioncoalition.unaids.org/en/resources/example"
+
+
+def _stream(text: str, chunk: int = 24) -> str:
+    t = index._MarkdownStreamTransformer(FOOTNOTE_URL, start_index=1)
+    out = [t.feed(text[i:i + chunk]) for i in range(0, len(text), chunk)]
+    out.append(t.finish())
+    return "".join(out)
+
+
+def _use_kbs(personal: dict | None, runtime: dict | None):
+    index._PERSONAL_KB, index._PERSONAL_MATCHER = personal, None
+    index._RUNTIME_KB, index._RUNTIME_MATCHER = runtime, None
+    index._RUNTIME_RESOURCE_INDEX = None
+
+
+def build_cases(rng: random.Random, quick: bool) -> list[tuple]:
+    """(name, variant, fn, inputs, setup) tuples; setup runs once before timing."""
+    answer_sizes = [1024, 5 * 1024] if quick else [1024, 5 * 1024, 20 * 1024]
+    kb_sizes = [100, 1000] if quick else [100, 1000, 10000]
+    resource_sizes = [50, 500] if quick else [50, 500, 5000]
+    prompts = [synthetic.prompt(rng) for _ in range(200)]
+
+    cases = []
+    for size in answer_sizes:
+        answers = [synthetic.answer(size, rng) for _ in range(8)]
+        variant = f"{size // 1024}KB"
+        cases += [
+            ("emphasize_stats", variant, index._emphasize_stats, answers, None),
+            ("linkify_bare_urls", variant, index._linkify_bare_urls, answers, None),
+            (
+                "annotate_sentences", variant,
+                lambda a: index._annotate_sentences_with_links(a, FOOTNOTE_URL, 1),
+                answers, None,
+            ),
+            ("stream_transformer", variant, _stream, answers, None),
+        ]
+
+    cases.append(("pick_reference_url", f"{len(index.REFERENCE_URLS)} urls",
+                  index._pick_reference_url, prompts, None))
+
+    for n in kb_sizes:
+        personal = synthetic.qna_kb(n, rng)
+        runtime = synthetic.runtime_kb(n, rng)
+        cases += [
+            ("match_personal", f"{n} items", index._match_personal, prompts,
+             lambda p=personal: _use_kbs(p, None)),
+            ("match_runtime", f"{n // 10} items", index._match_runtime, prompts,
+             lambda r=runtime: _use_kbs(None, r)),
+        ]
+
+    for n in resource_sizes:
+        runtime = synthetic.runtime_kb(n, rng)
+        cases.append((
+            "runtime_relevant_resources", f"{n} resources",
+            lambda p: index._runtime_relevant_resources(p, top_n=4), prompts,
+            lambda r=runtime: _use_kbs(None, r),
+        ))
+
+    for n in (10, 50, 200):
+        lists = [synthetic.sources(n, rng) for _ in range(20)]
+        cases.append(("dedupe_sources_best", f"{n} sources", index._dedupe_sources_best, lists, None))
+    return cases
+
+
+def measure(fn, inputs: list, min_time: float, repeats: int) -> dict:
+    fn(inputs[0])  # warm caches (compiled matchers / indexes are built lazily)
+    best = 0.0
+    for _ in range(repeats):
+        n, start = 0, time.perf_counter()
+        while True:
+            for x in inputs:
+                fn(x)
+            n += len(inputs)
+            elapsed = time.perf_counter() - start
+            if elapsed >= min_time:
+                break
+        best = max(best, n / elapsed)
+
+    peak = 0
+    tracemalloc.start()
+    try:
+        for x in inputs:
+            tracemalloc.reset_peak()
+            base = tracemalloc.get_traced_memory()[0]
+            fn(x)
+            peak = max(peak, tracemalloc.get_traced_memory()[1] - base)
+    finally:
+        tracemalloc.stop()
+    return {"ops_per_sec": best, "peak_alloc_kib": peak / 1024}
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    ap.add_argument("--quick", action="store_true", help="smaller sizes, shorter runs")
+    ap.add_argument("--only", default="", help="run cases whose name contains this")
+    ap.add_argument("--min-time", type=float, default=0.3, help="seconds per repeat")
+    ap.add_argument("--repeats", type=int, default=3)
+    ap.add_argument("--seed", type=int, default=7)
+    ap.add_argument("--json", default="", help="also write results to this file")
+    args = ap.parse_args()
+    if args.quick:
+        args.min_time = min(args.min_time, 0.1)
+
+    rng = random.Random(args.seed)
+    results = []
+    print(f"{'case':<28} {'variant':<14} {'ops/s':>12} {'us/op':>10} {'peak KiB/op':>12}")
+    for name, variant, fn, inputs, setup in build_cases(rng, args.quick):
+        if args.only and args.only not in name:
+            continue
+        if setup:
+            setup()
+        r = measure(fn, inputs, args.min_time, args.repeats)
+        results.append({"case": name, "variant": variant, **r})
+        print(
+            f"{name:<28} {variant:<14} {r['ops_per_sec']:>12.0f} "
+            f"{1e6 / r['ops_per_sec']:>10.1f} {r['peak_alloc_kib']:>12.1f}"
+        )
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"seed": args.seed, "python": sys.version.split()[0], "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
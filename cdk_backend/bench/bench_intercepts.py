@@ -0,0 +1,98 @@
+# cdk_backend/bench/bench_intercepts.py
+"""
+Benchmark personal/runtime KB intercept matching at 10k patterns.
+
+Compares the compiled _QnaMatcher (exact map + Aho-Corasick) with the
+original per-item `_norm(p) in q` scan. Runs offline; no AWS calls are made.
+
+    python cdk_backend/bench/bench_intercepts.py [--patterns 10000] [--prompts 2000]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "lambda", "lambdaXbedrock"))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "lambda", "shared", "python"))
+
+import index  # noqa: E402
+
+WORDS = (
+    "hiv prep agyw district prevalence incidence kenya uganda zimbabwe nigeria "
+    "scorecard phia unaids who testing treatment key populations adolescent "
+    "youth budget rollout cabotegravir guideline strategy dashboard data"
+).split()
+
+
+def _synthetic_kb(n_patterns: int, per_item: int, rng: random.Random) -> dict:
+    qna = []
+    for i in range(0, n_patterns, per_item):
+        patterns = [
+            " ".join(rng.sample(WORDS, 3)) + f" q{i + j}"
+            for j in range(per_item)
+        ]
+        qna.append({
+            "question_exact": f"What is item {i}?",
+            "patterns": patterns,
+            "answer_template": f"Answer {i}",
+        })
+    return {"qna": qna}
+
+
+def _scan_match(kb: dict, prompt: str):
+    """The pre-compilation matcher, kept here as the baseline."""
+    q = index._norm(prompt)
+    for item in kb.get("qna", []):
+        if index._norm(item.get("question_exact")) == q:
+            return item
+        for p in item.get("patterns", []) or []:
+            if p and index._norm(p) in q:
+                return item
+    return None
+
+
+def _time(fn, prompts) -> float:
+    start = time.perf_counter()
+    for p in prompts:
+        fn(p)
+    return time.perf_counter() - start
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    ap.add_argument("--patterns", type=int, default=10000)
+    ap.add_argument("--per-item", type=int, default=5)
+    ap.add_argument("--prompts", type=int, default=2000)
+    ap.add_argument("--seed", type=int, default=7)
+    args = ap.parse_args()
+
+    rng = random.Random(args.seed)
+    kb = _synthetic_kb(args.patterns, args.per_item, rng)
+    prompts = [
+        " ".join(rng.choice(WORDS) for _ in range(rng.randint(6, 25))) + "?"
+        for _ in range(args.prompts)
+    ]
+    # a few real hits, late in the list, so the scan can't exit early
+    hits = kb["qna"][-3:]
+    prompts[::50] = [hits[i % 3]["patterns"][0].upper() for i in range(len(prompts[::50]))]
+
+    t0 = time.perf_counter()
+    matcher = index._QnaMatcher(kb)
+    compile_s = time.perf_counter() - t0
+
+    for p in prompts:
+        assert matcher.match(p) is _scan_match(kb, p), p
+
+    scan_s = _time(lambda p: _scan_match(kb, p), prompts)
+    ac_s = _time(matcher.match, prompts)
+    n = len(prompts)
+    print(f"patterns={args.patterns} items={len(kb['qna'])} prompts={n}")
+    print(f"compile          {compile_s * 1e3:10.1f} ms (once per KB ETag)")
+    print(f"scan (baseline)  {scan_s / n * 1e6:10.1f} us/prompt  {n / scan_s:10.0f} ops/s")
+    print(f"aho-corasick     {ac_s / n * 1e6:10.1f} us/prompt  {n / ac_s:10.0f} ops/s")
+    print(f"speedup          {scan_s / ac_s:10.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+# cdk_backend/bench/check_count.py
+"""
+Checks for the COUNT route against the in-memory OpenSearch stand-in.
+
+Asserts the aggregation query lambdaXbedrock sends, the markdown it formats
+from the response (including keyword-mapped page fields whose bucket keys
+come back as strings), the per-keyword cache (links presigned on every read)
+and its invalidation when a new ingestion job completes, and the end-to-end
+websocket answer. Runs offline.
+
+    python cdk_backend/bench/check_count.py
+"""
+import os
+import sys
+
+HERE = os.path.dirname(__file__)
+sys.path.insert(0, HERE)
+
+import fakes  # noqa: E402
+
+KEYWORD = "cabotegravir"
+
+
+def _expected_docs(chunks: list[dict], cfg, phrase: str) -> dict[str, list[dict]]:
+    docs: dict[str, list[dict]] = {}
+    for c in chunks:
+        if phrase.lower() in c[cfg.OPENSEARCH_TEXT_FIELD].lower():
+            docs.setdefault(c[cfg.OPENSEARCH_DOC_ID_FIELD], []).append(c)
+    return docs
+
+
+def check_query_body(index):
+    cfg = index.cfg
+    body = index._os_count_query(KEYWORD)
+    assert body["size"] == 0 and body["track_total_hits"] is True, body
+    assert body["query"] == {"match_phrase": {cfg.OPENSEARCH_TEXT_FIELD: KEYWORD}}, body["query"]
+    aggs = body["aggs"]
+    assert aggs["doc_count"]["cardinality"]["field"] == cfg.OPENSEARCH_DOC_ID_FIELD
+    assert aggs["top_docs"]["terms"] == {"field": cfg.OPENSEARCH_DOC_ID_FIELD, "size": index.OS_COUNT_TOP_DOCS}
+    assert aggs["top_docs"]["aggs"]["pages"]["terms"] == {
+        "field": cfg.OPENSEARCH_PAGE_FIELD, "size": index.OS_COUNT_TOP_PAGES,
+    }
+
+
+def check_formatting(index, f: fakes.Fakes):
+    cfg = index.cfg
+    expected = _expected_docs(f.opensearch.chunks, cfg, KEYWORD)
+    summary, details, count = index._os_count_keyword(KEYWORD)
+    assert count == len(expected) > 1, (count, len(expected))
+    assert summary == f'**{count}** documents mention "{KEYWORD}".', summary
+    lines = details.splitlines()
+    shown = min(count, index.OS_COUNT_TOP_DOCS)
+    header = f"Top {shown}" if count > shown else "Documents"
+    assert lines[0] == f"{header} by matching passages:", lines[0]
+    assert len(lines) - 1 == shown, lines
+    for line in lines[1:]:
+        src = next(s for s in expected if index._clean_filename(s) in line)
+        pages = sorted(int(c[cfg.OPENSEARCH_PAGE_FIELD]) for c in expected[src])[:index.OS_COUNT_TOP_PAGES]
+        n = len(expected[src])
+        assert f"{', '.join(map(str, pages))} ({n} matching passage" in line, (line, pages)
+
+    none = index._os_count_keyword("no such phrase anywhere")
+    assert none == ('No documents mention "no such phrase anywhere".', "", 0), none
+
+
+def check_string_page_keys(index):
+    resp = {"aggregations": {
+        "doc_count": {"value": 1},
+        "top_docs": {"buckets": [{
+            "key": "s3://fake-doc-bucket/docs/report_1.pdf",
+            "doc_count": 4,
+            "pages": {"buckets": [
+                {"key": "12", "doc_count": 2}, {"key": 3.0, "doc_count": 1},
+                {"key": "7.0", "doc_count": 1}, {"key": "n/a", "doc_count": 1},
+            ]},
+        }]},
+    }}
+    summary, details, count = index._format_count_result(KEYWORD, resp)
+    assert count == 1 and summary == f'**1** document mentions "{KEYWORD}".', summary
+    assert "pages 3, 7, 12 (4 matching passages)" in details, details
+
+
+def check_cache(index, f: fakes.Fakes):
+    f.log.reset()
+    index._os_count_keyword(KEYWORD)
+    assert "opensearch.search" not in f.log.reset(), "second identical count should be a cache hit"
+
+    # A hit is re-presigned, so it never carries links older than _PRESIGN_CACHE allows.
+    index._PRESIGN_CACHE.clear()
+    _, details, _ = index._os_count_keyword(KEYWORD)
+    calls = f.log.reset()
+    assert "opensearch.search" not in calls and calls.get("s3.generate_presigned_url"), calls
+    assert "X-Amz-Signature" in details, details
+
+    f.bedrock_agent.latest_job = {"ingestionJobId": "JOB2", "status": "COMPLETE", "updatedAt": "2026-02-01T00:00:00Z"}
+    index._KB_VERSION_CHECKED_AT = float("-inf")
+    index._os_count_keyword(KEYWORD)
+    calls = f.log.reset()
+    assert calls.get("bedrock-agent.list_ingestion_jobs") == 1, calls
+    assert calls.get("opensearch.search") == 1, "a new ingestion job must invalidate cached counts"
+
+
+def check_end_to_end(index, f: fakes.Fakes):
+    f.ws.take_frames()
+    resp = index.lambda_handler({"connectionId": "c-count", "prompt": f'How many documents mention "{KEYWORD}"?'}, None)
+    assert resp == {"statusCode": 200, "body": "COUNT OK"}, resp
+    frames = [p for _, p in f.ws.take_frames("c-count")]
+    assert frames[-1] == {"type": "end", "statusCode": 200}, frames[-1]
+    assert frames[0]["text"].startswith("**"), frames[0]
+
+
+def main():
+    index = fakes.load_index()
+    f = fakes.install(index, fakes.FakeConfig(
+        tokens_per_sec=0, first_token_ms=0, converse_ms=0, retrieve_ms=0, post_ms=0,
+    ))
+    index._Trace.emit = lambda trace: None
+    check_query_body(index)
+    check_formatting(index, f)
+    check_string_page_keys(index)
+    check_cache(index, f)
+    check_end_to_end(index, f)
+    print("count checks passed")
+
+
+if __name__ == "__main__":
+    main()
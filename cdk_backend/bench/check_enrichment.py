@@ -0,0 +1,117 @@
+# cdk_backend/bench/check_enrichment.py
+"""
+Checks for the talk route's sources-block enrichment (relevance reasons and
+lead-in) against the fake model clients.
+
+Asserts that both enrichment calls start when retrieval completes, before
+the answer's first token, that the end-of-answer waits share one
+ENRICH_WAIT_SECONDS deadline instead of each getting their own, and that
+calls still running after their answer gave up on them are timed into that
+answer's trace and charged to its usage ledger, not the next invocation's.
+Runs offline.
+
+    python cdk_backend/bench/check_enrichment.py
+"""
+import os
+import sys
+import time
+
+HERE = os.path.dirname(__file__)
+sys.path.insert(0, HERE)
+
+import fakes  # noqa: E402
+
+EVENT = {"connectionId": "c-enrich", "prompt": "What was HIV prevalence among adolescent girls in Kenya in 2022?", "history": []}
+# no sources block, so no enrichment calls of its own
+PLAIN = {"connectionId": "c-plain", "prompt": "What does a good data visualisation for programme managers look like?", "history": []}
+
+
+def _record_converse(f: fakes.Fakes) -> dict:
+    seen = {"converse": [], "stream": []}
+    converse, converse_stream = f.brt.converse, f.brt.converse_stream
+
+    def recording_converse(**kwargs):
+        seen["converse"].append(time.perf_counter())
+        return converse(**kwargs)
+
+    def recording_converse_stream(**kwargs):
+        seen["stream"].append(time.perf_counter())
+        return converse_stream(**kwargs)
+
+    f.brt.converse, f.brt.converse_stream = recording_converse, recording_converse_stream
+    return seen
+
+
+def _run(index, f: fakes.Fakes) -> list[tuple[float, dict]]:
+    f.ws.take_frames()
+    resp = index.lambda_handler(dict(EVENT), None)
+    assert resp == {"statusCode": 200, "body": "OK"}, resp
+    return f.ws.take_frames("c-enrich")
+
+
+def check_starts_with_retrieval(index, f: fakes.Fakes):
+    f.brt.conf.first_token_ms = 500
+    seen = _record_converse(f)
+    frames = _run(index, f)
+    first_delta = next(t for t, p in frames if p.get("type") == "delta")
+    assert len(seen["converse"]) == 2, seen
+    # both calls go out with the stream request, well before its first token
+    assert all(t < seen["stream"][0] + 0.25 for t in seen["converse"]), seen
+    assert max(seen["converse"]) < first_delta, (seen, first_delta)
+    del f.brt.converse, f.brt.converse_stream
+    f.brt.conf.first_token_ms = 0
+
+
+def check_one_deadline(index, f: fakes.Fakes):
+    index.ENRICH_WAIT_SECONDS = 0.4
+    f.brt.conf.converse_ms = 3000
+    frames = _run(index, f)
+    deltas = [t for t, p in frames if p.get("type") == "delta"]
+    waited = frames[-1][0] - deltas[-2]
+    # reasons and lead-in each time out, but inside one 0.4 s budget
+    assert waited < index.ENRICH_WAIT_SECONDS + 0.2, waited
+    print(f"sources wait with both calls stuck: {waited * 1000:.0f}ms (budget {index.ENRICH_WAIT_SECONDS * 1000:.0f}ms)")
+    f.brt.conf.converse_ms = 0
+    index.ENRICH_WAIT_SECONDS = 8.0
+
+
+def check_late_workers(index, f: fakes.Fakes):
+    traces, ledgers = [], []
+
+    def emit(trace):
+        traces.append(trace)
+        ledgers.append(index._USAGE)
+
+    index._Trace.emit = emit
+    index.ENRICH_WAIT_SECONDS = 0.1
+    f.brt.conf.converse_ms = 600
+    _run(index, f)
+    # the next invocation is still streaming when the abandoned calls finish
+    f.brt.conf.first_token_ms = 1000
+    index.lambda_handler(dict(PLAIN), None)
+    time.sleep(0.2)
+    first, second = traces
+    assert {"reasons", "leadin"} <= first.stages.keys(), first.stages
+    assert not {"reasons", "leadin"} & second.stages.keys(), second.stages
+    purposes = [{c["purpose"] for c in ledger.calls} for ledger in ledgers]
+    assert purposes[0] == {"talk", "reasons", "leadin"}, purposes
+    assert purposes[1] == {"talk"}, purposes
+    f.brt.conf.converse_ms = f.brt.conf.first_token_ms = 0
+    index.ENRICH_WAIT_SECONDS = 8.0
+    index._Trace.emit = lambda trace: None
+
+
+def main():
+    index = fakes.load_index()
+    f = fakes.install(index, fakes.FakeConfig(
+        tokens_per_sec=0, first_token_ms=0, converse_ms=0, retrieve_ms=0, post_ms=0,
+    ))
+    index._Trace.emit = lambda trace: None
+    check_starts_with_retrieval(index, f)
+    check_one_deadline(index, f)
+    check_late_workers(index, f)
+    print("enrichment checks passed")
+
+
+if __name__ == "__main__":
+    main()
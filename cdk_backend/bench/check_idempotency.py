@@ -0,0 +1,177 @@
+# cdk_backend/bench/check_idempotency.py
+"""
+Checks for messageId idempotency against the in-memory DynamoDB stand-in.
+
+Asserts the conditional claim (new / duplicate while the lease is live /
+resume once it has expired / duplicate after completion), the checkpoint
+UpdateExpressions, how many checkpoint writes a long answer costs, and that
+a retry started after any posted frame leaves the client (which rewinds to
+a frame's `offset`, like StreamingResponse.jsx) with exactly the answer an
+uninterrupted attempt would have given. Runs offline.
+
+    python cdk_backend/bench/check_idempotency.py
+"""
+import copy
+import os
+import random
+import sys
+import time
+
+HERE = os.path.dirname(__file__)
+sys.path.insert(0, HERE)
+
+import fakes  # noqa: E402
+
+TABLE = "sessions"
+EVENT = {"connectionId": "c-idem", "prompt": "What makes a good chart for programme managers?", "history": []}
+RAW = (
+    "Good charts start with **one** question. About 45% of managers skim https://example.org/a first. "
+    "Then label axes clearly.\n\n- keep it simple\n- use 3 colours max\n\n"
+    "Finally, cite [UNAIDS](https://unaids.org). Done."
+)
+
+
+def _scripted_stream(chunk: int):
+    """converse_stream that continues RAW after whatever assistant prefill it is given."""
+    def converse_stream(**kwargs):
+        last = kwargs["messages"][-1]
+        prefill = last["content"][0]["text"] if last["role"] == "assistant" else ""
+        assert RAW.startswith(prefill), prefill
+        rest = RAW[len(prefill):]
+
+        def events():
+            yield {"messageStart": {"role": "assistant"}}
+            for i in range(0, len(rest), chunk):
+                yield {"contentBlockDelta": {"delta": {"text": rest[i:i + chunk]}}}
+            yield {"messageStop": {"stopReason": "end_turn"}}
+            yield {"metadata": {"usage": {"inputTokens": 1, "outputTokens": 1}}}
+        return {"stream": events()}
+    return converse_stream
+
+
+def client_text(frames: list[dict]) -> str:
+    """What the frontend shows: deltas appended, rewound to `offset` when it is behind."""
+    text = ""
+    for p in frames:
+        if p.get("type") == "delta" and p.get("text"):
+            offset = p.get("offset")
+            if isinstance(offset, int) and offset < len(text):
+                text = text[:offset]
+            text += p["text"]
+    return text
+
+
+def _record(index, f: fakes.Fakes) -> list[tuple]:
+    """Interleaved ("frame", payload) / ("checkpoint", fields) events, in worker order."""
+    events = []
+    post, checkpoint = f.ws.post_to_connection, index._IDEMPOTENCY_STORE.checkpoint
+
+    def recording_post(ConnectionId, Data):
+        post(ConnectionId=ConnectionId, Data=Data)
+        events.append(("frame", index.json.loads(Data)))
+
+    def recording_checkpoint(message_id, fields):
+        checkpoint(message_id, fields)
+        events.append(("checkpoint", copy.deepcopy(fields)))
+
+    f.ws.post_to_connection = recording_post
+    index._IDEMPOTENCY_STORE.checkpoint = recording_checkpoint
+    return events
+
+
+def _item(f: fakes.Fakes, message_id: str) -> dict:
+    return f.dynamodb.tables[TABLE][(f"msg#{message_id}", "0")]
+
+
+def check_claim(index, f: fakes.Fakes):
+    store = index._IDEMPOTENCY_STORE
+    assert store.claim("m-claim", time.time() + 60) == ("new", {})
+    assert store.claim("m-claim", time.time() + 60) == ("duplicate", {}), "live lease must not be reclaimed"
+    store.checkpoint("m-claim", {"raw": "Good ", "delivered": "Good ", "formatter": "{}", "ended": ""})
+    item = _item(f, "m-claim")
+    assert item["raw"] == {"S": "Good "} and item["status"] == {"S": "IN_PROGRESS"}, item
+    item["leaseUntil"] = {"N": f"{time.time() - 1:.3f}"}
+    state, checkpoint = store.claim("m-claim", time.time() + 60)
+    assert state == "resume", state
+    assert checkpoint == {"raw": "Good ", "delivered": "Good ", "formatter": "{}", "ended": ""}, checkpoint
+    store.complete("m-claim", 200)
+    item = _item(f, "m-claim")
+    assert item["status"] == {"S": "COMPLETED"} and "raw" not in item and "delivered" not in item, item
+    item["leaseUntil"] = {"N": "0"}
+    assert store.claim("m-claim", time.time() + 60) == ("duplicate", {}), "completed messages stay done"
+
+
+def check_checkpoint_cost(index, f: fakes.Fakes):
+    f.brt.converse_stream = fakes.FakeBedrockRuntime.converse_stream.__get__(f.brt)
+    f.brt.conf.answer_bytes = 4000
+    f.log.reset()
+    before = f.dynamodb.bytes_written
+    index.lambda_handler(dict(EVENT, messageId="m-cost"), None)
+    frames = [p for _, p in f.ws.take_frames("c-idem")]
+    calls = f.log.reset()
+    writes = calls.get("dynamodb.update_item", 0)
+    answer = sum(len(p.get("text") or "") for p in frames)
+    assert len(frames) > 20, (len(frames), answer)
+    # every 1 KB posted, the end frame, and completion
+    assert writes <= answer // index.IDEMPOTENCY_CHECKPOINT_CHARS + 3, (writes, len(frames))
+    written = f.dynamodb.bytes_written - before
+    assert written < 8 * (answer + 2000), written
+    print(f"checkpoint cost: frames={len(frames)} answer_chars={answer} update_item={writes} bytes_written={written}")
+    f.brt.conf.answer_bytes = 900
+
+
+def check_resume_everywhere(index, f: fakes.Fakes, chunk: int):
+    f.brt.converse_stream = _scripted_stream(chunk)
+    # a checkpoint on every frame and one only at the end bracket the thresholds
+    for every_chars in (1, 10 ** 9):
+        index.IDEMPOTENCY_CHECKPOINT_CHARS = every_chars
+        message_id = f"m-ref-{chunk}-{every_chars}"
+        events = _record(index, f)
+        random.seed(3)
+        index.lambda_handler(dict(EVENT, messageId=message_id), None)
+        f.ws.take_frames()
+        del f.ws.post_to_connection, index._IDEMPOTENCY_STORE.checkpoint
+        reference = client_text([p for kind, p in events if kind == "frame"])
+        assert reference.startswith("Good charts") and events[-1][0] == "checkpoint", events[-1]
+
+        for died_after in range(len(events)):
+            seen = events[:died_after + 1]
+            frames = [p for kind, p in seen if kind == "frame"]
+            saved = [c for kind, c in seen if kind == "checkpoint"]
+            retry_id = f"{message_id}-{died_after}"
+            f.dynamodb.put_item(TableName=TABLE, Item={
+                "sessionId": {"S": f"msg#{retry_id}"}, "seq": {"N": "0"},
+                "status": {"S": "IN_PROGRESS"}, "leaseUntil": {"N": "0"},
+                **{k: {"S": v} for k, v in (saved[-1] if saved else {}).items()},
+            })
+            random.seed(3)
+            resp = index.lambda_handler(dict(EVENT, messageId=retry_id), None)
+            retried = [p for _, p in f.ws.take_frames("c-idem")]
+            got = client_text(frames + retried)
+            if resp["body"] == "RESUMED_CLOSED":
+                assert got == client_text(frames), (died_after, got)
+                assert retried == ([] if saved[-1]["ended"] else [{"type": "end", "statusCode": 200}]), retried
+            else:
+                assert got == reference, f"chunk={chunk} died_after={died_after}\n{reference!r}\n{got!r}"
+                assert retried[-1]["type"] == "end", retried[-1]
+    index.IDEMPOTENCY_CHECKPOINT_CHARS = 1024
+
+
+def main():
+    index = fakes.load_index()
+    f = fakes.install(index, fakes.FakeConfig(
+        tokens_per_sec=0, first_token_ms=0, converse_ms=0, retrieve_ms=0, post_ms=0,
+    ))
+    f.use_dynamodb(index, TABLE)
+    index._Trace.emit = lambda trace: None
+    # one frame per delta, so every frame boundary is a possible crash point
+    index.WS_COALESCE_MS, index.WS_COALESCE_MAX_CHARS = 0, 1
+    check_claim(index, f)
+    check_checkpoint_cost(index, f)
+    for chunk in (3, 7, 19):
+        check_resume_everywhere(index, f, chunk)
+    print("idempotency checks passed")
+
+
+if __name__ == "__main__":
+    main()
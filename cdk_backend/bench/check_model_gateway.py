@@ -0,0 +1,106 @@
+# cdk_backend/bench/check_model_gateway.py
+"""
+Checks for _ModelGateway retry / fallback behaviour against the fake
+bedrock-runtime client.
+
+Covers a stream that is throttled on its first event (botocore raises
+EventStreamError with the camelCase code "throttlingException"), a fallback
+ID that cannot be invoked on demand (ValidationException: skipped, primary
+retried), and that LLM_MODEL_ID is never added to the chain implicitly.
+Runs offline.
+
+    python cdk_backend/bench/check_model_gateway.py
+"""
+import os
+import sys
+
+HERE = os.path.dirname(__file__)
+sys.path.insert(0, HERE)
+
+import fakes  # noqa: E402
+from botocore.exceptions import ClientError  # noqa: E402
+
+PROFILE = "us.anthropic.fake-profile-v1:0"
+ON_DEMAND = "anthropic.fake-on-demand-v1:0"
+FALLBACK = "anthropic.fake-fallback-v1:0"
+
+MESSAGES = [{"role": "user", "content": [{"text": "What is PrEP?"}]}]
+
+
+def _stream(index, f: fakes.Fakes) -> tuple[str, dict]:
+    f.log.reset()
+    resp = index._MODEL_GATEWAY.converse_stream(modelId=index.MODEL_ID, messages=MESSAGES)
+    events = list(resp["stream"])
+    assert any("contentBlockDelta" in ev for ev in events), events[:3]
+    return resp["servedModelId"], f.log.reset()
+
+
+def check_chain(index):
+    assert index.MODEL_ID == PROFILE, index.MODEL_ID
+    assert index.cfg.LLM_MODEL_FALLBACK_ID == ON_DEMAND
+    assert index._MODEL_GATEWAY._chain(index.MODEL_ID) == [PROFILE], "LLM_MODEL_ID must not be an implicit fallback"
+
+
+def check_stream_throttle_retries_primary(index, f: fakes.Fakes):
+    f.brt.stream_throttled[PROFILE] = 1
+    served, calls = _stream(index, f)
+    assert served == PROFILE, served
+    assert calls["bedrock-runtime.converse_stream.stream_throttled"] == 1, calls
+    assert calls["bedrock-runtime.converse_stream"] == 2, calls
+
+
+def check_stream_throttle_falls_back(index, f: fakes.Fakes):
+    index._MODEL_GATEWAY.fallback_ids = [FALLBACK]
+    f.brt.stream_throttled[PROFILE] = 1
+    served, calls = _stream(index, f)
+    assert served == FALLBACK, (served, calls)
+
+
+def check_unusable_fallback_is_skipped(index, f: fakes.Fakes):
+    index._MODEL_GATEWAY.fallback_ids = [FALLBACK]
+    f.brt.model_errors[FALLBACK] = "ValidationException"
+    f.brt.stream_throttled[PROFILE] = 2
+    served, calls = _stream(index, f)
+    assert served == PROFILE, (served, calls)
+    # skipped once, then only the primary is retried
+    assert calls["bedrock-runtime.ConverseStream.ValidationException"] == 1, calls
+    assert calls["bedrock-runtime.converse_stream.stream_throttled"] == 2, calls
+
+    f.brt.stream_throttled[PROFILE] = index.MODEL_MAX_RETRIES + 1
+    try:
+        _stream(index, f)
+    except ClientError as e:
+        assert e.response["Error"]["Code"] == "throttlingException", e.response
+    else:
+        raise AssertionError("an always-throttled primary must surface its throttle")
+    f.brt.model_errors.clear()
+    index._MODEL_GATEWAY.fallback_ids = []
+
+
+def check_end_to_end(index, f: fakes.Fakes):
+    f.brt.stream_throttled[PROFILE] = 1
+    f.ws.take_frames()
+    resp = index.lambda_handler({"connectionId": "c-gw", "prompt": "What makes a good chart?"}, None)
+    assert resp == {"statusCode": 200, "body": "OK"}, resp
+    frames = [p for _, p in f.ws.take_frames("c-gw")]
+    assert frames[-1] == {"type": "end", "statusCode": 200}, frames[-1]
+    assert all(p.get("type") != "error" for p in frames), frames
+
+
+def main():
+    index = fakes.load_index({"INFERENCE_PROFILE_ID": PROFILE, "LLM_MODEL_ID": ON_DEMAND})
+    f = fakes.install(index, fakes.FakeConfig(
+        tokens_per_sec=0, first_token_ms=0, converse_ms=0, retrieve_ms=0, post_ms=0,
+    ))
+    index._Trace.emit = lambda trace: None
+    index.MODEL_RETRY_BASE_SECONDS = 0.0
+    check_chain(index)
+    check_stream_throttle_retries_primary(index, f)
+    check_stream_throttle_falls_back(index, f)
+    check_unusable_fallback_is_skipped(index, f)
+    check_end_to_end(index, f)
+    print("model gateway checks passed")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+# cdk_backend/bench/check_session_store.py
+"""
+Checks for server-side history in the shared session table, driving
+web-socket-handler and lambdaXbedrock against the in-memory DynamoDB
+stand-in.
+
+Asserts that an inline turn recorded by web-socket-handler is read back as
+history by lambdaXbedrock, that turns are stored under session#<sessionId>,
+that a client sessionId shaped like a disconnect#/msg# key reads none of
+those records, and that a $disconnect marker stops an answer for that
+connection. Runs offline.
+
+    python cdk_backend/bench/check_session_store.py
+"""
+import json
+import os
+import sys
+
+HERE = os.path.dirname(__file__)
+sys.path.insert(0, HERE)
+
+import fakes  # noqa: E402
+from replay import CORPUS_DIR, _read  # noqa: E402
+
+TABLE = "sessions"
+SUPPORT = "Who is the support contact for this tool?"
+QUESTION = "What does a good data visualisation for programme managers look like?"
+
+
+def _send(ws_handler, connection_id: str, route: str = "sendMessage", **body) -> dict:
+    event = {"requestContext": {"routeKey": route, "connectionId": connection_id}}
+    if route == "sendMessage":
+        event["body"] = json.dumps({"action": "sendMessage", "role": "researchAssistant", **body})
+    return ws_handler.lambda_handler(event, None)
+
+
+def check_history_round_trip(index, ws_handler, f: fakes.Fakes, prompts: list):
+    _send(ws_handler, "c-1", prompt=SUPPORT, sessionId="s-1")
+    _send(ws_handler, "c-1", prompt=QUESTION, sessionId="s-1")
+    # the inline turn is the model's history for the follow-up
+    assert prompts[-1][:2] == [("user", SUPPORT), ("assistant", prompts[-1][1][1])], prompts[-1]
+    assert len(prompts[-1]) == 3, prompts[-1]
+    turns = index._SESSION_STORE.recent("s-1", 10)
+    assert [t["sentBy"] for t in turns] == ["USER", "BOT", "USER", "BOT"], turns
+    keys = {k[0] for k, item in f.dynamodb.tables[TABLE].items() if "sentBy" in item}
+    assert keys == {"session#s-1"}, keys
+
+
+def check_foreign_keys(index, ws_handler, f: fakes.Fakes, prompts: list):
+    _send(ws_handler, "c-2", "$disconnect")
+    index.lambda_handler({"connectionId": "c-3", "prompt": QUESTION, "messageId": "m-3"}, None)
+    for session_id in ("disconnect#c-2", "msg#m-3"):
+        assert index._SESSION_STORE.recent(session_id, 10) == [], session_id
+        _send(ws_handler, "c-4", prompt=QUESTION, sessionId=session_id)
+        assert len(prompts[-1]) == 1, prompts[-1]
+    assert not index._SESSION_STORE.is_disconnected("c-4")
+    assert index._IDEMPOTENCY_STORE.claim("m-3", 0)[0] == "duplicate"
+
+
+def check_disconnect_stops_answer(index, ws_handler, f: fakes.Fakes):
+    f.ws.take_frames()
+    _send(ws_handler, "c-5", prompt=QUESTION, sessionId="s-5")
+    full = [p for _, p in f.ws.take_frames("c-5")]
+    _send(ws_handler, "c-5", "$disconnect")
+    assert index._SESSION_STORE.is_disconnected("c-5")
+    _send(ws_handler, "c-5", prompt=QUESTION, sessionId="s-5")
+    cut = [p for _, p in f.ws.take_frames("c-5")]
+    assert len(cut) < len(full), (len(cut), len(full))
+    print(f"disconnect: frames {len(full)} -> {len(cut)}")
+
+
+def main():
+    index = fakes.load_index()
+    s3_objects = {
+        os.environ["RUNTIME_KB_KEY"]: _read(os.path.join(CORPUS_DIR, "runtime_kb.json")),
+        os.environ["PERSONAL_KB_KEY"]: _read(os.path.join(CORPUS_DIR, "personal_kb.json")),
+    }
+    f = fakes.install(index, fakes.FakeConfig(
+        tokens_per_sec=400, first_token_ms=0, converse_ms=0, retrieve_ms=0, post_ms=0,
+    ), s3_objects=s3_objects)
+    ws_handler = fakes.load_ws_handler(f)
+    ws_handler.lambda_client = fakes.FakeLambda(f.brt.conf, f.log, target=lambda p: index.lambda_handler(p, None))
+    f.use_dynamodb(index, TABLE, ws_handler=ws_handler)
+    index._Trace.emit = lambda trace: None
+    index.CANCEL_CHECK_SECONDS = 0.1
+
+    prompts = []
+    converse_stream = f.brt.converse_stream
+
+    def recording_converse_stream(**kwargs):
+        prompts.append([(m["role"], m["content"][0].get("text", "")) for m in kwargs["messages"]])
+        return converse_stream(**kwargs)
+
+    f.brt.converse_stream = recording_converse_stream
+    check_history_round_trip(index, ws_handler, f, prompts)
+    check_foreign_keys(index, ws_handler, f, prompts)
+    check_disconnect_stops_answer(index, ws_handler, f)
+    print("session store checks passed")
+
+
+if __name__ == "__main__":
+    main()
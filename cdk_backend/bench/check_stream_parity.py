@@ -0,0 +1,104 @@
+# cdk_backend/bench/check_stream_parity.py
+"""
+Parity check for the streaming markdown formatter.
+
+Feeds randomized answers through _MarkdownStreamTransformer at random delta
+boundaries and asserts the output is byte-identical to the batch pipeline:
+_linkify_bare_urls, then _emphasize_stats, then the sentence footnote pass
+(_annotate_sentences_with_links). Answers mix bare URLs, [label](url) links,
+unclosed brackets, percentages, number chains split across whitespace,
+decimals, ellipses and quoted sentence ends. Also checks that a stray '['
+is not held back past STREAM_LINK_HOLD_CHARS. Runs offline; no AWS calls.
+
+    python cdk_backend/bench/check_stream_parity.py [--cases 20000] [--seed 7]
+"""
+import argparse
+import os
+import random
+import sys
+
+HERE = os.path.dirname(__file__)
+sys.path.insert(0, HERE)
+sys.path.insert(0, os.path.join(HERE, "..", "lambda", "lambdaXbedrock"))
+sys.path.insert(0, os.path.join(HERE, "..", "lambda", "shared", "python"))
+
+import index  # noqa: E402
+import synthetic  # noqa: E402
+
+FOOTNOTE_URL = "https://www.hivinterchange.com/i2i/insight-2-implementation"
+
+FRAGMENTS = [
+    "prep", "coverage", "in", "Kenya", "and", "Uganda", "the", "data",
+    "72%", "1.2%", "12.5%", "1,234", "1,234.5%", "3.14", "12.20", "2023",
+    "95-95-95", "95 - 95 - 95", "2000–2023", "2000 – 2023", "73%-87%-81%", "10 -",
+    "https://www.who.int/data/gho", "https://aidsinfo.unaids.org/?q=1.",
+    "(https://example.org/a)", "<https://example.org/b>",
+    "[UNAIDS](https://unaids.org)", "[PHIA 2021](https://phia.icap.columbia.edu/x?id=7)",
+    "[not a link]", "[open", "](dangling)", "[x](", "a]b",
+    "...", "end.", "end!", "end?", 'said."', "it.)", "ok.’", "v2.0",
+    "\n\n", "\n- ", "\n1. ", "**bold**", "e.g.", "  ",
+]
+
+
+def random_answer(rng: random.Random) -> str:
+    if rng.random() < 0.25:
+        return synthetic.answer(rng.choice([256, 1024, 3000]), rng)
+    sep = lambda: rng.choice([" ", " ", " ", "\n", "", "  "])  # noqa: E731
+    return "".join(rng.choice(FRAGMENTS) + sep() for _ in range(rng.randint(1, 80)))
+
+
+def random_chunks(text: str, rng: random.Random) -> list[str]:
+    chunks, i = [], 0
+    while i < len(text):
+        n = rng.choice([1, 1, 2, 3, 5, 8, 13, 24, 40])
+        chunks.append(text[i:i + n])
+        i += n
+    return chunks
+
+
+def batch(text: str, footnote: bool, seed: int) -> str:
+    out = index._emphasize_stats(index._linkify_bare_urls(text))
+    if footnote:
+        random.seed(seed)
+        out, _ = index._annotate_sentences_with_links(out, FOOTNOTE_URL, 1)
+    return out
+
+
+def stream(chunks: list[str], footnote: bool, seed: int) -> str:
+    random.seed(seed)
+    t = index._MarkdownStreamTransformer(FOOTNOTE_URL if footnote else None, start_index=1)
+    out = [t.feed(c) for c in chunks]
+    out.append(t.finish())
+    return "".join(out)
+
+
+def check_bracket_hold():
+    """A '[' that never closes must not hold the rest of the answer until finish()."""
+    t = index._MarkdownStreamTransformer(None)
+    released = t.feed("see [the note ")
+    for _ in range(100):
+        released += t.feed("and more words ")
+    assert len(released) > 1000, len(released)
+    assert released + t.finish() == index._emphasize_stats("see [the note " + "and more words " * 100)
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    ap.add_argument("--cases", type=int, default=20000)
+    ap.add_argument("--seed", type=int, default=7)
+    args = ap.parse_args()
+
+    rng = random.Random(args.seed)
+    for case in range(args.cases):
+        text = random_answer(rng)
+        chunks = random_chunks(text, rng)
+        footnote = case % 2 == 0
+        expected = batch(text, footnote, case)
+        got = stream(chunks, footnote, case)
+        assert got == expected, f"case {case} footnote={footnote}\nchunks={chunks!r}\nexpected={expected!r}\ngot={got!r}"
+    check_bracket_hold()
+    print(f"cases={args.cases} seed={args.seed} mismatches=0")
+
+
+if __name__ == "__main__":
+    main()
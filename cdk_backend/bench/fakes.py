@@ -0,0 +1,778 @@
+# cdk_backend/bench/fakes.py
+"""
+Deterministic in-process stand-ins for the AWS clients lambdaXbedrock uses
+(bedrock-runtime, bedrock-agent-runtime, bedrock-agent, apigatewaymanagementapi,
+s3, lambda, dynamodb) plus an OpenSearch client for the COUNT route. Every call is counted in a shared CallLog; model latency, token
+rate and throttling are configurable so benches can shape the pipeline.
+ApiGatewayServer is a local HTTP PostToConnection endpoint for runs that
+should exercise the real network path.
+
+    fakes = install(index, FakeConfig(tokens_per_sec=60))
+"""
+import hashlib
+import io
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+from dataclasses import dataclass
+from decimal import Decimal
+
+from botocore.exceptions import ClientError, EventStreamError
+
+HERE = os.path.dirname(__file__)
+LAMBDA_DIR = os.path.join(HERE, "..", "lambda")
+# Where Lambda would find the layer code (/opt/python) when run locally.
+SHARED_DIR = os.path.join(LAMBDA_DIR, "shared", "python")
+
+# Environment lambdaXbedrock reads at import time; values only need to be non-empty.
+DEFAULT_ENV = {
+    "AWS_DEFAULT_REGION": "us-east-1",
+    "URL": "https://fake.execute-api.us-east-1.amazonaws.com/production",
+    "KNOWLEDGE_BASE_ID": "KBFAKE0001",
+    "DATA_SOURCE_ID": "DSFAKE0001",
+    "OPENSEARCH_INDEX": "bedrock-kb-fake",
+    "S3_BUCKET_NAME": "fake-doc-bucket",
+    "RUNTIME_KB_KEY": "runtime/runtime_kb.json",
+    "PERSONAL_KB_KEY": "runtime/personal_kb.json",
+}
+
+DOCS = [f"docs/report_{i}.pdf" for i in range(12)]
+
+
+def apply_env(env: dict | None = None):
+    for k, v in {**DEFAULT_ENV, **(env or {})}.items():
+        os.environ.setdefault(k, v)
+    for path in (os.path.join(LAMBDA_DIR, "lambdaXbedrock"), SHARED_DIR):
+        if path not in sys.path:
+            sys.path.insert(0, path)
+
+
+def load_index(env: dict | None = None):
+    """Import lambdaXbedrock/index.py with DEFAULT_ENV (+ env) applied first."""
+    apply_env(env)
+    import index
+    return index
+
+
+def _seed(*parts) -> int:
+    return int(hashlib.sha1("|".join(map(str, parts)).encode()).hexdigest()[:12], 16)
+
+
+def _throttle(op: str) -> ClientError:
+    return ClientError(
+        {"Error": {"Code": "ThrottlingException", "Message": "Rate exceeded"},
+         "ResponseMetadata": {"HTTPStatusCode": 429}},
+        op,
+    )
+
+
+def _stream_throttle() -> EventStreamError:
+    """What botocore raises from the event stream for a throttlingException event."""
+    return EventStreamError(
+        {"Error": {"Code": "throttlingException", "Message": "Too many tokens, please wait."}},
+        "ConverseStream",
+    )
+
+
+@dataclass
+class FakeConfig:
+    tokens_per_sec: float = 80.0     # streamed output rate
+    first_token_ms: float = 300.0    # converse_stream time to first token
+    converse_ms: float = 400.0       # non-streaming converse latency
+    retrieve_ms: float = 120.0
+    post_ms: float = 5.0             # post_to_connection latency
+    jitter: float = 0.0              # +/- fraction applied to every latency
+    throttle_rate: float = 0.0       # probability a model call is throttled
+    max_concurrency: int = 0         # model calls in flight beyond this are throttled (0 = unlimited)
+    stream_throttle_rate: float = 0.0  # probability a started stream fails on its first event
+    answer_bytes: int = 900
+    seed: int = 7
+
+
+class CallLog:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counts: dict[str, int] = {}
+
+    def add(self, op: str):
+        with self._lock:
+            self.counts[op] = self.counts.get(op, 0) + 1
+
+    def reset(self) -> dict:
+        with self._lock:
+            counts, self.counts = self.counts, {}
+        return counts
+
+
+class _Fake:
+    service = ""
+
+    def __init__(self, conf: FakeConfig, log: CallLog):
+        self.conf = conf
+        self.log = log
+        self.rng = random.Random(conf.seed)
+        self._rng_lock = threading.Lock()
+
+    def _call(self, op: str):
+        self.log.add(f"{self.service}.{op}")
+
+    def _sleep_ms(self, ms: float):
+        if ms <= 0:
+            return
+        if self.conf.jitter:
+            with self._rng_lock:
+                ms *= 1 + self.rng.uniform(-self.conf.jitter, self.conf.jitter)
+        time.sleep(ms / 1000.0)
+
+    def _throttled(self) -> bool:
+        if not self.conf.throttle_rate:
+            return False
+        with self._rng_lock:
+            return self.rng.random() < self.conf.throttle_rate
+
+
+def _last_user_text(kwargs: dict) -> str:
+    for msg in reversed(kwargs.get("messages") or []):
+        if msg.get("role") == "user":
+            return "".join(c.get("text", "") for c in msg.get("content") or [] if isinstance(c, dict))
+    return ""
+
+
+def _canned_answer(prompt: str, size: int) -> str:
+    rng = random.Random(_seed("answer", prompt))
+    sentences = []
+    while sum(len(s) + 1 for s in sentences) < size:
+        n = rng.randint(8, 18)
+        words = [rng.choice(["HIV", "PrEP", "coverage", "prevalence", "districts", "adolescents",
+                             "programmes", "testing", "estimates", "in", "the", "of", "and"])
+                 for _ in range(n)]
+        words.insert(rng.randrange(n), f"{rng.uniform(1, 95):.1f}%")
+        sentences.append(" ".join(words).capitalize() + ".")
+    return " ".join(sentences)
+
+
+class FakeBedrockRuntime(_Fake):
+    service = "bedrock-runtime"
+
+    def __init__(self, conf: FakeConfig, log: CallLog):
+        super().__init__(conf, log)
+        self._inflight = 0
+        self._inflight_lock = threading.Lock()
+        # modelId -> error code raised by every call to it (e.g. ValidationException)
+        self.model_errors: dict[str, str] = {}
+        # modelId -> number of upcoming streams that fail on their first event
+        self.stream_throttled: dict[str, int] = {}
+
+    def _admit(self, op: str, model_id: str = ""):
+        """Raise ThrottlingException like Bedrock does when over quota; else take a slot."""
+        code = self.model_errors.get(model_id)
+        if code:
+            self.log.add(f"{self.service}.{op}.{code}")
+            raise ClientError({"Error": {"Code": code, "Message": f"{model_id}: {code}"}}, op)
+        with self._inflight_lock:
+            over = self.conf.max_concurrency and self._inflight >= self.conf.max_concurrency
+            if not over and not self._throttled():
+                self._inflight += 1
+                return
+        self.log.add(f"{self.service}.{op}.throttled")
+        raise _throttle(op)
+
+    def _release(self):
+        with self._inflight_lock:
+            self._inflight -= 1
+
+    def converse_stream(self, **kwargs):
+        self._call("converse_stream")
+        model_id = kwargs.get("modelId", "")
+        self._admit("ConverseStream", model_id)
+        text = _canned_answer(_last_user_text(kwargs)[-400:], self.conf.answer_bytes)
+        tokens = [text[i:i + 4] for i in range(0, len(text), 4)]
+        with self._rng_lock:
+            stream_throttled = self.stream_throttled.get(model_id, 0) > 0 or (
+                self.conf.stream_throttle_rate and self.rng.random() < self.conf.stream_throttle_rate
+            )
+            if self.stream_throttled.get(model_id):
+                self.stream_throttled[model_id] -= 1
+
+        def events():
+            t0 = time.perf_counter()
+            try:
+                self._sleep_ms(self.conf.first_token_ms)
+                if stream_throttled:
+                    self.log.add(f"{self.service}.converse_stream.stream_throttled")
+                    raise _stream_throttle()
+                for tok in tokens:
+                    yield {"contentBlockDelta": {"delta": {"text": tok}, "contentBlockIndex": 0}}
+                    self._sleep_ms(1000.0 / self.conf.tokens_per_sec if self.conf.tokens_per_sec else 0)
+                yield {"messageStop": {"stopReason": "end_turn"}}
+                yield {"metadata": {
+                    "usage": {"inputTokens": len(json.dumps(kwargs)) // 4, "outputTokens": len(tokens)},
+                    "metrics": {"latencyMs": int((time.perf_counter() - t0) * 1000)},
+                }}
+            finally:
+                self._release()
+        return {"stream": events()}
+
+    def converse(self, **kwargs):
+        self._call("converse")
+        self._admit("Converse", kwargs.get("modelId", ""))
+        try:
+            self._sleep_ms(self.conf.converse_ms)
+        finally:
+            self._release()
+        user = _last_user_text(kwargs)
+        if "Docs:" in user:
+            docs = json.loads(user.split("Docs:", 1)[1]).get("docs", [])
+            names = [d.get("name") or d.get("key") or "" for d in docs if isinstance(d, dict)]
+            text = json.dumps({"reasons": {n: "covers the figures asked about" for n in names if n}})
+        else:
+            text = "Here are a few additional resources you might find useful."
+        return {
+            "output": {"message": {"role": "assistant", "content": [{"text": text}]}},
+            "usage": {"inputTokens": len(user) // 4, "outputTokens": len(text) // 4},
+            "metrics": {"latencyMs": int(self.conf.converse_ms)},
+        }
+
+
+class FakeAgentRuntime(_Fake):
+    service = "bedrock-agent-runtime"
+
+    def retrieve(self, **kwargs):
+        self._call("retrieve")
+        self._sleep_ms(self.conf.retrieve_ms)
+        query = (kwargs.get("retrievalQuery") or {}).get("text", "")
+        k = ((kwargs.get("retrievalConfiguration") or {}).get("vectorSearchConfiguration") or {}).get("numberOfResults", 10)
+        rng = random.Random(_seed("retrieve", query))
+        docs = sorted(DOCS, key=lambda d: (os.path.basename(d) not in query, rng.random()))
+        bucket = os.environ.get("S3_BUCKET_NAME", "fake-doc-bucket")
+        results = []
+        for i in range(k):
+            doc = docs[i % 4]
+            results.append({
+                "content": {"text": _canned_answer(f"{query}-{i}", 300)},
+                "location": {"type": "S3", "s3Location": {"uri": f"s3://{bucket}/{doc}"}},
+                "metadata": {"x-amz-bedrock-kb-document-page-number": float(rng.randint(1, 40))},
+                "score": round(0.9 - i * 0.02, 4),
+            })
+        return {"retrievalResults": results}
+
+
+class FakeBedrockAgent(_Fake):
+    service = "bedrock-agent"
+
+    def __init__(self, conf: FakeConfig, log: CallLog):
+        super().__init__(conf, log)
+        # newest COMPLETE job; replace it to simulate a finished re-ingestion
+        self.latest_job = {"ingestionJobId": "JOB1", "status": "COMPLETE", "updatedAt": "2026-01-01T00:00:00Z"}
+
+    def list_ingestion_jobs(self, **kwargs):
+        self._call("list_ingestion_jobs")
+        return {"ingestionJobSummaries": [dict(self.latest_job)]}
+
+
+def default_chunks(text_field: str, doc_field: str, page_field: str) -> list[dict]:
+    """KB index chunks over DOCS: a few pages each, some mentioning cabotegravir or PrEP."""
+    bucket = DEFAULT_ENV["S3_BUCKET_NAME"]
+    chunks = []
+    for i, doc in enumerate(DOCS):
+        for page in range(1, 9):
+            text = _canned_answer(f"{doc}-{page}", 200)
+            if (i + page) % 5 == 0:
+                text += " Long-acting cabotegravir was approved."
+            if i % 3 == 0 and page % 2:
+                text += " Oral PrEP uptake rose."
+            chunks.append({text_field: text, doc_field: f"s3://{bucket}/{doc}", page_field: float(page)})
+    return chunks
+
+
+class FakeOpenSearch(_Fake):
+    """
+    opensearchpy.OpenSearch.search over an in-memory list of chunk documents.
+    Understands what the COUNT route sends: match_phrase (case-insensitive,
+    whitespace-normalized) plus nested terms / cardinality aggregations.
+    Every request body is kept in `bodies`.
+    """
+    service = "opensearch"
+
+    def __init__(self, conf: FakeConfig, log: CallLog, chunks: list[dict] | None = None):
+        super().__init__(conf, log)
+        self.chunks = chunks
+        self.bodies: list[dict] = []
+
+    @staticmethod
+    def _matches(chunk: dict, query: dict) -> bool:
+        if not query or "match_all" in query:
+            return True
+        (field, phrase), = query["match_phrase"].items()
+        norm = lambda s: " ".join(str(s).lower().split())  # noqa: E731
+        return f" {norm(phrase)} " in f" {norm(chunk.get(field, ''))} "
+
+    def _aggregate(self, docs: list[dict], aggs: dict) -> dict:
+        out = {}
+        for name, spec in (aggs or {}).items():
+            if "cardinality" in spec:
+                field = spec["cardinality"]["field"]
+                out[name] = {"value": len({d[field] for d in docs if field in d})}
+            elif "terms" in spec:
+                field, size = spec["terms"]["field"], spec["terms"].get("size", 10)
+                groups: dict = {}
+                for d in docs:
+                    if field in d:
+                        groups.setdefault(d[field], []).append(d)
+                # OpenSearch orders terms buckets by doc_count desc, then key
+                ranked = sorted(groups.items(), key=lambda kv: (-len(kv[1]), str(kv[0])))[:size]
+                out[name] = {"buckets": [
+                    {"key": key, "doc_count": len(group), **self._aggregate(group, spec.get("aggs"))}
+                    for key, group in ranked
+                ]}
+        return out
+
+    def search(self, index=None, body=None, **_):
+        self._call("search")
+        self.bodies.append(body)
+        hits = [c for c in self.chunks or [] if self._matches(c, (body or {}).get("query"))]
+        return {
+            "hits": {"total": {"value": len(hits), "relation": "eq"}, "hits": [] if body.get("size") == 0 else hits},
+            "aggregations": self._aggregate(hits, body.get("aggs")),
+        }
+
+
+class FakeApiGateway(_Fake):
+    """apigatewaymanagementapi: records every posted frame with its time."""
+    service = "apigatewaymanagementapi"
+
+    def __init__(self, conf: FakeConfig, log: CallLog):
+        super().__init__(conf, log)
+        self._lock = threading.Lock()
+        self.frames: list[tuple[float, str, dict]] = []
+        self.gone: set[str] = set()
+
+    def post_to_connection(self, ConnectionId, Data):
+        self._call("post_to_connection")
+        if ConnectionId in self.gone:
+            raise ClientError(
+                {"Error": {"Code": "GoneException"}, "ResponseMetadata": {"HTTPStatusCode": 410}},
+                "PostToConnection",
+            )
+        self._sleep_ms(self.conf.post_ms)
+        with self._lock:
+            self.frames.append((time.perf_counter(), ConnectionId, json.loads(Data)))
+
+    def take_frames(self, connection_id: str | None = None) -> list[tuple[float, dict]]:
+        with self._lock:
+            keep, taken = [], []
+            for t, cid, payload in self.frames:
+                (taken if connection_id in (None, cid) else keep).append((t, payload))
+            self.frames = keep
+        return taken
+
+
+class ApiGatewayServer:
+    """
+    Local HTTP endpoint speaking the apigatewaymanagementapi PostToConnection
+    wire format (POST <stage>/@connections/<id>, raw body). Point URL at
+    `endpoint` and the real boto3 client works against it. Connections in
+    `gone` get a 410 GoneException.
+    """
+
+    def __init__(self, on_frame=None, stage: str = "production"):
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        from urllib.parse import unquote
+
+        outer = self
+        self.on_frame = on_frame
+        self.gone: set[str] = set()
+        self.posts = 0
+        self._lock = threading.Lock()
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+                cid = unquote(self.path.split("/@connections/", 1)[-1].split("?", 1)[0])
+                with outer._lock:
+                    outer.posts += 1
+                if cid in outer.gone:
+                    self._reply(410, b'{"message": "GoneException"}', {"x-amzn-ErrorType": "GoneException"})
+                    return
+                if outer.on_frame:
+                    outer.on_frame(cid, time.perf_counter(), json.loads(body or b"{}"))
+                self._reply(200, b"")
+
+            def _reply(self, status: int, body: bytes, headers: dict | None = None):
+                self.send_response(status)
+                for k, v in (headers or {}).items():
+                    self.send_header(k, v)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *_):
+                pass
+
+        class Server(ThreadingHTTPServer):
+            request_queue_size = 1024  # hundreds of senders connect at once under load
+
+        self._server = Server(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        self.endpoint = f"http://127.0.0.1:{self._server.server_port}/{stage}"
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *_):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+class HttpApiGateway:
+    """Minimal urllib PostToConnection client for ApiGatewayServer, for hosts without boto3."""
+
+    def __init__(self, endpoint: str, log: CallLog | None = None, timeout: float = 10.0):
+        self.endpoint = endpoint.rstrip("/")
+        self.log = log
+        self.timeout = timeout
+
+    def post_to_connection(self, ConnectionId, Data):
+        import urllib.error
+        import urllib.parse
+        import urllib.request
+
+        if self.log:
+            self.log.add("apigatewaymanagementapi.post_to_connection")
+        data = Data.encode("utf-8") if isinstance(Data, str) else Data
+        req = urllib.request.Request(
+            f"{self.endpoint}/@connections/{urllib.parse.quote(ConnectionId, safe='')}",
+            data=data, method="POST",
+        )
+        try:
+            with urllib.request.urlopen(req, timeout=self.timeout) as resp:
+                resp.read()
+        except urllib.error.HTTPError as e:
+            code = e.headers.get("x-amzn-ErrorType") or str(e.code)
+            raise ClientError(
+                {"Error": {"Code": code}, "ResponseMetadata": {"HTTPStatusCode": e.code}},
+                "PostToConnection",
+            ) from None
+
+
+class FakeS3(_Fake):
+    service = "s3"
+
+    def __init__(self, conf: FakeConfig, log: CallLog, objects: dict[str, bytes] | None = None):
+        super().__init__(conf, log)
+        self.objects = dict(objects or {})
+
+    def get_object(self, Bucket, Key, IfNoneMatch=None, **_):
+        self._call("get_object")
+        if Key not in self.objects:
+            raise ClientError({"Error": {"Code": "NoSuchKey"}}, "GetObject")
+        body = self.objects[Key]
+        etag = hashlib.md5(body).hexdigest()
+        if IfNoneMatch and IfNoneMatch.strip('"') == etag:
+            raise ClientError({"Error": {"Code": "304"}}, "GetObject")
+        return {"Body": io.BytesIO(body), "ETag": f'"{etag}"'}
+
+    def put_object(self, Bucket, Key, Body, **_):
+        self._call("put_object")
+        self.objects[Key] = Body.encode("utf-8") if isinstance(Body, str) else Body
+        return {}
+
+    def generate_presigned_url(self, op, Params=None, ExpiresIn=3600):
+        self._call("generate_presigned_url")
+        p = Params or {}
+        return f"https://{p.get('Bucket')}.s3.amazonaws.com/{p.get('Key')}?X-Amz-Expires={ExpiresIn}&X-Amz-Signature=fake"
+
+
+_DDB_TOKEN_RE = re.compile(r"\s*(<=|>=|<>|[=<>(),]|[#:]?[A-Za-z_][\w.\-]*)")
+
+
+class _DdbExpr:
+    """
+    Just enough of the DynamoDB expression language for the calls lambdaXbedrock
+    and web-socket-handler make: AND / OR / NOT, parentheses, comparisons and
+    attribute_exists / attribute_not_exists.
+    """
+
+    def __init__(self, text: str, names: dict | None, values: dict | None):
+        self.tokens = _DDB_TOKEN_RE.findall(text)
+        self.names = names or {}
+        self.values = values or {}
+        self.pos = 0
+
+    def _next(self) -> str:
+        tok = self.tokens[self.pos]
+        self.pos += 1
+        return tok
+
+    def _peek(self) -> str:
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else ""
+
+    def name(self, tok: str) -> str:
+        return self.names[tok] if tok.startswith("#") else tok
+
+    def _operand(self, item: dict):
+        tok = self._next()
+        attr = self.values[tok] if tok.startswith(":") else item.get(self.name(tok))
+        if attr is None:
+            return None
+        (kind, v), = attr.items()
+        return Decimal(v) if kind == "N" else v
+
+    def evaluate(self, item: dict) -> bool:
+        self.pos = 0
+        result = self._or(item)
+        assert self.pos == len(self.tokens), f"unparsed expression tail: {self.tokens[self.pos:]}"
+        return result
+
+    def _or(self, item):
+        result = self._and(item)
+        while self._peek().upper() == "OR":
+            self._next()
+            result = self._and(item) or result
+        return result
+
+    def _and(self, item):
+        result = self._not(item)
+        while self._peek().upper() == "AND":
+            self._next()
+            result = self._not(item) and result
+        return result
+
+    def _not(self, item):
+        if self._peek().upper() == "NOT":
+            self._next()
+            return not self._not(item)
+        if self._peek() == "(":
+            self._next()
+            result = self._or(item)
+            assert self._next() == ")"
+            return result
+        if self._peek() in ("attribute_exists", "attribute_not_exists"):
+            fn = self._next()
+            assert self._next() == "("
+            present = self.name(self._next()) in item
+            assert self._next() == ")"
+            return present if fn == "attribute_exists" else not present
+        left = self._operand(item)
+        op = self._next()
+        right = self._operand(item)
+        if left is None or right is None:
+            return op == "<>" and left != right
+        return {
+            "=": left == right, "<>": left != right, "<": left < right,
+            "<=": left <= right, ">": left > right, ">=": left >= right,
+        }[op]
+
+
+class FakeDynamoDB(_Fake):
+    """
+    One or more tables keyed by (hash, range) attribute values, with the
+    conditional writes, SET/REMOVE updates, key-condition queries and
+    batch_write_item (optionally leaving a fraction of items unprocessed)
+    that the session, disconnect-marker and idempotency code relies on.
+    """
+    service = "dynamodb"
+
+    def __init__(self, conf: FakeConfig, log: CallLog, hash_key: str = "sessionId", range_key: str = "seq"):
+        super().__init__(conf, log)
+        self.hash_key = hash_key
+        self.range_key = range_key
+        self.tables: dict[str, dict[tuple, dict]] = {}
+        self.unprocessed_rate = 0.0
+        self.bytes_written = 0
+        self._lock = threading.Lock()
+
+    def _key(self, item: dict) -> tuple:
+        return tuple(next(iter(item[k].values())) for k in (self.hash_key, self.range_key))
+
+    def _written(self, item: dict):
+        self.bytes_written += len(json.dumps(item))
+
+    def _check(self, item: dict, kwargs: dict):
+        cond = kwargs.get("ConditionExpression")
+        if cond and not _DdbExpr(
+            cond, kwargs.get("ExpressionAttributeNames"), kwargs.get("ExpressionAttributeValues")
+        ).evaluate(item):
+            raise ClientError(
+                {"Error": {"Code": "ConditionalCheckFailedException", "Message": "The conditional request failed"}},
+                "ConditionalCheck",
+            )
+
+    def put_item(self, TableName, Item, ReturnValues="NONE", **kwargs):
+        self._call("put_item")
+        with self._lock:
+            table = self.tables.setdefault(TableName, {})
+            old = table.get(self._key(Item))
+            self._check(old or {}, kwargs)
+            table[self._key(Item)] = json.loads(json.dumps(Item))
+            self._written(Item)
+        return {"Attributes": old} if old and ReturnValues == "ALL_OLD" else {}
+
+    def update_item(self, TableName, Key, UpdateExpression, **kwargs):
+        self._call("update_item")
+        names = kwargs.get("ExpressionAttributeNames") or {}
+        values = kwargs.get("ExpressionAttributeValues") or {}
+        with self._lock:
+            table = self.tables.setdefault(TableName, {})
+            item = dict(table.get(self._key(Key)) or Key)
+            self._check(table.get(self._key(Key)) or {}, kwargs)
+            for clause, body in re.findall(r"\b(SET|REMOVE)\s+(.*?)(?=\s+\b(?:SET|REMOVE)\b|$)", UpdateExpression):
+                for part in body.split(","):
+                    if clause == "SET":
+                        path, value = (p.strip() for p in part.split("="))
+                        item[names.get(path, path)] = values[value]
+                    else:
+                        item.pop(names.get(part.strip(), part.strip()), None)
+            table[self._key(Key)] = item
+            self._written(item)
+        return {}
+
+    def get_item(self, TableName, Key, **_):
+        self._call("get_item")
+        item = self.tables.get(TableName, {}).get(self._key(Key))
+        return {"Item": item} if item else {}
+
+    def query(self, TableName, KeyConditionExpression, ExpressionAttributeValues,
+              ScanIndexForward=True, Limit=None, ExpressionAttributeNames=None, **_):
+        self._call("query")
+        expr = _DdbExpr(KeyConditionExpression, ExpressionAttributeNames, ExpressionAttributeValues)
+        with self._lock:
+            items = [it for it in self.tables.get(TableName, {}).values() if expr.evaluate(it)]
+        items.sort(key=lambda it: Decimal(it[self.range_key]["N"]), reverse=not ScanIndexForward)
+        return {"Items": items[:Limit] if Limit else items}
+
+    def batch_write_item(self, RequestItems):
+        self._call("batch_write_item")
+        unprocessed: dict[str, list] = {}
+        for table_name, requests in RequestItems.items():
+            for req in requests:
+                with self._rng_lock:
+                    skip = self.unprocessed_rate and self.rng.random() < self.unprocessed_rate
+                if skip:
+                    unprocessed.setdefault(table_name, []).append(req)
+                    continue
+                item = req["PutRequest"]["Item"]
+                with self._lock:
+                    self.tables.setdefault(table_name, {})[self._key(item)] = item
+                    self._written(item)
+        return {"UnprocessedItems": unprocessed}
+
+
+class FakeLambda(_Fake):
+    """lambda.invoke(InvocationType='Event'): hands the payload to `target` (or just records it)."""
+    service = "lambda"
+
+    def __init__(self, conf: FakeConfig, log: CallLog, target=None):
+        super().__init__(conf, log)
+        self.target = target
+        self.payloads: list[dict] = []
+
+    def invoke(self, FunctionName, InvocationType="RequestResponse", Payload=b"{}", **_):
+        self._call("invoke")
+        payload = json.loads(Payload)
+        self.payloads.append(payload)
+        if self.target:
+            self.target(payload)
+        return {"StatusCode": 202 if InvocationType == "Event" else 200}
+
+
+@dataclass
+class Fakes:
+    log: CallLog
+    brt: FakeBedrockRuntime
+    agent_rt: FakeAgentRuntime
+    bedrock_agent: FakeBedrockAgent
+    ws: FakeApiGateway | HttpApiGateway
+    s3: FakeS3
+    opensearch: FakeOpenSearch | None = None
+    dynamodb: FakeDynamoDB | None = None
+
+    def attach(self, index):
+        """Point index's AWS clients at these fakes (several index copies may share them)."""
+        index.brt = self.brt
+        index.agent_rt = self.agent_rt
+        index._bedrock_agent = self.bedrock_agent
+        index.ws = self.ws
+        index.s3 = self.s3
+        if self.opensearch is not None:
+            index._os = self.opensearch
+            if self.opensearch.chunks is None:
+                cfg = index.cfg
+                self.opensearch.chunks = default_chunks(
+                    cfg.OPENSEARCH_TEXT_FIELD, cfg.OPENSEARCH_DOC_ID_FIELD, cfg.OPENSEARCH_PAGE_FIELD
+                )
+
+    def use_dynamodb(self, index, table: str = "sessions", ws_handler=None):
+        """
+        Back index's session and idempotency stores with the fake table, as
+        SESSION_TABLE_NAME would; with `ws_handler`, its inline turns and
+        disconnect markers go to the same table.
+        """
+        index._SESSION_STORE = index._DynamoSessionStore(table, index.SESSION_TTL_SECONDS)
+        index._IDEMPOTENCY_STORE = index._DynamoIdempotencyStore(table, index.IDEMPOTENCY_TTL_SECONDS)
+        for store in (index._SESSION_STORE, index._IDEMPOTENCY_STORE):
+            store._ddb = self.dynamodb
+        if ws_handler is not None:
+            ws_handler.SESSION_TABLE_NAME = table
+            ws_handler.dynamodb = self.dynamodb
+
+
+def install(index, conf: FakeConfig | None = None, s3_objects: dict[str, bytes] | None = None) -> Fakes:
+    """Swap index's AWS clients for fakes sharing one CallLog."""
+    conf = conf or FakeConfig()
+    log = CallLog()
+    fakes = Fakes(
+        log=log,
+        brt=FakeBedrockRuntime(conf, log),
+        agent_rt=FakeAgentRuntime(conf, log),
+        bedrock_agent=FakeBedrockAgent(conf, log),
+        ws=FakeApiGateway(conf, log),
+        s3=FakeS3(conf, log, s3_objects),
+        opensearch=FakeOpenSearch(conf, log),
+        dynamodb=FakeDynamoDB(conf, log),
+    )
+    fakes.attach(index)
+    return fakes
+
+
+def load_index_copy(name: str):
+    """
+    Fresh copy of lambdaXbedrock/index.py under `name`. Its module globals
+    (per-invocation trace, usage ledger, senders, caches) are private to the
+    copy, which is what a separate Lambda container gives each invocation.
+    """
+    import importlib.util
+    apply_env()
+    spec = importlib.util.spec_from_file_location(name, os.path.join(LAMBDA_DIR, "lambdaXbedrock", "index.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def load_ws_handler(fakes: "Fakes | None" = None):
+    """
+    Import web-socket-handler/index.py under its own module name. With `fakes`,
+    its inline intercept path reads KBs from fakes.s3 and posts to fakes.ws.
+    """
+    import importlib.util
+    apply_env()
+    os.environ.setdefault("RESPONSE_FUNCTION_ARN", "arn:aws:lambda:us-east-1:000000000000:function:fake")
+    spec = importlib.util.spec_from_file_location(
+        "ws_handler", os.path.join(LAMBDA_DIR, "web-socket-handler", "index.py")
+    )
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    if fakes is not None:
+        module.intercept_kbs.s3 = fakes.s3
+        module.intercept_kbs.bucket = os.environ["S3_BUCKET_NAME"]
+        module.ws_client = lambda event: fakes.ws
+    return module
@@ -0,0 +1,358 @@
+# cdk_backend/bench/load_test.py
+"""
+Concurrent load test of the WebSocket -> web-socket-handler -> lambdaXbedrock
+path, entirely local.
+
+N conversations run concurrently on an asyncio loop. Each turn calls the
+real web-socket-handler, whose `lambda_client.invoke(InvocationType='Event')`
+is an in-process async dispatcher: it returns 202 at once and runs the
+payload on a pool of simulated Lambda containers, each a private copy of
+lambdaXbedrock/index.py, up to --containers of them (the reserved concurrency).
+Frames travel over HTTP to a local apigatewaymanagementapi endpoint; Bedrock
+is the streaming fake from fakes.py with configurable latency, jitter,
+throttle probability and a concurrency quota.
+
+Reports TTFT (first frame) and turn latency p50/p95/p99 overall, per route
+and per conversation, plus error, timeout and throttle rates.
+
+    python cdk_backend/bench/load_test.py --conversations 200 --turns 3 --throttle-rate 0.05 [--json out.json]
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import statistics
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+HERE = os.path.dirname(__file__)
+sys.path.insert(0, HERE)
+
+import fakes  # noqa: E402
+from replay import CORPUS_DIR, _read, load_corpus  # noqa: E402
+
+
+def pct(values: list[float], p: float) -> float | None:
+    if not values:
+        return None
+    s = sorted(values)
+    return s[min(len(s) - 1, max(0, round(p / 100 * len(s)) - 1))]
+
+
+class FrameCollector:
+    """on_frame callback for ApiGatewayServer; resolves a future per turn on its `end` frame."""
+
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        self.loop = loop
+        self._lock = threading.Lock()
+        self._frames: dict[str, list[tuple[float, dict]]] = {}
+        self._waiters: dict[str, asyncio.Future] = {}
+
+    def expect(self, cid: str) -> asyncio.Future:
+        fut = self.loop.create_future()
+        with self._lock:
+            self._frames[cid] = []
+            self._waiters[cid] = fut
+        return fut
+
+    def on_frame(self, cid: str, t: float, payload: dict):
+        with self._lock:
+            frames = self._frames.setdefault(cid, [])
+            frames.append((t, payload))
+            fut = self._waiters.pop(cid, None) if payload.get("type") == "end" else None
+        if fut is not None:
+            self.loop.call_soon_threadsafe(lambda: fut.done() or fut.set_result(list(frames)))
+
+
+class Container:
+    """One warm Lambda execution environment: a private index copy, one invocation at a time."""
+
+    def __init__(self, n: int, shared: fakes.Fakes):
+        self.index = fakes.load_index_copy(f"lambdaXbedrock_c{n}")
+        shared.attach(self.index)
+        self.last_emf: dict = {}
+        container = self
+
+        def emit(trace):
+            container.last_emf = trace.emf()
+
+        self.index._Trace.emit = emit
+
+    def invoke(self, payload: dict) -> str:
+        self.last_emf = {}
+        self.index.lambda_handler(payload, None)
+        return self.last_emf.get("Route", "")
+
+
+class EventDispatcher:
+    """
+    lambda.invoke(InvocationType='Event') stand-in. invoke() is called from the
+    websocket handler's thread, returns 202 and schedules the payload on the
+    loop; containers are reused when idle and created (cold start) up to
+    `max_containers`, after which invocations queue. Failed invocations are
+    retried `max_retries` times like Lambda async invokes.
+    """
+
+    def __init__(self, loop, executor, make_container, max_containers: int,
+                 max_retries: int = 2, retry_delay: float = 1.0):
+        self.loop = loop
+        self.executor = executor
+        self.make_container = make_container
+        self.max_containers = max_containers
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.inflight: dict[str, asyncio.Task] = {}
+        self.stats = {"invocations": 0, "cold_starts": 0, "retries": 0, "failed": 0, "max_queue_wait_ms": 0.0}
+        self._idle: asyncio.Queue = asyncio.Queue()
+        self._created = 0
+
+    def invoke(self, FunctionName, InvocationType="RequestResponse", Payload=b"{}", **_):
+        payload = json.loads(Payload)
+        self.loop.call_soon_threadsafe(self._start, payload)
+        return {"StatusCode": 202}
+
+    def _start(self, payload: dict):
+        self.inflight[payload.get("connectionId") or ""] = self.loop.create_task(self._dispatch(payload))
+
+    async def _acquire(self):
+        if self._idle.empty() and self._created < self.max_containers:
+            self._created += 1
+            self.stats["cold_starts"] += 1
+            return await self.loop.run_in_executor(self.executor, self.make_container, self._created)
+        return await self._idle.get()
+
+    async def _dispatch(self, payload: dict) -> str:
+        for attempt in range(self.max_retries + 1):
+            t0 = time.perf_counter()
+            container = await self._acquire()
+            self.stats["max_queue_wait_ms"] = max(self.stats["max_queue_wait_ms"], (time.perf_counter() - t0) * 1000)
+            self.stats["invocations"] += 1
+            try:
+                return await self.loop.run_in_executor(self.executor, container.invoke, payload)
+            except Exception:
+                if attempt == self.max_retries:
+                    self.stats["failed"] += 1
+                    return "failed"
+                self.stats["retries"] += 1
+            finally:
+                self._idle.put_nowait(container)
+            await asyncio.sleep(self.retry_delay)
+        return "failed"
+
+    async def settled(self, cid: str) -> str:
+        """Route of the invocation forwarded for this connection's last turn ('' if none was)."""
+        task = self.inflight.pop(cid, None)
+        return await task if task else ""
+
+
+async def conversation(i: int, args, corpus: list[dict], ws_handler, collector: FrameCollector,
+                       dispatcher: EventDispatcher, executor) -> list[dict]:
+    loop = asyncio.get_running_loop()
+    rng = random.Random(args.seed + i)
+    cid = f"load-{i:04d}"
+    turns = []
+    await asyncio.sleep(rng.uniform(0, args.ramp))
+    for turn in range(args.turns):
+        case = corpus[(i + turn) % len(corpus)]
+        event = json.loads(json.dumps(case["event"]))
+        event["requestContext"]["connectionId"] = cid
+        waiter = collector.expect(cid)
+
+        t0 = time.perf_counter()
+        resp = await loop.run_in_executor(executor, ws_handler.lambda_handler, event, None)
+        result = {"conversation": i, "turn": turn, "case": case.get("name", ""), "route": "",
+                  "ttft_ms": None, "latency_ms": None, "status": resp.get("statusCode"), "outcome": "ok"}
+        try:
+            frames = await asyncio.wait_for(waiter, args.turn_timeout)
+        except asyncio.TimeoutError:
+            result["outcome"] = "timeout"
+            frames = []
+        if frames:
+            result["ttft_ms"] = (frames[0][0] - t0) * 1000
+            result["latency_ms"] = (frames[-1][0] - t0) * 1000
+            end = frames[-1][1]
+            result["status"] = end.get("statusCode")
+            # 501 is a route disabled by configuration (e.g. COUNT without OpenSearch), not a failure.
+            if (end.get("statusCode") or 0) >= 500 and end.get("statusCode") != 501:
+                result["outcome"] = "error"
+        result["route"] = await dispatcher.settled(cid) or "inline"
+        turns.append(result)
+        await asyncio.sleep(rng.uniform(0, 2 * args.think_time))
+    return turns
+
+
+def _dist(values: list[float]) -> dict:
+    return {
+        "n": len(values),
+        "p50": pct(values, 50),
+        "p95": pct(values, 95),
+        "p99": pct(values, 99),
+        "max": max(values) if values else None,
+    }
+
+
+def report(turns: list[dict], shared: fakes.Fakes, dispatcher: EventDispatcher, wall_s: float) -> dict:
+    ok = [t for t in turns if t["outcome"] == "ok"]
+    by_route: dict[str, list[dict]] = {}
+    for t in turns:
+        by_route.setdefault(t["route"], []).append(t)
+    per_conv: dict[int, list[float]] = {}
+    for t in ok:
+        if t["ttft_ms"] is not None:
+            per_conv.setdefault(t["conversation"], []).append(t["ttft_ms"])
+    calls = shared.log.reset()
+    model_calls = calls.get("bedrock-runtime.converse_stream", 0) + calls.get("bedrock-runtime.converse", 0)
+    throttles = calls.get("bedrock-runtime.ConverseStream.throttled", 0) + calls.get("bedrock-runtime.Converse.throttled", 0)
+    return {
+        "turns": len(turns),
+        "wall_s": wall_s,
+        "turns_per_s": len(turns) / wall_s if wall_s else None,
+        "ttft_ms": _dist([t["ttft_ms"] for t in ok if t["ttft_ms"] is not None]),
+        "latency_ms": _dist([t["latency_ms"] for t in ok if t["latency_ms"] is not None]),
+        "per_conversation_mean_ttft_ms": _dist([statistics.fmean(v) for v in per_conv.values()]),
+        "error_rate": sum(t["outcome"] == "error" for t in turns) / len(turns),
+        "timeout_rate": sum(t["outcome"] == "timeout" for t in turns) / len(turns),
+        "non_2xx_rate": sum((t["status"] or 0) >= 400 for t in turns) / len(turns),
+        "model_throttle_rate": throttles / model_calls if model_calls else 0.0,
+        "routes": {
+            route: {
+                "turns": len(ts),
+                "ttft_ms": _dist([t["ttft_ms"] for t in ts if t["ttft_ms"] is not None and t["outcome"] == "ok"]),
+                "error_rate": sum(t["outcome"] != "ok" for t in ts) / len(ts),
+            }
+            for route, ts in sorted(by_route.items())
+        },
+        "dispatcher": dispatcher.stats,
+        "aws_calls": calls,
+    }
+
+
+def _fmt(d: dict) -> str:
+    cells = [f"{k}={d[k]:.0f}" for k in ("p50", "p95", "p99", "max") if d.get(k) is not None]
+    return f"n={d['n']} " + " ".join(cells)
+
+
+def print_report(r: dict):
+    print(f"turns={r['turns']} wall={r['wall_s']:.1f}s throughput={r['turns_per_s']:.1f} turns/s")
+    print(f"TTFT ms        {_fmt(r['ttft_ms'])}")
+    print(f"latency ms     {_fmt(r['latency_ms'])}")
+    print(f"conv mean TTFT {_fmt(r['per_conversation_mean_ttft_ms'])}")
+    print(
+        f"errors={r['error_rate']:.2%} timeouts={r['timeout_rate']:.2%} non-2xx={r['non_2xx_rate']:.2%} "
+        f"model throttles={r['model_throttle_rate']:.2%} of calls"
+    )
+    for route, s in r["routes"].items():
+        print(f"  {route:<13} turns={s['turns']:<5} errors={s['error_rate']:.2%}  TTFT {_fmt(s['ttft_ms'])}")
+    d = r["dispatcher"]
+    print(
+        f"dispatcher: invocations={d['invocations']} cold_starts={d['cold_starts']} retries={d['retries']} "
+        f"failed={d['failed']} max_queue_wait={d['max_queue_wait_ms']:.0f}ms"
+    )
+
+
+def _ws_client(kind: str, endpoint: str, log: fakes.CallLog):
+    if kind == "boto3":
+        import boto3
+        os.environ.setdefault("AWS_ACCESS_KEY_ID", "fake")
+        os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "fake")
+        return boto3.client("apigatewaymanagementapi", endpoint_url=endpoint)
+    return fakes.HttpApiGateway(endpoint, log)
+
+
+async def run(args) -> dict:
+    loop = asyncio.get_running_loop()
+    corpus = [c for c in load_corpus(args.corpus) if not args.only or args.only in c.get("name", "")]
+    collector = FrameCollector(loop)
+    conf = fakes.FakeConfig(
+        tokens_per_sec=args.tokens_per_sec,
+        first_token_ms=args.first_token_ms,
+        converse_ms=args.converse_ms,
+        retrieve_ms=args.retrieve_ms,
+        jitter=args.jitter,
+        throttle_rate=args.throttle_rate,
+        max_concurrency=args.model_concurrency,
+        seed=args.seed,
+    )
+    with fakes.ApiGatewayServer(on_frame=collector.on_frame) as server:
+        os.environ["URL"] = server.endpoint
+        log = fakes.CallLog()
+        shared = fakes.Fakes(
+            log=log,
+            brt=fakes.FakeBedrockRuntime(conf, log),
+            agent_rt=fakes.FakeAgentRuntime(conf, log),
+            bedrock_agent=fakes.FakeBedrockAgent(conf, log),
+            ws=_ws_client(args.ws_client, server.endpoint, log),
+            s3=fakes.FakeS3(conf, log, {
+                os.environ.get("RUNTIME_KB_KEY", fakes.DEFAULT_ENV["RUNTIME_KB_KEY"]):
+                    _read(os.path.join(CORPUS_DIR, "runtime_kb.json")),
+                os.environ.get("PERSONAL_KB_KEY", fakes.DEFAULT_ENV["PERSONAL_KB_KEY"]):
+                    _read(os.path.join(CORPUS_DIR, "personal_kb.json")),
+            }),
+            opensearch=fakes.FakeOpenSearch(conf, log),
+        )
+        # Containers plus one websocket-handler call per conversation, with headroom
+        # for the model-call threads each container starts itself.
+        executor = ThreadPoolExecutor(max_workers=args.containers + args.conversations + 8)
+        dispatcher = EventDispatcher(
+            loop, executor,
+            lambda n: Container(n, shared),
+            max_containers=args.containers,
+            max_retries=args.async_retries,
+        )
+        ws_handler = fakes.load_ws_handler(shared)
+        ws_handler.lambda_client = dispatcher
+
+        t0 = time.perf_counter()
+        results = await asyncio.gather(*(
+            conversation(i, args, corpus, ws_handler, collector, dispatcher, executor)
+            for i in range(args.conversations)
+        ))
+        wall_s = time.perf_counter() - t0
+        executor.shutdown(wait=False)
+    r = report([t for conv in results for t in conv], shared, dispatcher, wall_s)
+    r["frames_posted"] = server.posts
+    return r
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    ap.add_argument("--conversations", type=int, default=200)
+    ap.add_argument("--turns", type=int, default=3)
+    ap.add_argument("--containers", type=int, default=0, help="max concurrent Lambda containers (default: one per conversation)")
+    ap.add_argument("--ramp", type=float, default=2.0, help="seconds over which conversations start")
+    ap.add_argument("--think-time", type=float, default=1.0, help="mean pause between turns, seconds")
+    ap.add_argument("--turn-timeout", type=float, default=60.0)
+    ap.add_argument("--corpus", default=os.path.join(CORPUS_DIR, "send_message_events.jsonl"))
+    ap.add_argument("--only", default="", help="only use corpus cases whose name contains this")
+    ap.add_argument("--tokens-per-sec", type=float, default=80.0)
+    ap.add_argument("--first-token-ms", type=float, default=300.0)
+    ap.add_argument("--converse-ms", type=float, default=400.0)
+    ap.add_argument("--retrieve-ms", type=float, default=120.0)
+    ap.add_argument("--jitter", type=float, default=0.3, help="+/- fraction applied to fake latencies")
+    ap.add_argument("--throttle-rate", type=float, default=0.0, help="probability a model call is throttled")
+    ap.add_argument("--model-concurrency", type=int, default=0, help="model calls in flight before throttling (0 = no quota)")
+    ap.add_argument("--async-retries", type=int, default=2)
+    ap.add_argument("--ws-client", choices=["http", "boto3"], default="http",
+                    help="post frames with the built-in urllib client or the real boto3 client")
+    ap.add_argument("--seed", type=int, default=7)
+    ap.add_argument("--verbose", action="store_true", help="show the handlers' log output")
+    ap.add_argument("--json", default="", help="also write results to this file")
+    args = ap.parse_args()
+    args.containers = args.containers or args.conversations
+    if not args.verbose:
+        logging.getLogger().addHandler(logging.NullHandler())
+
+    fakes.apply_env()
+    r = asyncio.run(run(args))
+    print_report(r)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"config": vars(args), **r}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
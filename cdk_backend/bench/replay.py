@@ -0,0 +1,187 @@
+# cdk_backend/bench/replay.py
+"""
+End-to-end replay of recorded sendMessage events through web-socket-handler
+and lambdaXbedrock with every AWS client replaced by the fakes in fakes.py.
+
+Each event goes through the real websocket handler (whose Event invoke is
+captured and run in-process), then lambdaXbedrock's handler. Per case it
+reports the route taken, wall time, time to first websocket frame, the
+per-stage EMF timings, model usage, and AWS calls made by operation, so
+routing or caching regressions show up as a changed call count or stage
+time without touching an AWS account.
+
+With --dynamodb both handlers keep server-side history, disconnect markers
+and idempotency records in the fake DynamoDB table, as SESSION_TABLE_NAME
+does; corpus/session_events.jsonl replays a session across an inline turn,
+a follow-up, a client sessionId shaped like another record's key, and a
+$disconnect.
+
+    python cdk_backend/bench/replay.py [--repeat 3] [--cold] [--tokens-per-sec 80] [--json out.json]
+    python cdk_backend/bench/replay.py --dynamodb --corpus cdk_backend/bench/corpus/session_events.jsonl
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+HERE = os.path.dirname(__file__)
+sys.path.insert(0, HERE)
+
+import fakes  # noqa: E402
+
+CORPUS_DIR = os.path.join(HERE, "corpus")
+
+
+def _read(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def load_corpus(path: str) -> list[dict]:
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def _clear_caches(index):
+    for cache in (index._KB_CACHE, index._PRESIGN_CACHE, index._COUNT_CACHE, index._HISTORY_SUMMARY_CACHE):
+        cache.clear()
+
+
+class Replayer:
+    def __init__(self, conf: fakes.FakeConfig, dynamodb: bool = False):
+        self.index = fakes.load_index()
+        self.fakes = fakes.install(self.index, conf, s3_objects={
+            os.environ["RUNTIME_KB_KEY"]: _read(os.path.join(CORPUS_DIR, "runtime_kb.json")),
+            os.environ["PERSONAL_KB_KEY"]: _read(os.path.join(CORPUS_DIR, "personal_kb.json")),
+        })
+        self.ws_handler = fakes.load_ws_handler(self.fakes)
+        self.ws_handler.lambda_client = fakes.FakeLambda(
+            conf, self.fakes.log, target=self._invoke
+        )
+        if dynamodb:
+            self.fakes.use_dynamodb(self.index, ws_handler=self.ws_handler)
+        self._records: list[dict] = []
+        self._responses: list[dict] = []
+        replayer = self
+
+        def emit(trace):
+            usage = replayer.index._USAGE
+            replayer._records.append({"emf": trace.emf(), "usage": usage.summary() if usage else None})
+
+        self.index._Trace.emit = emit
+
+    def _invoke(self, payload: dict):
+        self._responses.append(self.index.lambda_handler(payload, None))
+
+    def run(self, case: dict) -> dict:
+        event = case["event"]
+        cid = event["requestContext"]["connectionId"]
+        route_key = event["requestContext"]["routeKey"]
+        self.fakes.log.reset()
+        self.fakes.ws.take_frames()
+        self._records.clear()
+        self._responses.clear()
+
+        t0 = time.perf_counter()
+        resp = self.ws_handler.lambda_handler(event, None)
+        wall_ms = (time.perf_counter() - t0) * 1000
+
+        frames = self.fakes.ws.take_frames(cid)
+        record = self._records[-1] if self._records else {"emf": {}, "usage": None}
+        emf = record["emf"]
+        return {
+            "case": case.get("name") or cid,
+            # no invocation at all means web-socket-handler answered it inline
+            "route": emf.get("Route", "") if self._responses else (
+                "inline" if route_key == "sendMessage" else route_key
+            ),
+            # lambdaXbedrock's own status; the websocket handler answers 200 once it has forwarded.
+            "status": (self._responses[-1] if self._responses else resp).get("statusCode"),
+            "wall_ms": wall_ms,
+            "first_frame_ms": (frames[0][0] - t0) * 1000 if frames else None,
+            "frames": len(frames),
+            "stages_ms": {k: v for k, v in emf.items() if k.endswith("_ms")},
+            "usage": (record["usage"] or {}).get("totals", {}),
+            "aws_calls": self.fakes.log.reset(),
+        }
+
+
+def _summarize(runs: list[dict]) -> dict:
+    walls = [r["wall_ms"] for r in runs]
+    firsts = [r["first_frame_ms"] for r in runs if r["first_frame_ms"] is not None]
+    last = runs[-1]
+    return {
+        "case": last["case"],
+        "route": last["route"],
+        "status": last["status"],
+        "runs": len(runs),
+        "wall_ms_p50": statistics.median(walls),
+        "wall_ms_max": max(walls),
+        "first_frame_ms_p50": statistics.median(firsts) if firsts else None,
+        "frames": last["frames"],
+        "aws_calls_first": runs[0]["aws_calls"],
+        "aws_calls_last": last["aws_calls"],
+        "stages_ms_last": last["stages_ms"],
+        "usage_last": last["usage"],
+    }
+
+
+def _calls(counts: dict) -> str:
+    return " ".join(f"{op.split('.')[-1]}={n}" for op, n in sorted(counts.items())) or "-"
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    ap.add_argument("--corpus", default=os.path.join(CORPUS_DIR, "send_message_events.jsonl"))
+    ap.add_argument("--only", default="", help="replay cases whose name contains this")
+    ap.add_argument("--repeat", type=int, default=2, help="replays per case (first is cache-cold)")
+    ap.add_argument("--cold", action="store_true", help="clear KB/presign/count/summary caches before every replay")
+    ap.add_argument("--tokens-per-sec", type=float, default=80.0)
+    ap.add_argument("--first-token-ms", type=float, default=300.0)
+    ap.add_argument("--converse-ms", type=float, default=400.0)
+    ap.add_argument("--retrieve-ms", type=float, default=120.0)
+    ap.add_argument("--stages", action="store_true", help="print per-stage timings for each case")
+    ap.add_argument("--dynamodb", action="store_true", help="keep sessions and markers in the fake DynamoDB table")
+    ap.add_argument("--json", default="", help="also write results to this file")
+    args = ap.parse_args()
+
+    conf = fakes.FakeConfig(
+        tokens_per_sec=args.tokens_per_sec,
+        first_token_ms=args.first_token_ms,
+        converse_ms=args.converse_ms,
+        retrieve_ms=args.retrieve_ms,
+    )
+    replayer = Replayer(conf, dynamodb=args.dynamodb)
+    results = []
+    print(f"{'case':<22} {'route':<13} {'st':>3} {'wall p50':>9} {'1st frame':>9} {'frames':>6}  aws calls (first -> last)")
+    for case in load_corpus(args.corpus):
+        if args.only and args.only not in (case.get("name") or ""):
+            continue
+        _clear_caches(replayer.index)
+        runs = []
+        for _ in range(max(1, args.repeat)):
+            if args.cold:
+                _clear_caches(replayer.index)
+            runs.append(replayer.run(case))
+        s = _summarize(runs)
+        results.append(s)
+        first = "-" if s["first_frame_ms_p50"] is None else f"{s['first_frame_ms_p50']:.0f}ms"
+        print(
+            f"{s['case']:<22} {s['route']:<13} {s['status']:>3} {s['wall_ms_p50']:>7.0f}ms {first:>9} {s['frames']:>6}  "
+            f"{_calls(s['aws_calls_first'])} -> {_calls(s['aws_calls_last'])}"
+        )
+        if args.stages:
+            stages = ", ".join(f"{k[:-3]}={v:.0f}" for k, v in s["stages_ms_last"].items())
+            print(f"{'':<22} stages(ms): {stages}")
+            if s["usage_last"].get("calls"):
+                print(f"{'':<22} usage: {json.dumps(s['usage_last'])}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"config": vars(args), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+# cdk_backend/bench/synthetic.py
+"""
+Deterministic synthetic inputs for the lambdaXbedrock benchmarks: model-style
+markdown answers, prompts, runtime/personal KBs and KB source lists.
+Everything is driven by a random.Random so runs are reproducible.
+"""
+import random
+
+WORDS = (
+    "hiv prep agyw district prevalence incidence kenya uganda zimbabwe nigeria "
+    "scorecard phia unaids who testing treatment key populations adolescent "
+    "youth budget rollout cabotegravir guideline strategy dashboard data "
+    "coverage programme services community clinics estimates survey report"
+).split()
+
+COUNTRIES = ["Kenya", "Uganda", "Zimbabwe", "Nigeria", "Ghana", "Malawi", "Zambia"]
+
+DOMAINS = [
+    "https://www.who.int/data/gho",
+    "https://aidsinfo.unaids.org",
+    "https://phia.icap.columbia.edu/countries",
+    "https://hivpreventioncoalition.unaids.org/en/resources",
+    "https://www.prepwatch.org/resources",
+]
+
+
+def _stat(rng: random.Random) -> str:
+    kind = rng.randrange(6)
+    if kind == 0:
+        return f"{rng.uniform(0.1, 99):.1f}%"
+    if kind == 1:
+        return "-".join(str(rng.choice([90, 95])) for _ in range(3))
+    if kind == 2:
+        return f"{rng.randint(1990, 2015)}–{rng.randint(2016, 2025)}"
+    if kind == 3:
+        return f"{rng.randint(1, 999)},{rng.randint(100, 999)}"
+    if kind == 4:
+        return f"{rng.randint(10, 80)}%-{rng.randint(10, 80)}%"
+    return str(rng.randint(2, 5000))
+
+
+def _sentence(rng: random.Random) -> str:
+    words = [rng.choice(WORDS) for _ in range(rng.randint(8, 20))]
+    for _ in range(rng.randint(1, 3)):
+        words.insert(rng.randrange(len(words)), _stat(rng))
+    roll = rng.random()
+    if roll < 0.15:
+        words.insert(rng.randrange(len(words)), f"{rng.choice(DOMAINS)}/{rng.randint(1, 99)}")
+    elif roll < 0.25:
+        label = " ".join(rng.sample(WORDS, 2)).title()
+        words.insert(rng.randrange(len(words)), f"[{label}]({rng.choice(DOMAINS)}?id={rng.randint(1, 99)})")
+    words[0] = words[0].capitalize()
+    return " ".join(words) + rng.choice([".", ".", ".", "!", "?"])
+
+
+def answer(size_bytes: int, rng: random.Random) -> str:
+    """Markdown answer of roughly `size_bytes`: paragraphs and bullets full of stats and links."""
+    parts: list[str] = []
+    total = 0
+    while total < size_bytes:
+        if rng.random() < 0.2:
+            block = "\n".join(f"- {_sentence(rng)}" for _ in range(rng.randint(2, 5)))
+        else:
+            block = " ".join(_sentence(rng) for _ in range(rng.randint(2, 6)))
+        parts.append(block)
+        total += len(block) + 2
+    return "\n\n".join(parts)
+
+
+def prompt(rng: random.Random) -> str:
+    words = [rng.choice(WORDS) for _ in range(rng.randint(5, 18))]
+    if rng.random() < 0.5:
+        words.insert(rng.randrange(len(words)), rng.choice(COUNTRIES))
+    return " ".join(words).capitalize() + "?"
+
+
+def qna_kb(n_items: int, rng: random.Random, link_only: bool = False) -> dict:
+    qna = []
+    for i in range(n_items):
+        item = {
+            "question_exact": f"What is item {i}?",
+            "patterns": [" ".join(rng.sample(WORDS, 3)) + f" q{i}-{j}" for j in range(3)],
+            "answer_template": f"Answer {i}",
+        }
+        if link_only:
+            item.update(link_only=True, source_url=f"{rng.choice(DOMAINS)}/{i}", primary_source=f"Source {i}")
+        qna.append(item)
+    return {"qna": qna}
+
+
+def runtime_kb(n_resources: int, rng: random.Random) -> dict:
+    kb = qna_kb(max(1, n_resources // 10), rng, link_only=True)
+    kb["resources"] = [
+        {
+            "name": f"{' '.join(rng.sample(WORDS, 2)).title()} Tool {i}",
+            "url": f"{rng.choice(DOMAINS)}/tool-{i}",
+            "summary": " ".join(rng.choice(WORDS) for _ in range(rng.randint(10, 30))),
+            "when_to_use": [" ".join(rng.sample(WORDS, 4)) for _ in range(2)],
+            "match_terms": rng.sample(WORDS, 3),
+            "category": rng.choice(["data", "guidance", "dashboard", "report"]),
+        }
+        for i in range(n_resources)
+    ]
+    kb["style"] = {"answer_rules": ["Lead with the answer.", "Cite sources."]}
+    return kb
+
+
+def sources(n: int, rng: random.Random) -> list[dict]:
+    """KB source entries with duplicate labels (same file under different prefixes)."""
+    out = []
+    for _ in range(n):
+        doc = rng.randint(0, max(1, n // 3))
+        prefix = rng.choice(["docs", "docs/2024", "uploads"])
+        out.append({
+            "url": f"https://bucket.s3.amazonaws.com/{prefix}/report_{doc}.pdf?X-Amz-Signature={rng.getrandbits(64):x}",
+            "label": f"report_{doc}.pdf" if rng.random() < 0.7 else "",
+            "score": rng.random(),
+        })
+    return out
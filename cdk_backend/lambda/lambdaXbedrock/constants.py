@@ -102,6 +102,63 @@ REFERENCE_URLS = [
     "https://hivpreventioncoalition.unaids.org/en",
 ]
 
+# Routing table for the "suggested reference" link. Keyword rules are checked
+# in order (first rule with a term found in the lowercased prompt wins); a rule
+# with "country_template" fills in a country taken from the prompt. Otherwise
+# the REFERENCE_URLS entry sharing the most tokens with the prompt is picked,
+# plus "url_bonuses" (preferred_weight applies when the prompt has a
+# "prefer_terms" word). The same shape, optionally with its own "urls" list,
+# can be loaded from S3 (REFERENCE_ROUTES_KEY) to grow the table without a deploy.
+REFERENCE_ROUTES = {
+    "keyword_rules": [
+        # TEST: Pokemon queries
+        {"terms": ["pokemon", "pikachu"], "url": "https://www.pokemon.com/us"},
+        {"terms": ["pepfar"], "url": "https://www.prepitweb.org/"},
+        {
+            "terms": ["dsd", "differentiated service delivery", "differentiated service"],
+            "url": (
+                "https://dsd.unaids.org/?_gl=1*1it17e4*_gcl_au*MTY2OTY5Njk4OC4xNzMwMTQ1NzQy"
+                "*_ga*OTMzOTg2OTc1LjE3MjE5MzU3MzE.*_ga_T7FBEZEXNC*MTczMTM0NTcyNy45LjEu"
+                "MTczMTM0OTMxNS42MC4wLjA."
+            ),
+        },
+        {
+            "terms": ["adolescent", "adolescents", "youth", "young people"],
+            "url": "https://adh.popcouncil.org/",
+        },
+        {
+            "terms": ["behavioral", "behavioural", "behaviour", "behavior"],
+            "url": (
+                "https://hivpreventioncoalition.unaids.org/en/resources/"
+                "effectiveness-behavioural-interventions-prevent-hiv-compendium-evidence-2017-updated-2019"
+            ),
+        },
+        {
+            "terms": ["gpc scorecard", "gpc", "global prevention coalition", "scorecard"],
+            "url": "https://hivpreventioncoalition.unaids.org/en/scorecards",
+            "country_template": "https://hivpreventioncoalition.unaids.org/en/scorecards/{country}",
+        },
+    ],
+    "prefer_terms": ["prevalence", "estimate", "estimates", "hiv", "incidence", "ghana"],
+    "url_bonuses": [
+        {"tokens": ["unaids", "aidsinfo"], "weight": 3, "preferred_weight": 5},
+        {"tokens": ["who"], "weight": 2},
+        {"tokens": ["icap", "phia"], "weight": 2},
+    ],
+}
+
+# USD per 1K tokens for cost estimates in the usage logs. Matched by the
+# longest key contained in the model / inference-profile id; override with the
+# MODEL_PRICING_JSON env var (same shape). Cache reads/writes follow the
+# provider's prompt-caching rates.
+MODEL_PRICING = {
+    "claude-sonnet-4": {"input": 0.003, "output": 0.015, "cache_read": 0.0003, "cache_write": 0.00375},
+    "claude-3-7-sonnet": {"input": 0.003, "output": 0.015, "cache_read": 0.0003, "cache_write": 0.00375},
+    "claude-3-5-sonnet": {"input": 0.003, "output": 0.015, "cache_read": 0.0003, "cache_write": 0.00375},
+    "claude-3-5-haiku": {"input": 0.0008, "output": 0.004, "cache_read": 0.00008, "cache_write": 0.001},
+    "claude-3-haiku": {"input": 0.00025, "output": 0.00125, "cache_read": 0.00003, "cache_write": 0.0003},
+}
+
 @dataclass(frozen=True)
 class Settings:
     REGION: str
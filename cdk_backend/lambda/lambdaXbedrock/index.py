@@ -1,20 +1,43 @@
 # /cdk_backend/lambda/lambdaXbedrock/index.py
-import os
-import json
-import boto3
-import re
-import logging
-import urllib.parse
-import random
-from botocore.exceptions import ClientError
-from constants import load_from_env, REFERENCE_URLS
-
-# --- Optional OpenSearch imports (via your layer) ---
-try:
-    from opensearchpy import OpenSearch, RequestsHttpConnection, AWSV4SignerAuth
-    _OPENSEARCH_AVAILABLE = True
-except Exception:
-    _OPENSEARCH_AVAILABLE = False
+import time
+from contextlib import contextmanager
+
+# ---------- Cold-start profile ----------
+# Per-step import/init milliseconds, logged once when the module finishes loading.
+_COLD_START_T0 = time.perf_counter()
+_IMPORT_PROFILE: dict[str, float] = {}
+
+
+@contextmanager
+def _profiled(step: str):
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        _IMPORT_PROFILE[step] = round((time.perf_counter() - t0) * 1000, 2)
+
+
+with _profiled("import.stdlib"):
+    import os
+    import json
+    import re
+    import logging
+    import math
+    import hashlib
+    import urllib.parse
+    import random
+    import threading
+    import queue
+    from collections import OrderedDict, deque
+    from concurrent.futures import ThreadPoolExecutor
+with _profiled("import.boto3"):
+    import boto3
+    from botocore.exceptions import ClientError
+with _profiled("import.constants"):
+    from constants import load_from_env, REFERENCE_URLS, REFERENCE_ROUTES, MODEL_PRICING
+    # Shared with web-socket-handler via the intercepts layer (lambda/shared/python).
+    import intercepts
+    from intercepts import QnaMatcher as _QnaMatcher, matcher_for as _matcher_for, norm as _norm
 
 CORE_CONTEXT = """
 CORE KNOWLEDGE (Use this for questions about "What is i2i", "What is SSLN", "What is SHIPP", or "What is HIV-DDM"):
@@ -42,7 +65,8 @@ CORE KNOWLEDGE (Use this for questions about "What is i2i", "What is SSLN", "Wha
    - Explainer Resource: https://cdn.prod.website-files.com/63ff2c1bed17e63400e9c2e7/6825b9a961bf5faa4e79bd16_SSLN-i2i%20HIV%20Data%20Decision%20Maker%20-%20Explainer%20Pager%20.pdf
 """
 
-cfg = load_from_env()
+with _profiled("init.config"):
+    cfg = load_from_env()
 
 # ---------- Logging ----------
 logger = logging.getLogger()
@@ -54,14 +78,149 @@ logger.info(
     f"OS endpoint: {cfg.OPENSEARCH_ENDPOINT or '(none)'}"
 )
 
+# ---------- Request tracing (CloudWatch EMF) ----------
+# One _Trace per invocation collects stage durations (summed when a stage runs
+# more than once), the route taken and a few marks (time to first token);
+# emit() prints a single Embedded Metric Format record to stdout.
+EMF_NAMESPACE = os.environ.get("EMF_NAMESPACE", "LambdaXBedrock")
+
+
+class _Trace:
+    def __init__(self, connection_id: str = ""):
+        self.connection_id = connection_id
+        self.route = "unknown"
+        self.stages: dict[str, float] = {}
+        self.marks: dict[str, float] = {}
+        self._t0 = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def add(self, stage: str, ms: float):
+        with self._lock:
+            self.stages[stage] = self.stages.get(stage, 0.0) + ms
+
+    def mark(self, name: str):
+        ms = (time.perf_counter() - self._t0) * 1000
+        with self._lock:
+            self.marks.setdefault(name, ms)
+
+    def emf(self) -> dict:
+        with self._lock:
+            values = {f"{k}_ms": round(v, 2) for k, v in self.stages.items()}
+            values.update({f"{k}_ms": round(v, 2) for k, v in self.marks.items()})
+        values["total_ms"] = round((time.perf_counter() - self._t0) * 1000, 2)
+        return {
+            "_aws": {
+                "Timestamp": int(time.time() * 1000),
+                "CloudWatchMetrics": [{
+                    "Namespace": EMF_NAMESPACE,
+                    "Dimensions": [["Route"]],
+                    "Metrics": [{"Name": k, "Unit": "Milliseconds"} for k in values],
+                }],
+            },
+            "Route": self.route,
+            "ConnectionId": self.connection_id,
+            **values,
+        }
+
+    def emit(self):
+        # EMF records must be a bare JSON line, so bypass the logger's prefix.
+        print(json.dumps(self.emf()), flush=True)
+
+
+_TRACE: _Trace | None = None
+# Worker threads can still be running when their invocation ends and the
+# next one replaces _TRACE (and _USAGE), so they record into the trace and
+# usage ledger bound here when their work was handed over (see _traced)
+# rather than the globals.
+_BOUND = threading.local()
+
+
+def _current_trace() -> _Trace | None:
+    return getattr(_BOUND, "trace", _TRACE)
+
+
+@contextmanager
+def _span(stage: str):
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace = _current_trace()
+        if trace is not None:
+            trace.add(stage, (time.perf_counter() - t0) * 1000)
+
+
+def _trace_since(stage: str, t0: float):
+    trace = _current_trace()
+    if trace is not None:
+        trace.add(stage, (time.perf_counter() - t0) * 1000)
+
+
+def _trace_mark(name: str):
+    trace = _current_trace()
+    if trace is not None:
+        trace.mark(name)
+
+
+def _trace_route(route: str):
+    if _TRACE is not None:
+        _TRACE.route = route
+
+
+def _traced(stage: str, fn, *args, **kwargs):
+    """
+    fn(*args, **kwargs) as a callable for a thread pool, run inside a span of
+    the trace, and charging model calls to the usage ledger, current at
+    submit time.
+    """
+    trace, usage = _current_trace(), _current_usage()
+
+    def run():
+        _BOUND.trace, _BOUND.usage = trace, usage
+        try:
+            with _span(stage):
+                return fn(*args, **kwargs)
+        finally:
+            del _BOUND.trace, _BOUND.usage
+    return run
+
+
 # ---------- AWS clients ----------
-brt = boto3.client("bedrock-runtime", region_name=cfg.REGION)
-agent_rt = boto3.client("bedrock-agent-runtime", region_name=cfg.REGION)
-ws = boto3.client(
+class _LazyClient:
+    """
+    boto3 client created on first attribute access (thread-safe), so cold
+    starts only pay for the clients a request actually uses.
+    """
+
+    def __init__(self, service: str, **kwargs):
+        self._service = service
+        self._kwargs = kwargs
+        self._client = None
+        self._lock = threading.Lock()
+
+    def _get(self):
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    with _profiled(f"init.{self._service}"):
+                        self._client = boto3.client(self._service, **self._kwargs)
+                    logger.info(
+                        f"Initialized {self._service} client in "
+                        f"{_IMPORT_PROFILE[f'init.{self._service}']} ms"
+                    )
+        return self._client
+
+    def __getattr__(self, name):
+        return getattr(self._get(), name)
+
+
+brt = _LazyClient("bedrock-runtime", region_name=cfg.REGION)
+agent_rt = _LazyClient("bedrock-agent-runtime", region_name=cfg.REGION)
+ws = _LazyClient(
     "apigatewaymanagementapi",
     endpoint_url=cfg.WEBSOCKET_CALLBACK_URL
 ) if cfg.WEBSOCKET_CALLBACK_URL else None
-s3 = boto3.client("s3") if cfg.S3_BUCKET_NAME else None
+s3 = _LazyClient("s3") if cfg.S3_BUCKET_NAME else None
 
 MODEL_ID = cfg.INFERENCE_PROFILE_ID or cfg.LLM_MODEL_FALLBACK_ID
 
@@ -70,57 +229,113 @@ _RUNTIME_KB = None
 _PERSONAL_KB = None
 _RUNTIME_LAST_ETAG = None
 _PERSONAL_LAST_ETAG = None
+_ROUTES_LAST_ETAG = None
 _CONFIG_LOADED = False
+_CONFIG_CHECKED_AT = 0.0
+_CONFIG_LOCK = threading.Lock()
+# Warm containers re-check the S3 JSON files (conditional GET) this often
+KB_REFRESH_SECONDS = float(os.environ.get("KB_REFRESH_SECONDS", "300"))
+# Compiled qna matchers, rebuilt whenever a KB with a new ETag is loaded
+_RUNTIME_MATCHER = None
+_PERSONAL_MATCHER = None
 
 
 def _get_env(name, default=""):
     return getattr(cfg, name, None) or os.environ.get(name, default)
 
 
-def _get_s3_object_text(key):
-    """Read a small JSON file (runtime/personal) from S3."""
+def _get_s3_object_text(key, if_none_match=None):
+    """
+    Read a small JSON file (runtime/personal) from S3.
+    With `if_none_match`, an unchanged object returns ("", if_none_match)
+    without downloading the body.
+    """
     if not s3 or not _get_env("S3_BUCKET_NAME") or not key:
         return "", None
+    kwargs = {"Bucket": _get_env("S3_BUCKET_NAME"), "Key": key}
+    if if_none_match:
+        kwargs["IfNoneMatch"] = f'"{if_none_match}"'
     try:
-        obj = s3.get_object(Bucket=_get_env("S3_BUCKET_NAME"), Key=key)
+        obj = s3.get_object(**kwargs)
         body = obj["Body"].read().decode("utf-8")
         etag = (obj.get("ETag") or "").strip('"')
         return body, (etag or None)
+    except ClientError as e:
+        if str(e.response.get("Error", {}).get("Code")) in ("304", "NotModified"):
+            return "", if_none_match
+        logger.error(f"Failed to read S3 object {key}: {e}")
+        return "", None
     except Exception as e:
         logger.error(f"Failed to read S3 object {key}: {e}")
         return "", None
 
 
 def _load_runtime_kbs(force=False):
-    """Cold-start loader with ETag caching."""
+    """
+    Fetch the runtime KB, personal KB and reference routes in parallel
+    (conditional GETs on the last ETag unless `force`), compile whatever
+    changed, then swap the new structures in together.
+    """
     global _RUNTIME_KB, _PERSONAL_KB, _RUNTIME_LAST_ETAG, _PERSONAL_LAST_ETAG
-    rk_key = _get_env("RUNTIME_KB_KEY")  # e.g., runtime/HIV_DDM_Chatbot_KB.json
-    if rk_key:
-        txt, etag = _get_s3_object_text(rk_key)
-        if txt and (force or etag != _RUNTIME_LAST_ETAG or _RUNTIME_KB is None):
-            _RUNTIME_KB = json.loads(txt)
-            _RUNTIME_LAST_ETAG = etag
-            logger.info(
-                f"Loaded RUNTIME_KB key={rk_key} "
-                f"version={(_RUNTIME_KB.get('meta') or {}).get('version')}"
-            )
-    pk_key = _get_env("PERSONAL_KB_KEY")  # e.g., runtime/personal_kb.json
-    if pk_key:
-        txt, etag = _get_s3_object_text(pk_key)
-        if txt and (force or etag != _PERSONAL_LAST_ETAG or _PERSONAL_KB is None):
-            _PERSONAL_KB = json.loads(txt)
-            _PERSONAL_LAST_ETAG = etag
-            logger.info(
-                f"Loaded PERSONAL_KB key={pk_key} "
-                f"version={(_PERSONAL_KB.get('meta') or {}).get('version')}"
-            )
+    global _RUNTIME_MATCHER, _PERSONAL_MATCHER, _RUNTIME_RESOURCE_INDEX
+    global _REFERENCE_ROUTER, _ROUTES_LAST_ETAG
+    wanted = {
+        "runtime": (_get_env("RUNTIME_KB_KEY"), _RUNTIME_LAST_ETAG),  # e.g., runtime/HIV_DDM_Chatbot_KB.json
+        "personal": (_get_env("PERSONAL_KB_KEY"), _PERSONAL_LAST_ETAG),  # e.g., runtime/personal_kb.json
+        "routes": (_get_env("REFERENCE_ROUTES_KEY"), _ROUTES_LAST_ETAG),  # e.g., runtime/reference_routes.json
+    }
+    wanted = {name: spec for name, spec in wanted.items() if spec[0]}
+    if not wanted:
+        return
+    with ThreadPoolExecutor(max_workers=len(wanted)) as pool:
+        futures = {
+            name: pool.submit(_get_s3_object_text, key, None if force else etag)
+            for name, (key, etag) in wanted.items()
+        }
+        fetched = {name: f.result() for name, f in futures.items()}
+
+    # Compile outside the lock; a bad file keeps the previous version.
+    compiled = {}
+    for name, (txt, etag) in fetched.items():
+        if not txt:
+            continue
+        key, last_etag = wanted[name]
+        if not force and etag == last_etag:
+            continue
+        try:
+            data = json.loads(txt)
+            if name == "routes":
+                routes = {**REFERENCE_ROUTES, **data}
+                compiled[name] = (_ReferenceRouter(routes, routes.get("urls") or REFERENCE_URLS), etag)
+                logger.info(f"Loaded REFERENCE_ROUTES key={key} etag={etag}")
+            else:
+                extra = _ResourceIndex(data) if name == "runtime" else None
+                compiled[name] = (data, _QnaMatcher(data), extra, etag)
+                logger.info(
+                    f"Loaded {name.upper()}_KB key={key} etag={etag} "
+                    f"version={(data.get('meta') or {}).get('version')}"
+                )
+        except Exception as e:
+            logger.error(f"Failed to compile {name} from {key}: {e}")
+
+    with _CONFIG_LOCK:
+        if "runtime" in compiled:
+            _RUNTIME_KB, _RUNTIME_MATCHER, _RUNTIME_RESOURCE_INDEX, _RUNTIME_LAST_ETAG = compiled["runtime"]
+        if "personal" in compiled:
+            _PERSONAL_KB, _PERSONAL_MATCHER, _, _PERSONAL_LAST_ETAG = compiled["personal"]
+        if "routes" in compiled:
+            _REFERENCE_ROUTER, _ROUTES_LAST_ETAG = compiled["routes"]
 
 
 def _ensure_config_loaded():
-    global _CONFIG_LOADED
-    if not _CONFIG_LOADED:
-        _load_runtime_kbs(force=True)
-        _CONFIG_LOADED = True
+    """Load the S3 JSON configs on cold start, then re-check them every KB_REFRESH_SECONDS."""
+    global _CONFIG_LOADED, _CONFIG_CHECKED_AT
+    now = time.monotonic()
+    if _CONFIG_LOADED and now - _CONFIG_CHECKED_AT < KB_REFRESH_SECONDS:
+        return
+    _load_runtime_kbs(force=not _CONFIG_LOADED)
+    _CONFIG_LOADED = True
+    _CONFIG_CHECKED_AT = now
 
 
 # ---------- History normalization ----------
@@ -143,35 +358,455 @@ def _normalize_history_items(history_raw) -> list[dict]:
     return out
 
 
-# ---------- Personal & Runtime matching ----------
-def _norm(s: str) -> str:
-    return (s or "").lower().strip()
+# ---------- Session store (server-side history) ----------
+# When the client sends a sessionId, the websocket handler forwards only
+# {prompt, sessionId} (no uploaded history); turns are kept here
+# in the frontend's item shape so _normalize_history_items applies unchanged.
+# DynamoDB when SESSION_TABLE_NAME is set, otherwise a per-container stand-in.
+# The table also holds disconnect#<connectionId> markers and msg#<messageId>
+# idempotency records, and sessionId comes from the client, so turns are kept
+# under session#<sessionId> where no sessionId can reach the other records.
+SESSION_TABLE_NAME = os.environ.get("SESSION_TABLE_NAME", "")
+SESSION_HISTORY_ITEMS = int(os.environ.get("SESSION_HISTORY_ITEMS", "20"))
+SESSION_TTL_SECONDS = int(os.environ.get("SESSION_TTL_SECONDS", str(7 * 24 * 3600)))
+SESSION_WRITE_ATTEMPTS = int(os.environ.get("SESSION_WRITE_ATTEMPTS", "4"))
+
+
+class _DynamoSessionStore:
+    """Table keyed by sessionId (S) + seq (N); items expire via the expiresAt TTL attribute."""
+
+    def __init__(self, table_name: str, ttl_seconds: int):
+        self.table_name = table_name
+        self.ttl_seconds = ttl_seconds
+        self._ddb = _LazyClient("dynamodb")
+
+    @staticmethod
+    def _key(session_id: str) -> str:
+        return f"session#{session_id}"
+
+    def append(self, session_id: str, items: list[dict]):
+        now = time.time()
+        base = time.time_ns()
+        requests = [
+            {"PutRequest": {"Item": {
+                "sessionId": {"S": self._key(session_id)},
+                "seq": {"N": str(base + i)},
+                "sentBy": {"S": it["sentBy"]},
+                "message": {"S": it["message"]},
+                "expiresAt": {"N": str(int(now) + self.ttl_seconds)},
+            }}}
+            for i, it in enumerate(items)
+        ]
+        pending = {self.table_name: requests}
+        for attempt in range(SESSION_WRITE_ATTEMPTS):
+            if attempt:
+                time.sleep(min(0.05 * 2 ** attempt, 1.0) * random.uniform(0.5, 1.0))
+            pending = self._ddb.batch_write_item(RequestItems=pending).get("UnprocessedItems") or {}
+            if not pending:
+                return
+        dropped = sum(len(v) for v in pending.values())
+        logger.error(f"Session history: dropped {dropped} unprocessed item(s) for {session_id}")
+
+    def recent(self, session_id: str, limit: int) -> list[dict]:
+        resp = self._ddb.query(
+            TableName=self.table_name,
+            KeyConditionExpression="sessionId = :s",
+            ExpressionAttributeValues={":s": {"S": self._key(session_id)}},
+            ScanIndexForward=False,
+            Limit=limit,
+        )
+        return [
+            {
+                "type": "TEXT",
+                "sentBy": (it.get("sentBy") or {}).get("S", ""),
+                "message": (it.get("message") or {}).get("S", ""),
+            }
+            for it in reversed(resp.get("Items") or [])
+        ]
+
+    def is_disconnected(self, connection_id: str) -> bool:
+        # Marker written by web-socket-handler on $disconnect (same key shape).
+        resp = self._ddb.get_item(
+            TableName=self.table_name,
+            Key={"sessionId": {"S": f"disconnect#{connection_id}"}, "seq": {"N": "0"}},
+            ProjectionExpression="sessionId",
+        )
+        return "Item" in resp
+
+
+class _MemorySessionStore:
+    """Same interface, kept in the warm container; for local runs and tests."""
 
+    def __init__(self, max_items: int):
+        self.max_items = max_items
+        self._sessions: OrderedDict = OrderedDict()
+        self._disconnected: set[str] = set()
+        self._lock = threading.Lock()
 
+    def append(self, session_id: str, items: list[dict]):
+        with self._lock:
+            turns = self._sessions.setdefault(session_id, deque(maxlen=self.max_items))
+            turns.extend({"type": "TEXT", **it} for it in items)
+            self._sessions.move_to_end(session_id)
+            while len(self._sessions) > 1000:
+                self._sessions.popitem(last=False)
+
+    def recent(self, session_id: str, limit: int) -> list[dict]:
+        with self._lock:
+            turns = list(self._sessions.get(session_id) or ())
+        return turns[-limit:] if limit else []
+
+    def mark_disconnected(self, connection_id: str):
+        with self._lock:
+            self._disconnected.add(connection_id)
+
+    def is_disconnected(self, connection_id: str) -> bool:
+        return connection_id in self._disconnected
+
+
+_SESSION_STORE = (
+    _DynamoSessionStore(SESSION_TABLE_NAME, SESSION_TTL_SECONDS)
+    if SESSION_TABLE_NAME else
+    _MemorySessionStore(SESSION_HISTORY_ITEMS)
+)
+
+
+def _session_history(event: dict) -> list:
+    """Legacy events still carry `history`; otherwise read the session's recent turns."""
+    if "history" in event:
+        return event.get("history") or []
+    session_id = event.get("sessionId") or event.get("connectionId")
+    try:
+        return _SESSION_STORE.recent(session_id, SESSION_HISTORY_ITEMS)
+    except Exception as e:
+        logger.warning(f"Session history read failed for {session_id}: {e}")
+        return []
+
+
+def _save_session_turn(event: dict, prompt: str, reply: str):
+    if "history" in event or not reply:
+        return
+    session_id = event.get("sessionId") or event.get("connectionId")
+    try:
+        _SESSION_STORE.append(session_id, [
+            {"sentBy": "USER", "message": prompt},
+            {"sentBy": "BOT", "message": reply},
+        ])
+    except Exception as e:
+        logger.warning(f"Session history write failed for {session_id}: {e}")
+
+
+# ---------- Idempotency (async invoke retries) ----------
+# web-socket-handler stamps each forwarded prompt with a messageId, and Lambda
+# retries a timed-out Event invoke with the same payload. The first attempt
+# claims the id; a retry of a finished or still-running attempt is skipped,
+# and a retry of one that died mid-answer resumes from its checkpoint. The
+# checkpoint is taken from frames post_to_connection accepted, and answer
+# frames carry their offset in the message, so a retry continues from there
+# (assistant prefill) and the client rewinds to that offset rather than
+# showing text twice; a retry after the answer stream just closes the message.
+IDEMPOTENCY_TABLE_NAME = os.environ.get("IDEMPOTENCY_TABLE_NAME", SESSION_TABLE_NAME)
+IDEMPOTENCY_TTL_SECONDS = int(os.environ.get("IDEMPOTENCY_TTL_SECONDS", str(24 * 3600)))
+# Claim lease when there is no Lambda context to read the remaining time from
+IDEMPOTENCY_LEASE_SECONDS = float(os.environ.get("IDEMPOTENCY_LEASE_SECONDS", "90"))
+# Each checkpoint rewrites the whole answer so far; bound how often.
+IDEMPOTENCY_CHECKPOINT_SECONDS = float(os.environ.get("IDEMPOTENCY_CHECKPOINT_SECONDS", "1"))
+IDEMPOTENCY_CHECKPOINT_CHARS = int(os.environ.get("IDEMPOTENCY_CHECKPOINT_CHARS", "1024"))
+_CHECKPOINT_FIELDS = ("raw", "delivered", "formatter", "ended")
+
+
+class _DynamoIdempotencyStore:
+    """Records sit in the session table under msg#<messageId> / seq 0, next to the disconnect markers."""
+
+    def __init__(self, table_name: str, ttl_seconds: int):
+        self.table_name = table_name
+        self.ttl_seconds = ttl_seconds
+        self._ddb = _LazyClient("dynamodb")
+
+    @staticmethod
+    def _key(message_id: str) -> dict:
+        return {"sessionId": {"S": f"msg#{message_id}"}, "seq": {"N": "0"}}
+
+    def claim(self, message_id: str, lease_until: float) -> tuple[str, dict]:
+        """("new" | "resume" | "duplicate", checkpoint of the attempt being resumed)."""
+        now = time.time()
+        try:
+            resp = self._ddb.put_item(
+                TableName=self.table_name,
+                Item={
+                    **self._key(message_id),
+                    "status": {"S": "IN_PROGRESS"},
+                    "leaseUntil": {"N": f"{lease_until:.3f}"},
+                    "expiresAt": {"N": str(int(now) + self.ttl_seconds)},
+                },
+                # Free, or held by an attempt whose lease ran out (it timed out).
+                ConditionExpression="attribute_not_exists(sessionId) OR (#s = :running AND leaseUntil < :now)",
+                ExpressionAttributeNames={"#s": "status"},
+                ExpressionAttributeValues={":running": {"S": "IN_PROGRESS"}, ":now": {"N": f"{now:.3f}"}},
+                ReturnValues="ALL_OLD",
+            )
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") == "ConditionalCheckFailedException":
+                return "duplicate", {}
+            raise
+        old = resp.get("Attributes")
+        if not old:
+            return "new", {}
+        return "resume", {k: (old.get(k) or {}).get("S", "") for k in _CHECKPOINT_FIELDS}
+
+    def checkpoint(self, message_id: str, checkpoint: dict):
+        names = {f"#c{i}": k for i, k in enumerate(_CHECKPOINT_FIELDS)}
+        self._ddb.update_item(
+            TableName=self.table_name,
+            Key=self._key(message_id),
+            UpdateExpression="SET " + ", ".join(f"{n} = :{n[1:]}" for n in names),
+            ExpressionAttributeNames=names,
+            ExpressionAttributeValues={f":{n[1:]}": {"S": checkpoint[k]} for n, k in names.items()},
+        )
+
+    def complete(self, message_id: str, status_code: int):
+        names = {f"#c{i}": k for i, k in enumerate(_CHECKPOINT_FIELDS)}
+        self._ddb.update_item(
+            TableName=self.table_name,
+            Key=self._key(message_id),
+            UpdateExpression="SET #s = :done, statusCode = :c REMOVE " + ", ".join(names),
+            ExpressionAttributeNames={"#s": "status", **names},
+            ExpressionAttributeValues={":done": {"S": "COMPLETED"}, ":c": {"N": str(status_code)}},
+        )
+
+
+class _MemoryIdempotencyStore:
+    """Same interface, kept in the warm container; for local runs and tests."""
+
+    def __init__(self, max_items: int = 10000):
+        self.max_items = max_items
+        self._records: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def claim(self, message_id: str, lease_until: float) -> tuple[str, dict]:
+        with self._lock:
+            old = self._records.get(message_id)
+            if old and not (old["status"] == "IN_PROGRESS" and old["leaseUntil"] < time.time()):
+                return "duplicate", {}
+            self._records[message_id] = {"status": "IN_PROGRESS", "leaseUntil": lease_until}
+            self._records.move_to_end(message_id)
+            while len(self._records) > self.max_items:
+                self._records.popitem(last=False)
+        if not old:
+            return "new", {}
+        return "resume", {k: old.get(k, "") for k in _CHECKPOINT_FIELDS}
+
+    def checkpoint(self, message_id: str, checkpoint: dict):
+        with self._lock:
+            if message_id in self._records:
+                self._records[message_id].update(checkpoint)
+
+    def complete(self, message_id: str, status_code: int):
+        with self._lock:
+            if message_id in self._records:
+                self._records[message_id] = {"status": "COMPLETED", "statusCode": status_code}
+
+
+_IDEMPOTENCY_STORE = (
+    _DynamoIdempotencyStore(IDEMPOTENCY_TABLE_NAME, IDEMPOTENCY_TTL_SECONDS)
+    if IDEMPOTENCY_TABLE_NAME else
+    _MemoryIdempotencyStore()
+)
+
+
+class _IdempotentRun:
+    """
+    The claimed message for this invocation. Each answer delta is stamped with
+    its offset in the message and queued with a snapshot of the formatter
+    state (plus how much raw model text it had consumed) at the moment it was
+    produced. As post_to_connection accepts frames, the latest snapshot and
+    the text posted so far are checkpointed every IDEMPOTENCY_CHECKPOINT_SECONDS
+    or IDEMPOTENCY_CHECKPOINT_CHARS, and once the end frame is posted. A retry
+    continues from the checkpoint and its first frame's offset tells the
+    client to drop whatever it received after that point. Frames sent outside
+    the answer stream carry no snapshot, so a retry after them can only close
+    the message.
+    """
+
+    def __init__(self, message_id: str, checkpoint: dict):
+        self.message_id = message_id
+        self.raw_prefix = checkpoint.get("raw") or ""
+        self.delivered_prefix = checkpoint.get("delivered") or ""
+        self.ended = bool(checkpoint.get("ended"))
+        self._formatter_state = checkpoint.get("formatter") or ""
+        self._raw = [self.raw_prefix] if self.raw_prefix else []
+        self._raw_len = len(self.raw_prefix)
+        self._delivered = [self.delivered_prefix] if self.delivered_prefix else []
+        self._offset = len(self.delivered_prefix)
+        self._snapshot = (len(self.raw_prefix), self._formatter_state)
+        self._unsaved_chars = 0
+        self._saved_at = time.monotonic()
+        self._formatter = None
+        self._streaming = False
+        # The prefill drops trailing whitespace the formatter already consumed.
+        self._trim = self.raw_prefix[-1:].isspace()
+
+    @property
+    def stream_done(self) -> bool:
+        """Resumed after the answer stream had finished: nothing left to generate."""
+        return self.ended or bool(self.delivered_prefix and not self._formatter_state)
+
+    def resume(self, messages: list[dict], formatter) -> list[dict]:
+        """Attach the stream's formatter; when resuming, restore it and prefill the answer so far."""
+        first = self._formatter is None
+        self._formatter = formatter
+        self._streaming = True
+        prefix = self.raw_prefix.rstrip()
+        if not (first and prefix and self._formatter_state):
+            self._trim = False
+            return messages
+        formatter.restore(json.loads(self._formatter_state))
+        logger.info(f"Resuming message {self.message_id} after {len(prefix)} chars")
+        return [*messages, {"role": "assistant", "content": [{"text": prefix}]}]
+
+    def note(self, delta: str) -> str:
+        if self._trim:
+            delta = delta.lstrip()
+            self._trim = not delta
+        if delta:
+            self._raw.append(delta)
+            self._raw_len += len(delta)
+        return delta
+
+    def finish(self):
+        self._streaming = False
+
+    def stamp(self, payload: dict) -> tuple[dict, tuple[int, str] | None]:
+        """The delta frame with its message offset, and its resume point (None outside the answer stream)."""
+        stamped = {**payload, "offset": self._offset}
+        self._offset += len(payload.get("text") or "")
+        if not self._streaming:
+            return stamped, None
+        return stamped, (self._raw_len, json.dumps(self._formatter.state()))
+
+    def posted(self, payload: dict, snapshot: tuple[int, str] | None):
+        """Called by the WebSocket sender after post_to_connection accepted `payload`."""
+        kind = payload.get("type")
+        if kind == "delta":
+            text = payload.get("text") or ""
+            self._delivered.append(text)
+            self._snapshot = snapshot or (0, "")
+            self._unsaved_chars += len(text)
+            if (
+                self._unsaved_chars < IDEMPOTENCY_CHECKPOINT_CHARS
+                and time.monotonic() - self._saved_at < IDEMPOTENCY_CHECKPOINT_SECONDS
+            ):
+                return
+        elif kind == "end":
+            self.ended = True
+        else:
+            return
+        self.save()
+
+    def save(self):
+        raw_len, formatter = self._snapshot
+        checkpoint = {
+            "raw": "".join(self._raw)[:raw_len],
+            "delivered": "".join(self._delivered),
+            "formatter": formatter,
+            "ended": "1" if self.ended else "",
+        }
+        self._saved_at = time.monotonic()
+        self._unsaved_chars = 0
+        try:
+            _IDEMPOTENCY_STORE.checkpoint(self.message_id, checkpoint)
+        except Exception as e:
+            logger.warning(f"Idempotency checkpoint failed for {self.message_id}: {e}")
+
+
+_IDEMPOTENT_RUN: _IdempotentRun | None = None
+
+
+def _idempotency_claim(event: dict, context) -> str:
+    """Claim event["messageId"]; "duplicate" means another attempt owns or finished it."""
+    global _IDEMPOTENT_RUN
+    message_id = event.get("messageId")
+    if not message_id:
+        return "new"
+    try:
+        remaining = context.get_remaining_time_in_millis() / 1000 if context else IDEMPOTENCY_LEASE_SECONDS
+    except Exception:
+        remaining = IDEMPOTENCY_LEASE_SECONDS
+    try:
+        state, checkpoint = _IDEMPOTENCY_STORE.claim(message_id, time.time() + remaining + 5)
+    except Exception as e:
+        # Fail open: a duplicate answer beats no answer.
+        logger.warning(f"Idempotency claim failed for {message_id}: {e}")
+        return "new"
+    if state == "duplicate":
+        logger.info(f"Skipping duplicate delivery of message {message_id}")
+        return state
+    _IDEMPOTENT_RUN = _IdempotentRun(message_id, checkpoint)
+    if state == "resume":
+        if not (_IDEMPOTENT_RUN.delivered_prefix or _IDEMPOTENT_RUN.ended):
+            # Frames start at offset 0, so the client drops anything it got.
+            logger.info(f"Retrying message {message_id}: no checkpoint, answering from the start")
+        else:
+            _IDEMPOTENT_RUN.save()  # the claim replaced the item; keep the checkpoint
+    return state
+
+
+def _resume_stream(messages: list[dict], formatter) -> list[dict]:
+    """Messages for the answer stream; continues from the checkpoint on a resumed attempt."""
+    return _IDEMPOTENT_RUN.resume(messages, formatter) if _IDEMPOTENT_RUN else messages
+
+
+def _note_model_text(delta: str) -> str:
+    """Record a model delta for the checkpoint; returns the text to feed the formatter."""
+    if _IDEMPOTENT_RUN is not None and delta:
+        return _IDEMPOTENT_RUN.note(delta)
+    return delta
+
+
+def _finish_stream(formatter) -> str:
+    """formatter.finish(); frames after this point can no longer be resumed mid-stream."""
+    if _IDEMPOTENT_RUN is not None:
+        _IDEMPOTENT_RUN.finish()
+    return formatter.finish()
+
+
+def _close_resumed(connection_id: str) -> dict:
+    """A retry after the answer stream finished: the client keeps what it has; just end the message."""
+    run = _IDEMPOTENT_RUN
+    logger.info(
+        f"Closing resumed message {run.message_id}: {len(run.delivered_prefix)} chars already delivered"
+    )
+    if not run.ended:
+        _send_ws(connection_id, {"type": "end", "statusCode": 200})
+    return {"statusCode": 200, "body": "RESUMED_CLOSED"}
+
+
+def _idempotency_complete(status_code: int):
+    global _IDEMPOTENT_RUN
+    run, _IDEMPOTENT_RUN = _IDEMPOTENT_RUN, None
+    if run is None:
+        return
+    try:
+        _IDEMPOTENCY_STORE.complete(run.message_id, status_code)
+    except Exception as e:
+        logger.warning(f"Idempotency completion failed for {run.message_id}: {e}")
+
+
+# ---------- Personal & Runtime matching ----------
 def _match_personal(prompt: str):
+    global _PERSONAL_MATCHER
     if not _PERSONAL_KB:
         return None
-    q = _norm(prompt)
-    for item in _PERSONAL_KB.get("qna", []):
-        if _norm(item.get("question_exact")) == q:
-            return item
-        for p in item.get("patterns", []) or []:
-            if p and _norm(p) in q:
-                return item
-    return None
+    _PERSONAL_MATCHER = _matcher_for(_PERSONAL_KB, _PERSONAL_MATCHER)
+    return _PERSONAL_MATCHER.match(prompt)
 
 
 def _match_runtime(prompt: str):
+    global _RUNTIME_MATCHER
     if not _RUNTIME_KB:
         return None
-    q = _norm(prompt)
-    for item in _RUNTIME_KB.get("qna", []):
-        if _norm(item.get("question_exact")) == q:
-            return item
-        for p in item.get("patterns", []) or []:
-            if p and _norm(p) in q:
-                return item
-    return None
+    _RUNTIME_MATCHER = _matcher_for(_RUNTIME_KB, _RUNTIME_MATCHER)
+    return _RUNTIME_MATCHER.match(prompt)
 
 
 def _get_source_meta(source_code: str) -> dict | None:
@@ -237,7 +872,7 @@ _BARE_URL_RE = re.compile(
 
 
 def _linkify_bare_urls(text: str) -> str:
-    if not text:
+    if not text or "://" not in text:
         return text
 
     def _repl(m: re.Match) -> str:
@@ -264,6 +899,8 @@ _CHAIN_RE = re.compile(
 
 # standalone numbers (ints/decimals with optional commas)
 _NUMBER_RE = re.compile(r"\b\d{1,3}(?:,\d{3})*(?:\.\d+)?\b")
+# every pattern above needs a digit
+_DIGIT_RE = re.compile(r"\d")
 
 
 def _wrap_bold(s: str) -> str:
@@ -278,7 +915,7 @@ def _emphasize_stats(text: str) -> str:
       - Standalone numbers (1,234, 1.2)
     Never modify inside [label](url). Avoid double bold.
     """
-    if not text:
+    if not text or not _DIGIT_RE.search(text):
         return text
 
     parts = _LINK_BLOCK_RE.split(text)
@@ -343,6 +980,41 @@ def _emphasize_stats(text: str) -> str:
 # ---------- Sentence-level footnote links ----------
 FOOTNOTE_FALLBACK_URL = "https://www.hivinterchange.com/i2i/insight-2-implementation"
 
+def _sentence_end_positions(seg: str) -> list[int]:
+    """
+    Offsets just past each sentence terminator ('.', '!' or '?') in a
+    link-free segment, including trailing quotes/brackets.
+    """
+    positions = []
+    i = 0
+    n = len(seg)
+    while i < n:
+        ch = seg[i]
+
+        if ch in ".!?":
+            # --- DO NOT split on decimals like 12.20 ---
+            if ch == "." and i > 0 and i + 1 < n and seg[i-1].isdigit() and seg[i+1].isdigit():
+                i += 1
+                continue
+
+            # (Optional) collapse ellipses "..." into a single non-terminator
+            if ch == "." and i + 2 < n and seg[i+1] == "." and seg[i+2] == ".":
+                i += 3
+                continue
+
+            j = i + 1
+            # include trailing quotes/brackets directly after punctuation
+            while j < n and seg[j] in ['"', "'", "”", "’", ")", "]"]:
+                j += 1
+
+            positions.append(j)
+            i = j
+            continue
+
+        i += 1
+    return positions
+
+
 def _annotate_sentences_with_links(
     text: str,
     url: str,
@@ -366,32 +1038,8 @@ def _annotate_sentences_with_links(
 
     # Collect sentence end positions outside markdown links
     for seg_idx, seg in enumerate(parts):
-        i = 0
-        n = len(seg)
-        while i < n:
-            ch = seg[i]
-
-            if ch in ".!?":
-                # --- DO NOT split on decimals like 12.20 ---
-                if ch == "." and i > 0 and i + 1 < n and seg[i-1].isdigit() and seg[i+1].isdigit():
-                    i += 1
-                    continue
-
-                # (Optional) collapse ellipses "..." into a single non-terminator
-                if ch == "." and i + 2 < n and seg[i+1] == "." and seg[i+2] == ".":
-                    i += 3
-                    continue
-
-                j = i + 1
-                # include trailing quotes/brackets directly after punctuation
-                while j < n and seg[j] in ['"', "'", "”", "’", ")", "]"]:
-                    j += 1
-
-                sentence_positions.append((seg_idx, j))
-                i = j
-                continue
-
-            i += 1
+        for pos in _sentence_end_positions(seg):
+            sentence_positions.append((seg_idx, pos))
 
     # Need at least 2 sentences to target 2nd or 3rd
     if len(sentence_positions) < 2:
@@ -416,6 +1064,228 @@ def _annotate_sentences_with_links(
     return "".join(out), start_index + 1
 
 
+# ---------- Streaming answer formatting ----------
+# Characters that may continue a number chain (95-95-95, 2000 – 2023) across whitespace.
+_CHAIN_CONT_CHARS = set("0123456789-–")
+STREAM_RELEASE_CHARS = int(os.environ.get("STREAM_RELEASE_CHARS", "48"))
+STREAM_LINK_HOLD_CHARS = int(os.environ.get("STREAM_LINK_HOLD_CHARS", "300"))
+
+
+def _last_space(text: str) -> int:
+    """Index of the last whitespace character in text, or -1."""
+    if text[-1:].isspace():
+        return len(text) - 1
+    parts = text.rsplit(None, 1)
+    if len(parts) == 2:
+        return len(text) - len(parts[1]) - 1
+    return len(text) - len(text.lstrip()) - 1
+
+
+def _link_may_open(text: str, i: int) -> bool:
+    """
+    True when the '[' at text[i] is not (yet) a [label](url) block but could
+    still become one once more text arrives.
+    """
+    close = text.find("]", i + 1)
+    if close == -1:
+        return True
+    if close == i + 1:
+        return False
+    if close + 1 == len(text):
+        return True
+    if text[close + 1] != "(":
+        return False
+    return text.find(")", close + 2) == -1
+
+
+def _sentence_end_offsets(text: str) -> list[int]:
+    """Sentence ends in `text` (offsets into text), skipping markdown links."""
+    offsets = []
+    base = 0
+    parts = _LINK_BLOCK_RE.split(text)
+    links = _LINK_BLOCK_RE.findall(text)
+    for i, seg in enumerate(parts):
+        offsets.extend(base + pos for pos in _sentence_end_positions(seg))
+        base += len(seg)
+        if i < len(links):
+            base += len(links[i])
+    return offsets
+
+
+class _SentenceFootnoteStream:
+    """
+    Streaming twin of _annotate_sentences_with_links: places the single
+    [[n]](url) marker after the 2nd or 3rd sentence as sentences arrive.
+
+    When the 3rd sentence is the target, text after the 2nd is held back until
+    the 3rd ends; if the answer stops at two sentences, the marker goes after
+    the 2nd, exactly as the batch version would.
+    """
+
+    def __init__(self, url: str, start_index: int = 1):
+        self.marker = f" [[{start_index}]]({url})" if url else ""
+        self.target = random.choice((2, 3))
+        self.count = 0
+        self.held = ""
+        self.done = not self.marker
+
+    def feed(self, chunk: str) -> str:
+        if self.done or not chunk:
+            return chunk
+        text = self.held + chunk
+        base = len(self.held)
+        hold_at = 0 if self.count >= 2 else None
+        for pos in _sentence_end_offsets(chunk):
+            self.count += 1
+            if self.count == self.target:
+                at = base + pos
+                self.done = True
+                self.held = ""
+                return text[:at] + self.marker + text[at:]
+            if self.count == 2:
+                hold_at = base + pos
+        if hold_at is None:
+            self.held = ""
+            return text
+        self.held = text[hold_at:]
+        return text[:hold_at]
+
+    def finish(self) -> str:
+        out = self.held
+        if not self.done and self.count >= 2:
+            out = self.marker + out
+        self.held = ""
+        self.done = True
+        return out
+
+
+class _MarkdownStreamTransformer:
+    """
+    Streaming version of _linkify_bare_urls followed by _emphasize_stats (and,
+    optionally, the sentence footnote).
+
+    feed() takes raw model deltas and returns markdown that is safe to send
+    now; finish() flushes the rest. Text is only released at cut points where
+    the batch functions give the same result on the pieces as on the whole:
+    after whitespace, outside [label](url) blocks, and not where a URL or a
+    number chain could still continue. New text is classified once (whitespace
+    runs and '[' are found with str methods); the batch regexes run on each
+    released segment, which is at least STREAM_RELEASE_CHARS long (except the
+    first release and at newlines), so they run a few times per paragraph
+    rather than per delta. An undecided '[' holds output back for at most
+    STREAM_LINK_HOLD_CHARS, like the old fixed tail window did; past that it
+    is treated as plain text.
+    """
+
+    def __init__(self, footnote_url: str | None = None, start_index: int = 1):
+        self._raw = ""      # model text not yet linkified (the current word)
+        self._linked = ""   # linkified text not yet emphasized
+        self._scan = 0      # chars of _linked already classified
+        self._cut = 0       # best safe cut found so far in _linked
+        self._prev = ""     # last non-space char before _scan
+        self._open = None   # index of an undecided '[' in _linked
+        self._released = False
+        self._footnote = (
+            _SentenceFootnoteStream(footnote_url, start_index) if footnote_url else None
+        )
+
+    def _annotate(self, text: str) -> str:
+        return self._footnote.feed(text) if self._footnote else text
+
+    def _cut_in(self, start: int, end: int):
+        """Move _cut to the last safe cut in _linked[start:end], a range without '['."""
+        body = self._linked[start:end]
+        prev = self._prev
+        head = body.rstrip()
+        if head:
+            self._prev = head[-1]
+        # Cuts sit at the ends of whitespace runs; try them from the right.
+        while body:
+            stripped = body.rstrip()
+            if len(stripped) < len(body):
+                if (stripped[-1] if stripped else prev) not in _CHAIN_CONT_CHARS:
+                    self._cut = start + len(body)
+                    return
+                body = stripped
+            else:
+                body = body[:_last_space(body) + 1]
+
+    def _advance(self):
+        text = self._linked
+        n = len(text)
+        i = self._scan
+        if self._open is not None:
+            i, self._open = self._open, None
+        while i < n:
+            j = text.find("[", i)
+            if j == -1:
+                self._cut_in(i, n)
+                i = n
+                break
+            self._cut_in(i, j)
+            m = _LINK_BLOCK_RE.match(text, j)
+            if m:
+                i = m.end()
+                self._prev = ")"
+                continue
+            if _link_may_open(text, j) and n - j <= STREAM_LINK_HOLD_CHARS:
+                self._open = j
+                i = j
+                break
+            self._prev = "["
+            i = j + 1
+        self._scan = i
+
+    def feed(self, delta: str) -> str:
+        if not delta:
+            return ""
+        ws_at = _last_space(delta)
+        if ws_at == -1:
+            self._raw += delta
+            return ""
+        self._linked += _linkify_bare_urls(self._raw + delta[:ws_at + 1])
+        self._raw = delta[ws_at + 1:]
+        self._advance()
+        cut = self._cut
+        if not cut or (cut < STREAM_RELEASE_CHARS and self._released and "\n" not in delta):
+            return ""
+        self._released = True
+        ready = _emphasize_stats(self._linked[:cut])
+        self._linked = self._linked[cut:]
+        self._scan -= cut
+        if self._open is not None:
+            self._open -= cut
+        self._cut = 0
+        return self._annotate(ready)
+
+    def state(self) -> dict:
+        """JSON-able snapshot, so another invocation can continue an interrupted stream."""
+        snap = {k: v for k, v in vars(self).items() if k != "_footnote"}
+        snap["_footnote"] = dict(vars(self._footnote)) if self._footnote else None
+        return snap
+
+    def restore(self, snap: dict):
+        footnote = snap.get("_footnote")
+        for k, v in snap.items():
+            if k != "_footnote":
+                setattr(self, k, v)
+        self._footnote = None
+        if footnote:
+            self._footnote = _SentenceFootnoteStream.__new__(_SentenceFootnoteStream)
+            vars(self._footnote).update(footnote)
+
+    def finish(self) -> str:
+        text = self._linked + _linkify_bare_urls(self._raw)
+        self._raw = self._linked = ""
+        self._scan = self._cut = 0
+        self._prev = ""
+        self._open = None
+        out = self._annotate(_emphasize_stats(text))
+        if self._footnote:
+            out += self._footnote.finish()
+        return out
+
+
 # ---------- Suggested reference picking ----------
 def _tokenize(text: str) -> set[str]:
     return set(re.findall(r"[a-z0-9]+", text.lower()))
@@ -431,113 +1301,167 @@ def _url_tokens(u: str) -> set[str]:
         return set()
 
 
-def _pick_reference_url(prompt: str) -> str | None:
-    q = _tokenize(prompt)
-    prompt_lower = prompt.lower()
-
-    # TEST: Handle Pokemon queries (for testing)
-    if "pokemon" in prompt_lower or "pikachu" in prompt_lower:
-        return "https://www.pokemon.com/us"
+_COUNTRY_RE = re.compile(r'\b(?:for|in|of|about)\s+([A-Z][a-zA-Z]+(?:\s+[A-Z][a-zA-Z]+)?)\b')
+_COUNTRY_FALLBACK_RE = re.compile(r'\b(?:for|in|of|about)\s+([a-z]+(?:\s+[a-z]+)?)\b')
+_DEFAULT_REFERENCE_LIST = [
+    "https://aidsinfo.unaids.org/",
+    "https://www.who.int/data/gho",
+    "https://phia.icap.columbia.edu/",
+]
 
-    # NEW: Handle PEPFAR queries
-    if "pepfar" in prompt_lower:
-        return "https://www.prepitweb.org/"
 
-    # NEW: Handle DSD queries
-    if any(term in prompt_lower for term in [
-        "dsd", "differentiated service delivery", "differentiated service"
-    ]):
-        return (
-            "https://dsd.unaids.org/?_gl=1*1it17e4*_gcl_au*MTY2OTY5Njk4OC4xNzMwMTQ1NzQy"
-            "*_ga*OTMzOTg2OTc1LjE3MjE5MzU3MzE.*_ga_T7FBEZEXNC*MTczMTM0NTcyNy45LjEu"
-            "MTczMTM0OTMxNS42MC4wLjA."
-        )
+class _ReferenceRouter:
+    """
+    Compiled REFERENCE_ROUTES table for _pick_reference_url.
 
-    # NEW: Handle Adolescent queries
-    if any(term in prompt_lower for term in ["adolescent", "adolescents", "youth", "young people"]):
-        return "https://adh.popcouncil.org/"
+    Keyword rules become one regex whose alternatives are ordered by rule
+    priority (a zero-width lookahead so overlapping terms are all seen), and
+    REFERENCE_URLS become a token -> URL inverted index with the URL bonuses
+    folded into per-URL base scores. Picking a URL is then one regex pass over
+    the prompt plus one dictionary pass over its tokens.
+    """
 
-    if any(term in prompt_lower for term in ["behavioral", "behavioural", "behaviour", "behavior"]):
-        return (
-            "https://hivpreventioncoalition.unaids.org/en/resources/"
-            "effectiveness-behavioural-interventions-prevent-hiv-compendium-evidence-2017-updated-2019"
+    def __init__(self, routes: dict | None, urls=None):
+        routes = routes or {}
+        self.rules = [r for r in routes.get("keyword_rules", []) or [] if r.get("terms")]
+        self.term_rule: dict[str, int] = {}
+        for idx, rule in enumerate(self.rules):
+            for term in rule["terms"]:
+                self.term_rule.setdefault(term.lower(), idx)
+        self.terms_re = (
+            re.compile("(?=(" + "|".join(re.escape(t) for t in self.term_rule) + "))")
+            if self.term_rule else None
         )
 
-    # Handle GPC scorecard requests
-    if any(term in prompt_lower for term in ["gpc scorecard", "gpc", "global prevention coalition", "scorecard"]):
-        # Extract country name - search in ORIGINAL prompt for proper capitalization
-        country_pattern = r'\b(?:for|in|of|about)\s+([A-Z][a-zA-Z]+(?:\s+[A-Z][a-zA-Z]+)?)\b'
-        match = re.search(country_pattern, prompt)
-
-        if match:
-            country = match.group(1).lower().replace(" ", "-")
-            return f"https://hivpreventioncoalition.unaids.org/en/scorecards/{country}"
-
-        # Fallback: try to find country name even without capital letters
-        fallback_pattern = r'\b(?:for|in|of|about)\s+([a-z]+(?:\s+[a-z]+)?)\b'
-        fallback_match = re.search(fallback_pattern, prompt_lower)
-
-        if fallback_match:
-            country = fallback_match.group(1).replace(" ", "-")
-            return f"https://hivpreventioncoalition.unaids.org/en/scorecards/{country}"
-
-        # If "scorecard" appears but no country detected, return base URL
-        return "https://hivpreventioncoalition.unaids.org/en/scorecards"
-
-    ref_list = REFERENCE_URLS if (
-        REFERENCE_URLS and isinstance(REFERENCE_URLS, (list, tuple))
-    ) else [
-        "https://aidsinfo.unaids.org/",
-        "https://www.who.int/data/gho",
-        "https://phia.icap.columbia.edu/",
-    ]
-    if not ref_list:
-        return None
+        urls = urls if (urls and isinstance(urls, (list, tuple))) else _DEFAULT_REFERENCE_LIST
+        self.urls = list(urls)
+        self.prefer_terms = {t.lower() for t in routes.get("prefer_terms", []) or []}
+        self.url_index: dict[str, list[int]] = {}
+        self.base = [0.0] * len(self.urls)
+        self.base_preferred = [0.0] * len(self.urls)
+        bonuses = routes.get("url_bonuses", []) or []
+        for idx, u in enumerate(self.urls):
+            toks = _url_tokens(u)
+            for t in toks:
+                self.url_index.setdefault(t, []).append(idx)
+            for b in bonuses:
+                if toks.intersection(b.get("tokens", [])):
+                    w = float(b.get("weight", 0))
+                    self.base[idx] += w
+                    self.base_preferred[idx] += float(b.get("preferred_weight", w))
+        # best URL on bonus alone (first wins ties), for prompts touching nothing
+        self.best_base = self._argmax(range(len(self.urls)), self.base)
+        self.best_base_preferred = self._argmax(range(len(self.urls)), self.base_preferred)
+
+    @staticmethod
+    def _argmax(candidates, scores) -> int | None:
+        best, best_score = None, None
+        for idx in sorted(candidates):
+            if best_score is None or scores[idx] > best_score:
+                best, best_score = idx, scores[idx]
+        return best
+
+    def _keyword_rule(self, prompt_lower: str) -> dict | None:
+        if not self.terms_re:
+            return None
+        top = None
+        for m in self.terms_re.finditer(prompt_lower):
+            idx = self.term_rule[m.group(1)]
+            if top is None or idx < top:
+                top = idx
+                if top == 0:
+                    break
+        return self.rules[top] if top is not None else None
+
+    def pick(self, prompt: str) -> str | None:
+        prompt_lower = prompt.lower()
+        rule = self._keyword_rule(prompt_lower)
+        if rule:
+            template = rule.get("country_template")
+            if template:
+                # Extract country name - search in ORIGINAL prompt for proper capitalization
+                match = _COUNTRY_RE.search(prompt)
+                if match:
+                    return template.format(country=match.group(1).lower().replace(" ", "-"))
+                # Fallback: try to find country name even without capital letters
+                match = _COUNTRY_FALLBACK_RE.search(prompt_lower)
+                if match:
+                    return template.format(country=match.group(1).replace(" ", "-"))
+            return rule.get("url")
+
+        if not self.urls:
+            return None
+        q = _tokenize(prompt)
+        preferred = not self.prefer_terms.isdisjoint(q)
+        base = self.base_preferred if preferred else self.base
+        scores: dict[int, float] = {}
+        for t in q:
+            for idx in self.url_index.get(t, ()):
+                scores[idx] = scores.get(idx, base[idx]) + 1
+        best_untouched = self.best_base_preferred if preferred else self.best_base
+        if best_untouched is not None:
+            scores.setdefault(best_untouched, base[best_untouched])
+        best = self._argmax(scores.keys(), scores)
+        return self.urls[best] if best is not None else self.urls[0]
+
+
+_REFERENCE_ROUTER = _ReferenceRouter(REFERENCE_ROUTES, REFERENCE_URLS)
 
-    prefers_unaids = any(
-        t in q for t in {"prevalence", "estimate", "estimates", "hiv", "incidence", "ghana"}
-    )
 
-    best_url, best_score = None, -1
-    for u in ref_list:
-        toks = _url_tokens(u)
-        score = sum(1 for t in toks if t in q)
-        if "unaids" in toks or "aidsinfo" in toks:
-            score += (5 if prefers_unaids else 3)
-        if "who" in toks:
-            score += 2
-        if "icap" in toks or "phia" in toks:
-            score += 2
-        if score > best_score:
-            best_score, best_url = score, u
-    return best_url or ref_list[0]
+def _pick_reference_url(prompt: str) -> str | None:
+    return _REFERENCE_ROUTER.pick(prompt)
 
 
 # ---------- OpenSearch (optional COUNT support) ----------
 _os = None
-if _OPENSEARCH_AVAILABLE and cfg.OPENSEARCH_ENDPOINT:
-    try:
-        sess = boto3.Session()
-        creds = sess.get_credentials()
-        service = "aoss" if ".aoss." in cfg.OPENSEARCH_ENDPOINT else "es"
-        auth = AWSV4SignerAuth(creds, cfg.REGION, service)
-        host = cfg.OPENSEARCH_ENDPOINT.replace("https://", "")
-        _os = OpenSearch(
-            hosts=[{"host": host, "port": 443}],
-            http_auth=auth,
-            use_ssl=True,
-            verify_certs=True,
-            connection_class=RequestsHttpConnection,
-            timeout=30,
-            pool_maxsize=20,
-        )
-        _ = _os.ping()
-        logger.info("OpenSearch client initialized.")
-    except Exception as e:
-        logger.error(f"OpenSearch init failed: {e}")
-        _os = None
-elif not _OPENSEARCH_AVAILABLE and cfg.OPENSEARCH_ENDPOINT:
-    logger.warning("OpenSearch layer not available; COUNT disabled.")
+_os_lock = threading.Lock()
+_os_unavailable = False
+
+
+def _get_opensearch():
+    """
+    OpenSearch client for the COUNT flow, created on first use. opensearchpy
+    (from the Lambda layer) is only imported here, and no blocking ping is done;
+    connection problems surface on the first query instead.
+    """
+    global _os, _os_unavailable
+    if _os is not None or _os_unavailable or not cfg.OPENSEARCH_ENDPOINT:
+        return _os
+    with _os_lock:
+        if _os is not None or _os_unavailable:
+            return _os
+        try:
+            with _profiled("import.opensearchpy"):
+                from opensearchpy import OpenSearch, RequestsHttpConnection, AWSV4SignerAuth
+        except Exception:
+            logger.warning("OpenSearch layer not available; COUNT disabled.")
+            _os_unavailable = True
+            return None
+        try:
+            with _profiled("init.opensearch"):
+                sess = boto3.Session()
+                creds = sess.get_credentials()
+                service = "aoss" if ".aoss." in cfg.OPENSEARCH_ENDPOINT else "es"
+                auth = AWSV4SignerAuth(creds, cfg.REGION, service)
+                host = cfg.OPENSEARCH_ENDPOINT.replace("https://", "")
+                _os = OpenSearch(
+                    hosts=[{"host": host, "port": 443}],
+                    http_auth=auth,
+                    use_ssl=True,
+                    verify_certs=True,
+                    connection_class=RequestsHttpConnection,
+                    timeout=30,
+                    pool_maxsize=20,
+                )
+            logger.info(
+                f"OpenSearch client initialized in {_IMPORT_PROFILE['init.opensearch']} ms."
+            )
+        except Exception as e:
+            logger.error(f"OpenSearch init failed: {e}")
+            _os_unavailable = True
+            _os = None
+    return _os
+
 
 _COUNT_STARTERS = (
     "how many papers",
@@ -607,15 +1531,7 @@ def _doc_url_from_s3_uri(s3_uri: str) -> str:
         bucket, key = parts[0], parts[1]
         if s3 and cfg.S3_BUCKET_NAME and bucket == cfg.S3_BUCKET_NAME:
             try:
-                return s3.generate_presigned_url(
-                    "get_object",
-                    Params={
-                        "Bucket": cfg.S3_BUCKET_NAME,
-                        "Key": key,
-                        "ResponseContentDisposition": "inline"
-                    },
-                    ExpiresIn=3600,
-                )
+                return _presign_get_url(cfg.S3_BUCKET_NAME, key)
             except Exception as e:
                 logger.warning(f"Presign failed for {s3_uri}: {e}")
                 return f"https://{bucket}.s3.amazonaws.com/{key}"
@@ -669,46 +1585,58 @@ def _dedupe_sources_best(items: list[dict]) -> list[dict]:
 
 
 # ---------- Bedrock KB retrieval ----------
-def _kb_retrieve(prompt: str, kb_id: str, k: int = 10) -> tuple[str, list[dict]]:
-    if not kb_id:
-        return "", []
-    try:
-        resp = agent_rt.retrieve(
-            knowledgeBaseId=kb_id,
-            retrievalQuery={"text": prompt},
-            retrievalConfiguration={"vectorSearchConfiguration": {"numberOfResults": k}},
-        )
-        results = resp.get("retrievalResults") or []
+def _presign_kb_uri(s3_uri: str) -> str:
+    """Presign an s3:// URI from our bucket; anything else is returned as-is."""
+    url = s3_uri
+    if s3_uri and cfg.S3_BUCKET_NAME and s3 and s3_uri.startswith(f"s3://{cfg.S3_BUCKET_NAME}/"):
+        try:
+            key = s3_uri.split(f"s3://{cfg.S3_BUCKET_NAME}/", 1)[1]
+            url = _presign_get_url(cfg.S3_BUCKET_NAME, key)
+        except Exception as e:
+            logger.warning(f"Presign failed for {s3_uri}: {e}")
+    return url
+
+
+class _KbRetrieval:
+    """
+    Results of ONE Bedrock Retrieve call for a prompt.
+
+    The answer context, the deduped sources and the relevance-reason snippets
+    are all sliced from the same ranked result list, so a KB-backed answer
+    costs a single Retrieve round-trip. Presigned URLs are computed lazily,
+    once per result.
+    """
+
+    def __init__(self, results: list[dict] | None = None):
+        self.results = results or []
+        self._urls: dict[int, str] = {}
+
+    def __bool__(self) -> bool:
+        return bool(self.results)
+
+    def _url_at(self, i: int) -> str:
+        if i not in self._urls:
+            loc = (self.results[i].get("location") or {}).get("s3Location") or {}
+            self._urls[i] = _presign_kb_uri(loc.get("uri"))
+        return self._urls[i]
+
+    def context(self, k: int = 10) -> tuple[str, list[dict]]:
+        """(joined snippet text, up to 3 deduped sources) from the top-k results."""
+        results = self.results[:k]
         if not results:
             return "", []
         snippets: list[str] = []
         sources_raw: list[dict] = []
-        for r in results:
+        for i, r in enumerate(results):
             txt = (r.get("content") or {}).get("text", "")
             if txt:
                 snippets.append(txt)
-            loc = (r.get("location") or {}).get("s3Location") or {}
-            s3_uri = loc.get("uri")
             score = r.get("score")
             page = (
                 (r.get("metadata") or {})
                 .get("x-amz-bedrock-kb-document-page-number")
             )
-            url = s3_uri
-            if s3_uri and cfg.S3_BUCKET_NAME and s3 and s3_uri.startswith(f"s3://{cfg.S3_BUCKET_NAME}/"):
-                try:
-                    key = s3_uri.split(f"s3://{cfg.S3_BUCKET_NAME}/", 1)[1]
-                    url = s3.generate_presigned_url(
-                        "get_object",
-                        Params={
-                            "Bucket": cfg.S3_BUCKET_NAME,
-                            "Key": key,
-                            "ResponseContentDisposition": "inline"
-                        },
-                        ExpiresIn=3600,
-                    )
-                except Exception as e:
-                    logger.warning(f"Presign failed for {s3_uri}: {e}")
+            url = self._url_at(i)
             src: dict = {"url": url}
             if page is not None:
                 src["page"] = page
@@ -718,81 +1646,569 @@ def _kb_retrieve(prompt: str, kb_id: str, k: int = 10) -> tuple[str, list[dict]]
                 src["label"] = _clean_filename(url)
             sources_raw.append(src)
         deduped = _dedupe_sources_best(sources_raw)
-        # return up to 6 sources
+        # return up to 3 sources
         return ("\n\n".join(snippets).strip(), deduped[:3])
-    except ClientError as e:
-        logger.error(f"KB retrieve ClientError: {e}")
-        return "", []
-    except Exception as e:
-        logger.error(f"KB retrieve unexpected error: {e}")
-        return "", []
 
-
-# ---------- Snippets for reason generation ----------
-def _basename_from_url(u: str) -> str:
-    try:
-        p = urllib.parse.urlparse(u)
-        name = (p.path or "").split("/")[-1]
-        name = urllib.parse.unquote(name or "")
-        name = name.split("?")[0].split("#")[0]
-        return name
-    except Exception:
-        return u or ""
-
-
-def _collect_doc_snippets(prompt: str, k: int = 20) -> dict:
-    out = {}
-    kb_id = cfg.KNOWLEDGE_BASE_ID
-    if not kb_id:
-        return out
-    try:
-        resp = agent_rt.retrieve(
-            knowledgeBaseId=kb_id,
-            retrievalQuery={"text": prompt},
-            retrievalConfiguration={"vectorSearchConfiguration": {"numberOfResults": k}},
-        )
-        results = resp.get("retrievalResults") or []
-        for r in results:
+    def doc_snippets(self, k: int = 20) -> dict:
+        """First snippet per document (keyed by lowercase basename) from the top-k results."""
+        out = {}
+        for i, r in enumerate(self.results[:k]):
             txt = (r.get("content") or {}).get("text") or ""
             loc = (r.get("location") or {}).get("s3Location") or {}
             s3_uri = loc.get("uri") or ""
             if not s3_uri or not txt:
                 continue
-            url = s3_uri
-            if (
-                s3_uri.startswith("s3://")
-                and s3
-                and cfg.S3_BUCKET_NAME
-                and s3_uri.startswith(f"s3://{cfg.S3_BUCKET_NAME}/")
-            ):
-                try:
-                    key = s3_uri.split(f"s3://{cfg.S3_BUCKET_NAME}/", 1)[1]
-                    url = s3.generate_presigned_url(
-                        "get_object",
-                        Params={
-                            "Bucket": cfg.S3_BUCKET_NAME,
-                            "Key": key,
-                            "ResponseContentDisposition": "inline"
-                        },
-                        ExpiresIn=3600,
-                    )
-                except Exception as e:
-                    logger.warning(f"Presign failed for {s3_uri}: {e}")
             key = _basename_from_url(s3_uri).lower()
             if key in out:
                 continue
             out[key] = {
                 "snippet": txt,
-                "url": url,
+                "url": self._url_at(i),
                 "label": _clean_filename(s3_uri),
             }
         return out
+
+
+# ---------- Retrieval cache (warm container) ----------
+KB_CACHE_MAX_ENTRIES = int(os.environ.get("KB_CACHE_MAX_ENTRIES", "256"))
+KB_CACHE_TTL_SECONDS = float(os.environ.get("KB_CACHE_TTL_SECONDS", "900"))
+# How often to ask Bedrock whether a newer ingestion job has completed.
+KB_VERSION_CHECK_SECONDS = float(os.environ.get("KB_VERSION_CHECK_SECONDS", "60"))
+
+
+class _TtlLruCache:
+    """Small thread-safe LRU cache with per-entry TTL and hit/miss counters."""
+
+    def __init__(self, max_entries: int, ttl_seconds: float):
+        self.max_entries = max(0, max_entries)
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self._data: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry[0] > now:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                del self._data[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        if not self.max_entries or self.ttl_seconds <= 0:
+            return
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl_seconds, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self._data)}
+
+
+_KB_CACHE = _TtlLruCache(KB_CACHE_MAX_ENTRIES, KB_CACHE_TTL_SECONDS)
+
+# Presigned URLs are reused until less than PRESIGN_MIN_REMAINING_SECONDS of
+# validity is left, so every link we hand out stays usable for at least that long.
+PRESIGN_EXPIRES_SECONDS = int(os.environ.get("PRESIGN_EXPIRES_SECONDS", "3600"))
+PRESIGN_MIN_REMAINING_SECONDS = int(os.environ.get("PRESIGN_MIN_REMAINING_SECONDS", "900"))
+_PRESIGN_CACHE = _TtlLruCache(
+    int(os.environ.get("PRESIGN_CACHE_MAX_ENTRIES", "1024")),
+    PRESIGN_EXPIRES_SECONDS - PRESIGN_MIN_REMAINING_SECONDS,
+)
+
+
+def _presign_get_url(bucket: str, key: str, disposition: str = "inline") -> str:
+    """Memoized s3.generate_presigned_url for get_object; raises on signing errors."""
+    cache_key = (bucket, key, disposition)
+    url = _PRESIGN_CACHE.get(cache_key)
+    if url is None:
+        url = s3.generate_presigned_url(
+            "get_object",
+            Params={
+                "Bucket": bucket,
+                "Key": key,
+                "ResponseContentDisposition": disposition
+            },
+            ExpiresIn=PRESIGN_EXPIRES_SECONDS,
+        )
+        _PRESIGN_CACHE.put(cache_key, url)
+    return url
+
+
+_KB_VERSION = None
+_KB_VERSION_CHECKED_AT = 0.0
+_bedrock_agent = _LazyClient("bedrock-agent", region_name=cfg.REGION)
+
+
+def _latest_ingestion_marker(kb_id: str) -> str | None:
+    """ID + end time of the newest COMPLETE ingestion job, or None if unknown."""
+    ds_id = _get_env("DATA_SOURCE_ID")
+    if not (kb_id and ds_id):
+        return None
+    resp = _bedrock_agent.list_ingestion_jobs(
+        knowledgeBaseId=kb_id,
+        dataSourceId=ds_id,
+        filters=[{"attribute": "STATUS", "operator": "EQ", "values": ["COMPLETE"]}],
+        sortBy={"attribute": "STARTED_AT", "order": "DESCENDING"},
+        maxResults=1,
+    )
+    jobs = resp.get("ingestionJobSummaries") or []
+    if not jobs:
+        return None
+    job = jobs[0]
+    return f"{job.get('ingestionJobId')}@{job.get('updatedAt')}"
+
+
+def _refresh_kb_version(kb_id: str):
+    """Drop cached retrievals when a newer ingestion job has finished."""
+    global _KB_VERSION, _KB_VERSION_CHECKED_AT
+    now = time.monotonic()
+    if now - _KB_VERSION_CHECKED_AT < KB_VERSION_CHECK_SECONDS:
+        return
+    _KB_VERSION_CHECKED_AT = now
+    try:
+        marker = _latest_ingestion_marker(kb_id)
+    except Exception as e:
+        logger.warning(f"Ingestion job check failed: {e}")
+        return
+    if marker and marker != _KB_VERSION:
+        if _KB_VERSION is not None:
+            logger.info(f"KB ingestion changed ({_KB_VERSION} -> {marker}); clearing retrieval/count caches")
+            _KB_CACHE.clear()
+            _COUNT_CACHE.clear()
+        _KB_VERSION = marker
+
+
+def _retrieval_cache_key(prompt: str, kb_id: str, k: int) -> tuple:
+    return (kb_id, k, " ".join(_norm(prompt).split()))
+
+
+def _kb_retrieve_once(prompt: str, kb_id: str, k: int = 20) -> _KbRetrieval:
+    """Single Retrieve call, served from the warm-container cache when possible; errors yield an empty result."""
+    if not kb_id:
+        return _KbRetrieval()
+    _refresh_kb_version(kb_id)
+    cache_key = _retrieval_cache_key(prompt, kb_id, k)
+    cached = _KB_CACHE.get(cache_key)
+    if cached is not None:
+        logger.info(f"KB retrieve cache hit k={k} stats={_KB_CACHE.stats()}")
+        return _KbRetrieval(cached)
+    try:
+        resp = agent_rt.retrieve(
+            knowledgeBaseId=kb_id,
+            retrievalQuery={"text": prompt},
+            retrievalConfiguration={"vectorSearchConfiguration": {"numberOfResults": k}},
+        )
+        results = resp.get("retrievalResults") or []
+        _KB_CACHE.put(cache_key, results)
+        logger.info(f"KB retrieve cache miss k={k} stats={_KB_CACHE.stats()}")
+        return _KbRetrieval(results)
+    except ClientError as e:
+        logger.error(f"KB retrieve ClientError: {e}")
+        return _KbRetrieval()
+    except Exception as e:
+        logger.error(f"KB retrieve unexpected error: {e}")
+        return _KbRetrieval()
+
+
+def _kb_retrieve(prompt: str, kb_id: str, k: int = 10) -> tuple[str, list[dict]]:
+    return _kb_retrieve_once(prompt, kb_id, k).context(k)
+
+
+# ---------- Snippets for reason generation ----------
+def _basename_from_url(u: str) -> str:
+    try:
+        p = urllib.parse.urlparse(u)
+        name = (p.path or "").split("/")[-1]
+        name = urllib.parse.unquote(name or "")
+        name = name.split("?")[0].split("#")[0]
+        return name
+    except Exception:
+        return u or ""
+
+
+def _collect_doc_snippets(
+    prompt: str,
+    k: int = 20,
+    retrieval: _KbRetrieval | None = None,
+) -> dict:
+    """Per-document snippets; reuses `retrieval` instead of calling Retrieve again."""
+    if retrieval is None:
+        retrieval = _kb_retrieve_once(prompt, cfg.KNOWLEDGE_BASE_ID, k)
+    try:
+        return retrieval.doc_snippets(k)
     except Exception as e:
         logger.warning(f"_collect_doc_snippets error: {e}")
-        return out
+        return {}
+
+
+# ---------- Model gateway (retry, fallback, admission) ----------
+# Every Bedrock converse/converse_stream call goes through _MODEL_GATEWAY:
+# - admission: per-container RPM/TPM token buckets (0 disables a limit);
+# - fallback: on throttling/unavailability the next ID in MODEL_FALLBACK_IDS
+#   is tried; a fallback the caller cannot invoke is skipped;
+# - retry: after a full pass over the chain, jittered exponential backoff.
+# Error codes are compared case-insensitively: in-stream errors arrive as
+# botocore EventStreamError with camelCase codes (throttlingException).
+MODEL_FALLBACK_IDS = [
+    m.strip() for m in os.environ.get("MODEL_FALLBACK_IDS", "").split(",") if m.strip()
+]
+MODEL_MAX_RETRIES = int(os.environ.get("MODEL_MAX_RETRIES", "2"))
+MODEL_RETRY_BASE_SECONDS = float(os.environ.get("MODEL_RETRY_BASE_SECONDS", "0.5"))
+MODEL_RETRY_MAX_SECONDS = float(os.environ.get("MODEL_RETRY_MAX_SECONDS", "8"))
+MODEL_RPM_LIMIT = float(os.environ.get("MODEL_RPM_LIMIT", "0"))
+MODEL_TPM_LIMIT = float(os.environ.get("MODEL_TPM_LIMIT", "0"))
+MODEL_ADMISSION_MAX_WAIT_SECONDS = float(os.environ.get("MODEL_ADMISSION_MAX_WAIT_SECONDS", "10"))
+_MODEL_FALLBACK_CODES = {
+    "throttlingexception", "toomanyrequestsexception", "serviceunavailableexception",
+    "modelnotreadyexception", "modeltimeoutexception", "internalserverexception",
+}
+# From a fallback only: e.g. an on-demand ID that needs an inference profile.
+_MODEL_SKIP_CODES = {"validationexception", "accessdeniedexception", "resourcenotfoundexception"}
+_MODEL_STREAM_FALLBACK_EVENTS = (
+    "throttlingException", "serviceUnavailableException", "internalServerException",
+)
+
+
+class _TokenBucket:
+    """Refills at `per_minute`/60 per second up to `per_minute`; may go into debt via charge()."""
+
+    def __init__(self, per_minute: float):
+        self.capacity = per_minute
+        self.rate = per_minute / 60.0
+        self.tokens = per_minute
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self, n: float, max_wait: float) -> float:
+        """Take `n` tokens, waiting up to `max_wait`; returns seconds waited."""
+        if self.capacity <= 0:
+            return 0.0
+        n = min(n, self.capacity)
+        waited = 0.0
+        while True:
+            with self._lock:
+                self._refill()
+                if self.tokens >= n or waited >= max_wait:
+                    self.tokens -= n
+                    return waited
+                delay = min(max_wait - waited, (n - self.tokens) / self.rate)
+            time.sleep(delay)
+            waited += delay
+
+    def charge(self, n: float):
+        if self.capacity <= 0 or n <= 0:
+            return
+        with self._lock:
+            self._refill()
+            self.tokens -= n
+
+
+class _PeekedStream:
+    """converse_stream event stream with its first event already read."""
+
+    def __init__(self, first, rest):
+        self._first = first
+        self._rest = rest
+
+    def __iter__(self):
+        if self._first is not None:
+            yield self._first
+        yield from self._rest
+
+    def close(self):
+        if hasattr(self._rest, "close"):
+            self._rest.close()
+
+
+class _ModelGateway:
+    def __init__(self, fallback_ids: list[str]):
+        self.fallback_ids = fallback_ids
+        self.rpm = _TokenBucket(MODEL_RPM_LIMIT)
+        self.tpm = _TokenBucket(MODEL_TPM_LIMIT)
+
+    def _chain(self, model_id: str) -> list[str]:
+        chain = []
+        for m in [model_id, *self.fallback_ids]:
+            if m and m not in chain:
+                chain.append(m)
+        return chain
+
+    @staticmethod
+    def _estimate_input_tokens(kwargs: dict) -> int:
+        texts = [
+            c.get("text", "")
+            for m in kwargs.get("messages") or []
+            for c in (m.get("content") or [])
+            if isinstance(c, dict)
+        ]
+        texts += [b.get("text", "") for b in kwargs.get("system") or [] if isinstance(b, dict)]
+        return sum(_estimate_tokens(t) for t in texts)
+
+    def _admit(self, kwargs: dict):
+        waited = self.rpm.acquire(1, MODEL_ADMISSION_MAX_WAIT_SECONDS)
+        waited += self.tpm.acquire(
+            self._estimate_input_tokens(kwargs), MODEL_ADMISSION_MAX_WAIT_SECONDS
+        )
+        if waited > 0:
+            logger.info(f"Model admission waited {waited:.2f}s (RPM/TPM budget)")
+
+    def charge_output(self, output_tokens: int):
+        """Called by _record_model_usage once the real output size is known."""
+        self.tpm.charge(output_tokens)
+
+    def _call(self, op: str, kwargs: dict):
+        kwargs = {k: v for k, v in kwargs.items() if v is not None}
+        chain = self._chain(kwargs.get("modelId") or MODEL_ID)
+        if not chain:
+            raise RuntimeError("no model configured (set INFERENCE_PROFILE_ID/LLM_MODEL_ID or MODEL_FALLBACK_IDS)")
+        self._admit(kwargs)
+        last_error = None
+        for attempt in range(MODEL_MAX_RETRIES + 1):
+            if attempt:
+                delay = min(MODEL_RETRY_MAX_SECONDS, MODEL_RETRY_BASE_SECONDS * (2 ** (attempt - 1)))
+                time.sleep(random.uniform(delay / 2, delay))
+            for model_id in list(chain):
+                try:
+                    resp = getattr(brt, op)(**{**kwargs, "modelId": model_id})
+                    if op == "converse_stream":
+                        resp = self._check_stream_start(resp)
+                except ClientError as e:
+                    code = e.response.get("Error", {}).get("Code", "")
+                    if model_id != chain[0] and code.lower() in _MODEL_SKIP_CODES:
+                        chain.remove(model_id)
+                        logger.warning(f"Fallback model {model_id} {op} unusable ({code}); skipping it")
+                        continue
+                    if code.lower() not in _MODEL_FALLBACK_CODES:
+                        raise
+                    last_error = e
+                    logger.warning(f"Model {model_id} {op} failed ({code}); trying next")
+                    continue
+                if model_id != chain[0] or attempt:
+                    logger.info(f"Model {op} served by {model_id} (attempt {attempt + 1})")
+                return {**resp, "servedModelId": model_id}
+        raise last_error
+
+    @staticmethod
+    def _check_stream_start(resp):
+        """Throttling often arrives as the first stream event; surface it as a ClientError."""
+        stream = resp.get("stream")
+        if not stream:
+            return resp
+        it = iter(stream)
+        try:
+            first = next(it, None)
+        except ClientError as e:
+            # botocore raises EventStreamError (a ClientError) for an error
+            # event, with the camelCase code; _call compares codes caselessly.
+            code = e.response.get("Error", {}).get("Code", "")
+            logger.info(f"Model stream failed before its first event ({code})")
+            raise
+        for key in _MODEL_STREAM_FALLBACK_EVENTS:
+            if isinstance(first, dict) and key in first:
+                code = key[0].upper() + key[1:]
+                raise ClientError(
+                    {"Error": {"Code": code, "Message": str(first[key])}}, "ConverseStream"
+                )
+        return {**resp, "stream": _PeekedStream(first, it)}
+
+    def converse(self, **kwargs):
+        return self._call("converse", kwargs)
+
+    def converse_stream(self, **kwargs):
+        return self._call("converse_stream", kwargs)
+
+
+# Only explicit fallbacks: LLM_MODEL_ID may be an on-demand ID that only an
+# inference profile can invoke.
+_MODEL_GATEWAY = _ModelGateway(MODEL_FALLBACK_IDS)
+
+
+# ---------- Model usage & cost ----------
+# Every model call records usage/latency from its response (converse) or the
+# trailing `metadata` event (converse_stream). Totals are logged once per
+# invocation, together with running per-route totals for this container.
+_MODEL_PRICING = {**MODEL_PRICING, **json.loads(os.environ.get("MODEL_PRICING_JSON") or "{}")}
+_USAGE_FIELDS = (
+    ("input", "inputTokens"),
+    ("output", "outputTokens"),
+    ("cache_read", "cacheReadInputTokens"),
+    ("cache_write", "cacheWriteInputTokens"),
+)
+
+
+def _price_for(model_id: str) -> dict:
+    keys = [k for k in _MODEL_PRICING if k in (model_id or "")]
+    return _MODEL_PRICING[max(keys, key=len)] if keys else {}
+
+
+def _usage_cost(model_id: str, tokens: dict) -> float:
+    price = _price_for(model_id)
+    return sum(tokens.get(k, 0) / 1000.0 * price.get(k, 0.0) for k, _ in _USAGE_FIELDS)
+
+
+class _UsageLedger:
+    def __init__(self):
+        self.calls: list[dict] = []
+        self._lock = threading.Lock()
+
+    def record(self, purpose: str, model_id: str, payload: dict):
+        usage = (payload or {}).get("usage") or {}
+        tokens = {k: int(usage.get(src) or 0) for k, src in _USAGE_FIELDS}
+        call = {
+            "purpose": purpose,
+            "model": model_id,
+            **tokens,
+            "latency_ms": int(((payload or {}).get("metrics") or {}).get("latencyMs") or 0),
+            "cost_usd": _usage_cost(model_id, tokens),
+        }
+        with self._lock:
+            self.calls.append(call)
+        return call
+
+    def record_cancelled(self, purpose: str, model_id: str, output_tokens_est: int):
+        call = {
+            "purpose": purpose, "model": model_id, "cancelled_output_est": output_tokens_est,
+            "cost_usd": _usage_cost(model_id, {"output": output_tokens_est}),
+        }
+        with self._lock:
+            self.calls.append(call)
+
+    def summary(self) -> dict:
+        totals: dict = {}
+        by_purpose: dict = {}
+        with self._lock:
+            calls = list(self.calls)
+        for call in calls:
+            bucket = by_purpose.setdefault(call["purpose"], {})
+            for k, v in call.items():
+                if isinstance(v, (int, float)):
+                    totals[k] = totals.get(k, 0) + v
+                    bucket[k] = bucket.get(k, 0) + v
+            bucket["calls"] = bucket.get("calls", 0) + 1
+        totals["calls"] = len(calls)
+        for d in [totals, *by_purpose.values()]:
+            if "cost_usd" in d:
+                d["cost_usd"] = round(d["cost_usd"], 6)
+        return {"totals": totals, "by_purpose": by_purpose}
+
+
+_USAGE: _UsageLedger | None = None
+# Running totals per route for the life of this container.
+_ROUTE_USAGE: dict[str, dict] = {}
+
+
+def _current_usage() -> _UsageLedger | None:
+    return getattr(_BOUND, "usage", _USAGE)
+
+
+def _record_model_usage(purpose: str, model_id: str, payload: dict):
+    """payload: a converse response or a converse_stream `metadata` event."""
+    call = (_current_usage() or _UsageLedger()).record(purpose, model_id, payload)
+    _MODEL_GATEWAY.charge_output(call["output"])
+    logger.info(
+        f"Model usage ({purpose}): model={model_id} input={call['input']} "
+        f"output={call['output']} cache_read={call['cache_read']} "
+        f"cache_write={call['cache_write']} latency_ms={call['latency_ms']}"
+    )
+
+
+def _log_usage_summary(route: str):
+    if _USAGE is None or not _USAGE.calls:
+        return
+    summary = _USAGE.summary()
+    running = _ROUTE_USAGE.setdefault(route, {"requests": 0})
+    running["requests"] += 1
+    for k, v in summary["totals"].items():
+        running[k] = round(running.get(k, 0) + v, 6)
+    logger.info(json.dumps({
+        "event": "model_usage",
+        "route": route,
+        "request": summary["totals"],
+        "by_purpose": summary["by_purpose"],
+        "route_running_totals": running,
+    }))
 
 
 # ---------- Model helpers ----------
+# Post-answer enrichment calls (relevance reasons, sources lead-in) run here
+# while the main answer streams.
+_ENRICH_POOL = ThreadPoolExecutor(
+    max_workers=int(os.environ.get("ENRICH_MAX_WORKERS", "4")),
+    thread_name_prefix="enrich",
+)
+# How long the finished answer waits, in total, on the enrichment calls
+# before the sources block falls back to no reasons / a random lead-in.
+ENRICH_WAIT_SECONDS = float(os.environ.get("ENRICH_WAIT_SECONDS", "8"))
+
+
+class _Enrichment:
+    """
+    Enrichment model calls for one answer. Jobs are added once retrieval is
+    done and submitted to _ENRICH_POOL by start(); each worker re-checks the
+    cancellation right before its model call (a running call can't be
+    stopped, so that check is what skips the spend). result() waits until a
+    shared deadline and is None for a job that was never added or was skipped.
+    """
+
+    def __init__(self, cancel):
+        self.cancel = cancel
+        self.started = False
+        self._jobs: dict[str, tuple] = {}
+        self._futures: dict = {}
+
+    def add(self, name: str, fn, *args):
+        self._jobs[name] = (fn, args)
+
+    def has(self, name: str) -> bool:
+        return name in self._jobs or name in self._futures
+
+    def start(self):
+        if self.started:
+            return
+        self.started = True
+        for name, (fn, args) in self._jobs.items():
+            self._futures[name] = _ENRICH_POOL.submit(_traced(name, self._run, name, fn, *args))
+        self._jobs = {}
+
+    def _run(self, name: str, fn, *args):
+        if self.cancel.is_set():
+            logger.info(f"Skipping {name} enrichment: client gone ({self.cancel.reason})")
+            return None
+        return fn(*args)
+
+    def result(self, name: str, deadline: float):
+        """Wait for a job until `deadline` (time.monotonic()); raises TimeoutError past it."""
+        fut = self._futures.get(name)
+        if fut is None:
+            return None
+        return fut.result(timeout=max(0.0, deadline - time.monotonic()))
+
+    def abandon(self):
+        self.started = True
+        self._jobs = {}
+        for fut in self._futures.values():
+            fut.cancel()
+
+
 def _extract_text_from_converse(resp) -> str:
     try:
         parts = (resp.get("output") or {}).get("message", {}).get("content", [])
@@ -804,37 +2220,40 @@ def _extract_text_from_converse(resp) -> str:
         return ""
 
 
-def _model_complete_text(messages, system=None) -> str:
-    try:
-        kwargs = {"modelId": MODEL_ID, "messages": messages}
-        if system:
-            kwargs["system"] = (
-                [{"text": system}] if isinstance(system, str) else system
-            )
-        resp = brt.converse(**kwargs)
-        text = _extract_text_from_converse(resp)
-        if text:
-            return text
-    except Exception as e:
-        logger.warning(f"converse failed, falling back to stream: {e}")
+# Converse prompt caching: everything before a cachePoint block is reused
+# across requests, so static instructions go in `system` ahead of the
+# checkpoint and per-request text goes in the final user turn.
+# Bedrock ignores a cachePoint until the prefix reaches the model's minimum
+# (1024 tokens for Claude 3.7 / Sonnet 4). The stock prefix (system prompt +
+# CORE_CONTEXT + instructions) is ~3.1K chars, about 600-800 tokens, so caching
+# is off by default; when enabled, the checkpoint is only added to prefixes
+# estimated (chars / 4) to clear PROMPT_CACHE_MIN_TOKENS.
+PROMPT_CACHE_ENABLED = os.environ.get("PROMPT_CACHE_ENABLED", "false").lower() in ("1", "true", "yes")
+PROMPT_CACHE_MIN_TOKENS = int(os.environ.get("PROMPT_CACHE_MIN_TOKENS", "1024"))
+_CACHE_POINT = {"cachePoint": {"type": "default"}}
+
+
+def _cached_system(*parts: str) -> list[dict]:
+    blocks = [{"text": p} for p in parts if p]
+    if (
+        PROMPT_CACHE_ENABLED and blocks
+        and sum(len(b["text"]) for b in blocks) // 4 >= PROMPT_CACHE_MIN_TOKENS
+    ):
+        blocks.append(_CACHE_POINT)
+    return blocks
+
+
+def _model_complete_text(messages, system=None, purpose: str = "complete") -> str:
     try:
-        resp = brt.converse_stream(
+        resp = _MODEL_GATEWAY.converse(
             modelId=MODEL_ID,
             messages=messages,
-            system=([{"text": system}] if system else None)
+            system=([{"text": system}] if isinstance(system, str) else system) or None,
         )
-        stream = resp.get("stream")
-        acc = []
-        for ev in stream:
-            if "contentBlockDelta" in ev:
-                delta = (ev["contentBlockDelta"].get("delta") or {}).get("text")
-                if delta:
-                    acc.append(delta)
-            elif "messageStop" in ev:
-                break
-        return "".join(acc)
+        _record_model_usage(purpose, resp.get("servedModelId", MODEL_ID), resp)
+        return _extract_text_from_converse(resp)
     except Exception as e:
-        logger.error(f"converse_stream failed: {e}")
+        logger.error(f"converse failed: {e}")
         return ""
 
 
@@ -874,7 +2293,7 @@ def _gen_relevance_reasons_via_model(user_prompt: str, doc_snips: dict) -> dict:
         "Docs:\n" + json.dumps({"docs": docs_arr}, ensure_ascii=False)
     )
     messages = [{"role": "user", "content": [{"text": user_text}]}]
-    txt = _model_complete_text(messages, system=system_text)
+    txt = _model_complete_text(messages, system=system_text, purpose="reasons")
     obj = _safe_json_from_text(txt)
     if "reasons" in obj and isinstance(obj["reasons"], dict):
         return {k: (v or "").strip() for k, v in obj["reasons"].items()}
@@ -898,7 +2317,7 @@ def _gen_sources_leadin_via_model(user_prompt: str) -> str:
         "'Here are a few additional resources you might find useful.')."
     )
     messages = [{"role": "user", "content": [{"text": user_text}]}]
-    out = (_model_complete_text(messages, system=system_text) or "").strip()
+    out = (_model_complete_text(messages, system=system_text, purpose="leadin") or "").strip()
     out = re.sub(r"[\r\n]+", " ", out).strip()
     if not out:
         out = "Here are a few additional resources you might find useful."
@@ -945,6 +2364,147 @@ def _pick_sources_leadin(user_prompt: str) -> str:
         return _random_sources_leadin()
 
 
+# ---------- History window (token budget + rolling summary) ----------
+# Recent turns are sent verbatim while they fit HISTORY_TOKEN_BUDGET; older
+# turns are folded into a model-written summary. When the budget is exceeded
+# we fold down to HISTORY_REFOLD_RATIO of the budget, so the same summary is
+# reused for the next few turns instead of being rewritten every time.
+HISTORY_TOKEN_BUDGET = int(os.environ.get("HISTORY_TOKEN_BUDGET", "2000"))
+HISTORY_REFOLD_RATIO = float(os.environ.get("HISTORY_REFOLD_RATIO", "0.5"))
+HISTORY_SUMMARY_MAX_WORDS = int(os.environ.get("HISTORY_SUMMARY_MAX_WORDS", "150"))
+HISTORY_CHARS_PER_TOKEN = float(os.environ.get("HISTORY_CHARS_PER_TOKEN", "4"))
+# Keyed by a hash chain over the folded turns: key(turns[:n]) -> summary.
+_HISTORY_SUMMARY_CACHE = _TtlLruCache(
+    int(os.environ.get("HISTORY_SUMMARY_CACHE_MAX_ENTRIES", "512")),
+    float(os.environ.get("HISTORY_SUMMARY_CACHE_TTL_SECONDS", "3600")),
+)
+
+
+def _estimate_tokens(text: str) -> int:
+    # Cheap chars/token heuristic; Bedrock reports real usage after the call.
+    return int(math.ceil(len(text or "") / HISTORY_CHARS_PER_TOKEN)) + 4
+
+
+def _message_text(msg: dict) -> str:
+    return "".join(
+        c.get("text", "") for c in (msg.get("content") or [])
+        if isinstance(c, dict)
+    )
+
+
+def _history_prefix_keys(messages: list[dict]) -> list[str]:
+    """keys[n] identifies messages[:n]; equal prefixes give equal keys."""
+    keys = [""]
+    h = hashlib.sha1()
+    for msg in messages:
+        h.update(f"{msg.get('role')}\x1f{_message_text(msg)}\x1e".encode("utf-8"))
+        keys.append(h.copy().hexdigest())
+    return keys
+
+
+def _summarize_history(previous: str, messages: list[dict]) -> str:
+    transcript = "\n".join(
+        f"{'User' if m.get('role') == 'user' else 'Assistant'}: {_message_text(m)}"
+        for m in messages
+    )
+    user_text = (
+        "Update the running summary of this conversation with the new turns. "
+        "Keep names, countries, numbers, documents and open questions the user "
+        f"may refer back to. Plain prose, at most {HISTORY_SUMMARY_MAX_WORDS} words.\n\n"
+        f"<summary_so_far>\n{previous or '(none)'}\n</summary_so_far>\n"
+        f"<new_turns>\n{transcript}\n</new_turns>"
+    )
+    return _model_complete_text(
+        [{"role": "user", "content": [{"text": user_text}]}],
+        system="You maintain a concise running summary of a chat. Return only the summary.",
+        purpose="history_summary",
+    ).strip()
+
+
+def _history_window(history_messages: list[dict] | None) -> tuple[list[dict], str, dict]:
+    """
+    Fit `history_messages` into HISTORY_TOKEN_BUDGET. Returns the turns to
+    send verbatim, the summary of the folded turns ("" if none) and stats
+    (tokens_in, tokens_sent, tokens_saved, kept, folded, summary=none|hit|new|failed).
+    """
+    msgs = list(history_messages or [])
+    costs = [_estimate_tokens(_message_text(m)) for m in msgs]
+    tokens_in = sum(costs)
+    stats = {
+        "turns": len(msgs), "kept": len(msgs), "folded": 0, "summary": "none",
+        "tokens_in": tokens_in, "tokens_sent": tokens_in, "tokens_saved": 0,
+    }
+    if tokens_in <= HISTORY_TOKEN_BUDGET:
+        return msgs, "", stats
+
+    # suffix[i] = tokens of msgs[i:]; a window must start on a user turn.
+    suffix = [0] * (len(msgs) + 1)
+    for i in range(len(msgs) - 1, -1, -1):
+        suffix[i] = suffix[i + 1] + costs[i]
+    starts = [i for i, m in enumerate(msgs) if m.get("role") == "user"] + [len(msgs)]
+
+    def _first_start_within(budget: float) -> int:
+        return next(i for i in starts if suffix[i] <= budget)
+
+    keys = _history_prefix_keys(msgs)
+    min_cut = _first_start_within(HISTORY_TOKEN_BUDGET)
+
+    # Reuse a summary we already wrote for this conversation if its window fits.
+    cut, summary = min_cut, None
+    for i in starts:
+        if i >= min_cut and i > 0:
+            summary = _HISTORY_SUMMARY_CACHE.get(keys[i])
+            if summary is not None:
+                cut = i
+                stats["summary"] = "hit"
+                break
+
+    if summary is None:
+        cut = _first_start_within(HISTORY_TOKEN_BUDGET * HISTORY_REFOLD_RATIO)
+        # Extend the longest cached summary of an earlier prefix, if any.
+        base, previous = 0, ""
+        for i in range(cut - 1, 0, -1):
+            cached = _HISTORY_SUMMARY_CACHE.get(keys[i])
+            if cached is not None:
+                base, previous = i, cached
+                break
+        try:
+            summary = _summarize_history(previous, msgs[base:cut])
+        except Exception as e:
+            logger.warning(f"History summary failed: {e}")
+            summary = ""
+        if summary:
+            _HISTORY_SUMMARY_CACHE.put(keys[cut], summary)
+            stats["summary"] = "new"
+        else:
+            # Fall back to plain truncation at the budget boundary.
+            cut, stats["summary"] = min_cut, "failed"
+
+    sent = suffix[cut] + (_estimate_tokens(summary) if summary else 0)
+    stats.update(
+        kept=len(msgs) - cut, folded=cut, tokens_sent=sent,
+        tokens_saved=max(0, tokens_in - sent),
+    )
+    return msgs[cut:], summary or "", stats
+
+
+def _messages_with_history(
+    history_messages: list[dict] | None, user_text: str, route: str
+) -> list[dict]:
+    """History window + the new user turn; the summary rides on the first user turn."""
+    with _span("history"):
+        window, summary, stats = _history_window(history_messages)
+    if stats["turns"]:
+        logger.info(f"History window ({route}): {json.dumps(stats)}")
+    messages = list(window) + [{"role": "user", "content": [{"text": user_text}]}]
+    if summary:
+        note = f"<conversation_summary>\n{summary}\n</conversation_summary>"
+        first = dict(messages[0])
+        first["content"] = [{"text": note}] + list(first.get("content") or [])
+        messages[0] = first
+    return messages
+
+
 # ---------- Varied, context-aware follow-up ----------
 def _pick_follow_up(
     user_prompt: str,
@@ -1049,13 +2609,23 @@ def _kb_retrieve_for_doc(
     return (all_text if filtered_sources else all_text), (filtered_sources or all_sources)
 
 
+_SUMMARY_INSTRUCTIONS = (
+    "Be accurate and concise. "
+    "You will summarize an official PDF. Use ONLY the provided snippets; do not invent facts. "
+    "Write a clear, paragraph-style summary (3–6 sentences) in plain English. "
+    "Do NOT include a title, headings, or bullet points—just narrative prose. "
+    "If something is unclear, say so briefly."
+)
+
+
 def _stream_summary_from_chunks(
     connection_id: str,
     prompt: str,
     doc_url: str,
     history_messages: list[dict] | None = None
 ):
-    kb_text, kb_sources = _kb_retrieve_for_doc(prompt, doc_url, k=20)
+    with _span("retrieve"):
+        kb_text, kb_sources = _kb_retrieve_for_doc(prompt, doc_url, k=20)
     if not kb_text:
         _end_with_error(
             connection_id,
@@ -1065,28 +2635,21 @@ def _stream_summary_from_chunks(
         return
 
     user_text = (
-        "You will summarize an official PDF. Use ONLY the provided snippets; do not invent facts. "
-        "Write a clear, paragraph-style summary (3–6 sentences) in plain English. "
-        "Do NOT include a title, headings, or bullet points—just narrative prose. "
-        "If something is unclear, say so briefly.\n\n"
         f"<doc_url>{doc_url}</doc_url>\n"
         "<knowledge_snippets>\n"
         f"{kb_text}\n"
         "</knowledge_snippets>\n\n"
         f"User request: {prompt}"
     )
-    messages: list[dict] = []
-    if history_messages:
-        messages.extend(history_messages)
-    messages.append({"role": "user", "content": [{"text": user_text}]})
-    system = (
-        [{"text": (cfg.SYSTEM_PROMPT or "") + "\nBe accurate and concise."}]
-        if cfg.SYSTEM_PROMPT else
-        [{"text": "Be accurate and concise."}]
-    )
+    messages = _messages_with_history(history_messages, user_text, "summary")
+    system = _cached_system(cfg.SYSTEM_PROMPT, _SUMMARY_INSTRUCTIONS)
 
+    formatter = _MarkdownStreamTransformer()
+    t_stream = time.perf_counter()
     try:
-        resp = brt.converse_stream(modelId=MODEL_ID, messages=messages, system=system)
+        resp = _MODEL_GATEWAY.converse_stream(
+            modelId=MODEL_ID, messages=_resume_stream(messages, formatter), system=system
+        )
     except ClientError as e:
         logger.error(f"Bedrock ClientError (summary): {e}")
         _end_with_error(
@@ -1101,31 +2664,37 @@ def _stream_summary_from_chunks(
         _end_with_error(connection_id, "Model stream not available.", 500)
         return
 
-    pending = ""
-    TAIL = 200  # keep a tail so we don't split numbers/percentages across chunks
+    raw_parts: list[str] = []
+    cancel = _Cancellation(connection_id)
+
+    def _send_summary_text(text: str):
+        if text:
+            _send_ws(
+                connection_id,
+                {
+                    "type": "delta",
+                    "statusCode": 200,
+                    "format": "markdown",
+                    "text": text,
+                },
+            )
 
     for ev in stream:
+        if cancel.is_set():
+            _abort_generation(
+                "summary", cancel, stream, "".join(raw_parts),
+                model_id=resp.get("servedModelId", MODEL_ID),
+            )
+            return
         if "contentBlockDelta" in ev:
             delta = (ev["contentBlockDelta"].get("delta") or {}).get("text") or ""
-            pending += delta
-            if len(pending) > 600 or "\n" in delta:
-                safe = pending[:-TAIL]
-                pending = pending[-TAIL:]
-                if safe:
-                    safe = _linkify_bare_urls(safe)
-                    safe = _emphasize_stats(safe)
-                    _send_ws(
-                        connection_id,
-                        {
-                            "type": "delta",
-                            "statusCode": 200,
-                            "format": "markdown",
-                            "text": safe,
-                        },
-                    )
+            if delta and not raw_parts:
+                _trace_mark("model_first_token")
+            raw_parts.append(delta)
+            _send_summary_text(formatter.feed(_note_model_text(delta)))
 
-        elif "messageStop" in ev:
-            break
+        elif "metadata" in ev:
+            _record_model_usage("summary", resp.get("servedModelId", MODEL_ID), ev["metadata"])
         elif (
             "internalServerException" in ev
             or "modelStreamErrorException" in ev
@@ -1142,18 +2711,8 @@ def _stream_summary_from_chunks(
             _end_with_error(connection_id, "Model streaming error.", 500)
             return
 
-    if pending:
-        tail = _linkify_bare_urls(pending)
-        tail = _emphasize_stats(tail)
-        _send_ws(
-            connection_id,
-            {
-                "type": "delta",
-                "statusCode": 200,
-                "format": "markdown",
-                "text": tail,
-            },
-        )
+    _trace_since("model_stream", t_stream)
+    _send_summary_text(_finish_stream(formatter))
 
     try:
         follow_up = _pick_follow_up(
@@ -1178,17 +2737,268 @@ def _stream_summary_from_chunks(
 
 
 # ---------- WebSocket helpers ----------
+# Delta texts sent during the current invocation; saved as the BOT turn.
+_REPLY_PARTS: list[str] | None = None
+
+
+WS_COALESCE_MS = float(os.environ.get("WS_COALESCE_MS", "20"))
+WS_COALESCE_MAX_CHARS = int(os.environ.get("WS_COALESCE_MAX_CHARS", "4000"))
+WS_MAX_RETRIES = int(os.environ.get("WS_MAX_RETRIES", "4"))
+WS_RETRY_BASE_SECONDS = float(os.environ.get("WS_RETRY_BASE_SECONDS", "0.05"))
+_WS_THROTTLE_CODES = {"ThrottlingException", "TooManyRequestsException", "LimitExceededException"}
+_WS_CLOSE = object()
+
+
+class _WsSender:
+    """
+    Per-connection outbound queue drained by a worker thread, so a slow
+    post_to_connection never stalls the Bedrock stream reader.
+
+    Adjacent `delta` frames with the same format are merged for up to
+    WS_COALESCE_MS / WS_COALESCE_MAX_CHARS (the very first frame goes out
+    immediately; a merged frame keeps the first frame's other fields, such
+    as its `offset`). Throttled posts are retried with jittered backoff; frames
+    are posted strictly in order and send() blocks on an `end` frame until
+    everything before it has been delivered. `on_posted(payload, snapshot)`
+    runs on the worker after each accepted post, with the snapshot the last
+    frame merged into it was sent with.
+    """
+
+    def __init__(self, connection_id: str, on_posted=None):
+        self.connection_id = connection_id
+        self.on_posted = on_posted
+        self.gone = False
+        self._delta_sent = False
+        self._q: queue.Queue = queue.Queue()
+        self._trace = _current_trace()
+        self._thread = threading.Thread(
+            target=self._run, name=f"ws-{connection_id}", daemon=True
+        )
+        self._m = {
+            "frames_in": 0, "frames_sent": 0, "bytes_sent": 0, "retries": 0,
+            "dropped": 0, "post_ms_total": 0.0, "post_ms_max": 0.0,
+        }
+        self._thread.start()
+
+    def send(self, payload: dict, snapshot=None):
+        self._m["frames_in"] += 1
+        self._q.put((payload, snapshot))
+        if payload.get("type") == "end":
+            self.flush()
+
+    def flush(self):
+        self._q.join()
+
+    def close(self):
+        self._q.put(_WS_CLOSE)
+        self._thread.join()
+
+    def metrics(self) -> dict:
+        m = dict(self._m)
+        m["post_ms_total"] = round(m["post_ms_total"], 2)
+        m["post_ms_max"] = round(m["post_ms_max"], 2)
+        m["post_ms_avg"] = round(m["post_ms_total"] / m["frames_sent"], 2) if m["frames_sent"] else 0.0
+        m["gone"] = self.gone
+        return m
+
+    @staticmethod
+    def _mergeable(pending: dict | None, item) -> bool:
+        return (
+            pending is not None
+            and isinstance(item, dict)
+            and item.get("type") == "delta"
+            and item.get("format") == pending.get("format")
+            and item.get("statusCode") == pending.get("statusCode")
+        )
+
+    def _run(self):
+        _BOUND.trace = self._trace
+        pending, snapshot, merged, deadline = None, None, 0, 0.0
+        while True:
+            try:
+                if pending is None:
+                    item = self._q.get()
+                else:
+                    item = self._q.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                self._deliver(pending, merged, snapshot)
+                pending = None
+                continue
+
+            payload, snap = (None, None) if item is _WS_CLOSE else item
+            if self._mergeable(pending, payload):
+                pending["text"] = (pending.get("text") or "") + (payload.get("text") or "")
+                snapshot = snap
+                merged += 1
+                if len(pending["text"]) >= WS_COALESCE_MAX_CHARS:
+                    self._deliver(pending, merged, snapshot)
+                    pending = None
+                continue
+            if pending is not None:
+                self._deliver(pending, merged, snapshot)
+                pending = None
+            if item is _WS_CLOSE:
+                self._q.task_done()
+                return
+            if payload.get("type") == "delta":
+                # First frame of the reply is not held back (time to first token).
+                window = WS_COALESCE_MS / 1000.0 if self._m["frames_sent"] else 0.0
+                pending, snapshot, merged, deadline = dict(payload), snap, 1, time.monotonic() + window
+            else:
+                self._deliver(payload, 1, snap)
+
+    def _deliver(self, payload: dict, n_items: int, snapshot=None):
+        # Never let one frame kill the worker: flush() waits on every task_done().
+        try:
+            if self._post(payload) and self.on_posted is not None:
+                self.on_posted(payload, snapshot)
+        except Exception as e:
+            self._m["dropped"] += 1
+            logger.error(f"WebSocket frame dropped for {self.connection_id}: {e}", exc_info=True)
+        finally:
+            for _ in range(n_items):
+                self._q.task_done()
+
+    def _post(self, payload: dict) -> bool:
+        """post_to_connection with retries; True once the frame was accepted."""
+        if self.gone:
+            self._m["dropped"] += 1
+            return False
+        try:
+            data = json.dumps(payload)
+        except (TypeError, ValueError) as e:
+            self._m["dropped"] += 1
+            logger.error(f"WebSocket payload not serializable: {e}")
+            return False
+        for attempt in range(WS_MAX_RETRIES + 1):
+            t0 = time.perf_counter()
+            try:
+                ws.post_to_connection(ConnectionId=self.connection_id, Data=data)
+            except ClientError as e:
+                code = e.response.get("Error", {}).get("Code", "")
+                status = e.response.get("ResponseMetadata", {}).get("HTTPStatusCode")
+                if code == "GoneException" or status == 410:
+                    self.gone = True
+                    self._m["dropped"] += 1
+                    logger.warning(f"WebSocket connection gone: {self.connection_id}")
+                    return False
+                if (code in _WS_THROTTLE_CODES or status == 429) and attempt < WS_MAX_RETRIES:
+                    self._m["retries"] += 1
+                    time.sleep(WS_RETRY_BASE_SECONDS * (2 ** attempt) * random.uniform(0.5, 1.0))
+                    continue
+                self._m["dropped"] += 1
+                logger.error(f"WebSocket post_to_connection error: {e}")
+                return False
+            except Exception as e:
+                self._m["dropped"] += 1
+                logger.error(f"WebSocket post_to_connection error: {e}")
+                return False
+            ms = (time.perf_counter() - t0) * 1000
+            if payload.get("type") == "delta" and not self._delta_sent:
+                self._delta_sent = True
+                _trace_mark("ttft")
+            self._m["frames_sent"] += 1
+            self._m["bytes_sent"] += len(data)
+            self._m["post_ms_total"] += ms
+            self._m["post_ms_max"] = max(self._m["post_ms_max"], ms)
+            return True
+        return False
+
+
+# Senders for the current invocation; closed (and metrics logged) by the handler.
+_WS_SENDERS: dict[str, _WsSender] = {}
+
+
+def _ws_sender(connection_id: str) -> _WsSender:
+    sender = _WS_SENDERS.get(connection_id)
+    if sender is None:
+        run = _IDEMPOTENT_RUN
+        sender = _WS_SENDERS[connection_id] = _WsSender(
+            connection_id, on_posted=run.posted if run else None
+        )
+    return sender
+
+
+def _close_ws_senders():
+    while _WS_SENDERS:
+        connection_id, sender = _WS_SENDERS.popitem()
+        sender.close()
+        if _TRACE is not None:
+            _TRACE.add("ws_post", sender.metrics()["post_ms_total"])
+        logger.info(f"WebSocket sender metrics ({connection_id}): {json.dumps(sender.metrics())}")
+
+
 def _send_ws(connection_id: str, payload: dict):
+    if _REPLY_PARTS is not None and payload.get("type") == "delta":
+        _REPLY_PARTS.append(payload.get("text") or "")
     if not ws:
         logger.error("WebSocket client not configured (URL env missing).")
     else:
-        try:
-            ws.post_to_connection(
-                ConnectionId=connection_id,
-                Data=json.dumps(payload)
-            )
-        except ClientError as e:
-            logger.error(f"WebSocket post_to_connection error: {e}")
+        run = _IDEMPOTENT_RUN
+        snapshot = None
+        if run and payload.get("type") == "delta":
+            payload, snapshot = run.stamp(payload)
+        _ws_sender(connection_id).send(payload, snapshot)
+
+
+CANCEL_CHECK_SECONDS = float(os.environ.get("CANCEL_CHECK_SECONDS", "1.0"))
+
+
+class _Cancellation:
+    """
+    Set once the client is gone: a post hit GoneException, or the $disconnect
+    marker is in the session store. The store is polled at most every
+    CANCEL_CHECK_SECONDS, so is_set() is cheap enough to call per stream event.
+    """
+
+    def __init__(self, connection_id: str):
+        self.connection_id = connection_id
+        self.reason = ""
+        self._checked_at = time.monotonic()
+
+    def is_set(self) -> bool:
+        if self.reason:
+            return True
+        sender = _WS_SENDERS.get(self.connection_id)
+        if sender is not None and sender.gone:
+            self.reason = "gone"
+            return True
+        now = time.monotonic()
+        if now - self._checked_at >= CANCEL_CHECK_SECONDS:
+            self._checked_at = now
+            try:
+                if _SESSION_STORE.is_disconnected(self.connection_id):
+                    self.reason = "disconnect"
+            except Exception as e:
+                logger.warning(f"Disconnect check failed: {e}")
+        return bool(self.reason)
+
+
+def _abort_generation(
+    route: str, cancel: _Cancellation, stream, generated_text: str,
+    enrichment: "_Enrichment | None" = None, model_id: str = MODEL_ID,
+):
+    """
+    Stop reading the model stream and drop pending enrichment for a gone
+    client. Pass the stream only while it is unfinished: its output is then
+    billed without a usage event, so an estimate is recorded against
+    `model_id` (the model that actually served it).
+    """
+    output_tokens_est = _estimate_tokens(generated_text) if generated_text else 0
+    if _USAGE is not None and stream is not None:
+        _USAGE.record_cancelled(route, model_id, output_tokens_est)
+    try:
+        if hasattr(stream, "close"):
+            stream.close()
+    except Exception:
+        pass
+    if enrichment is not None:
+        enrichment.abandon()
+    logger.info(
+        f"Generation cancelled ({route}): reason={cancel.reason} "
+        f"connection={cancel.connection_id} "
+        f"output_tokens_est={output_tokens_est}"
+    )
 
 
 def _end_with_error(connection_id: str, message: str, code: int = 500):
@@ -1211,40 +3021,130 @@ def _should_use_kb(prompt: str) -> bool:
     return any(t in toks for t in _HIV_TOKENS)
 
 
+_RESOURCE_TOKEN_RE = re.compile(r"[a-z0-9\-]+")
+
+# Default term weights for runtime resource ranking. A rule adds `weight` to a
+# resource when the query has any of `query_terms` and the resource (or just
+# its `field`, if given) has any of `resource_terms`. A runtime KB can replace
+# these with its own list under ranking.term_weights.
+DEFAULT_RESOURCE_TERM_WEIGHTS = [
+    {"query_terms": ["agyw"], "resource_terms": ["agyw"], "weight": 2},
+    {"query_terms": ["district", "subnational"], "resource_terms": ["sub", "district"], "weight": 1},
+    {"query_terms": ["prep"], "resource_terms": ["prep"], "weight": 2},
+    {"query_terms": ["testing"], "resource_terms": ["statcompiler"], "field": "name", "weight": 1},
+]
+BM25_K1 = float(os.environ.get("RUNTIME_BM25_K1", "1.2"))
+BM25_B = float(os.environ.get("RUNTIME_BM25_B", "0.75"))
+
+
+def _resource_tokens(r: dict) -> list[str]:
+    text = " ".join([
+        r.get("name", ""),
+        r.get("summary", ""),
+        " ".join(r.get("when_to_use", []) or []),
+        " ".join(r.get("match_terms", []) or []),
+        r.get("category", ""),
+    ]).lower()
+    return _RESOURCE_TOKEN_RE.findall(text)
+
+
+class _ResourceIndex:
+    """
+    Token -> resource inverted index with precomputed BM25 statistics for the
+    runtime KB `resources`, built once per runtime KB version.
+    """
+
+    def __init__(self, kb: dict | None):
+        self.kb = kb
+        self.resources = list((kb or {}).get("resources", []) or [])
+        self.postings: dict[str, list[tuple[int, float]]] = {}
+        n = len(self.resources)
+        doc_tokens = [_resource_tokens(r) for r in self.resources]
+        avgdl = (sum(len(t) for t in doc_tokens) / n) if n else 0.0
+        for idx, toks in enumerate(doc_tokens):
+            tf: dict[str, int] = {}
+            for t in toks:
+                tf[t] = tf.get(t, 0) + 1
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * (len(toks) / avgdl if avgdl else 0.0))
+            for t, c in tf.items():
+                # store the BM25 term-frequency part; idf is applied below
+                self.postings.setdefault(t, []).append((idx, c * (BM25_K1 + 1) / (c + norm)))
+        for t, plist in self.postings.items():
+            idf = math.log(1 + (n - len(plist) + 0.5) / (len(plist) + 0.5))
+            self.postings[t] = [(idx, w * idf) for idx, w in plist]
+
+        rules = ((kb or {}).get("ranking") or {}).get("term_weights")
+        if not isinstance(rules, list):
+            rules = DEFAULT_RESOURCE_TERM_WEIGHTS
+        self.boosts: list[tuple[set, set, float]] = []
+        for rule in rules:
+            try:
+                field = rule.get("field")
+                wanted = {t.lower() for t in rule.get("resource_terms", [])}
+                docs = set()
+                for idx, r in enumerate(self.resources):
+                    toks = (
+                        _RESOURCE_TOKEN_RE.findall(str(r.get(field, "")).lower())
+                        if field else doc_tokens[idx]
+                    )
+                    if wanted.intersection(toks):
+                        docs.add(idx)
+                query_terms = {t.lower() for t in rule.get("query_terms", [])}
+                self.boosts.append((query_terms, docs, float(rule.get("weight", 0))))
+            except Exception as e:
+                logger.warning(f"Skipping bad resource term weight {rule!r}: {e}")
+
+    def search(self, prompt: str, top_n: int = 4) -> list[dict]:
+        q_tokens = set(_RESOURCE_TOKEN_RE.findall(_norm(prompt)))
+        scores: dict[int, float] = {}
+        for t in q_tokens:
+            for idx, w in self.postings.get(t, ()):
+                scores[idx] = scores.get(idx, 0.0) + w
+        for query_terms, docs, weight in self.boosts:
+            if weight and not query_terms.isdisjoint(q_tokens):
+                for idx in docs:
+                    scores[idx] = scores.get(idx, 0.0) + weight
+        ranked = sorted(
+            (idx for idx, sc in scores.items() if sc > 0),
+            key=lambda idx: (-scores[idx], idx),
+        )
+        return [self.resources[idx] for idx in ranked[:max(1, top_n)]]
+
+
+_RUNTIME_RESOURCE_INDEX = None
+
+
 def _runtime_relevant_resources(prompt: str, top_n: int = 4) -> list[dict]:
-    resources = (_RUNTIME_KB or {}).get("resources", [])
-    if not resources:
+    global _RUNTIME_RESOURCE_INDEX
+    if not (_RUNTIME_KB or {}).get("resources"):
         return []
-    q_tokens = set(re.findall(r"[a-z0-9\-]+", _norm(prompt)))
-    scored = []
-    for r in resources:
-        text = " ".join([
-            r.get("name", ""),
-            r.get("summary", ""),
-            " ".join(r.get("when_to_use", []) or []),
-            " ".join(r.get("match_terms", []) or []),
-            r.get("category", ""),
-        ]).lower()
-        r_tokens = set(re.findall(r"[a-z0-9\-]+", text))
-        overlap = len(q_tokens.intersection(r_tokens))
-        if "agyw" in q_tokens and "agyw" in r_tokens:
-            overlap += 2
-        if "district" in q_tokens or "subnational" in q_tokens:
-            if "sub" in r_tokens or "district" in r_tokens:
-                overlap += 1
-        if "prep" in q_tokens and "prep" in r_tokens:
-            overlap += 2
-        if "testing" in q_tokens and "statcompiler" in r.get("name", "").lower():
-            overlap += 1
-        if overlap > 0:
-            scored.append((overlap, r))
-    scored.sort(key=lambda x: x[0], reverse=True)
-    return [r for _, r in scored[:max(1, top_n)]]
+    if _RUNTIME_RESOURCE_INDEX is None or _RUNTIME_RESOURCE_INDEX.kb is not _RUNTIME_KB:
+        _RUNTIME_RESOURCE_INDEX = _ResourceIndex(_RUNTIME_KB)
+    return _RUNTIME_RESOURCE_INDEX.search(prompt, top_n)
+
+
+_TALK_KB_INSTRUCTIONS = (
+    "Use the runtime routing map and brief bios in the user turn to choose the right data source/tool. "
+    "If helpful, consult the provided excerpts. "
+    "Do not mention internal tools. "
+    "CRITICAL FORMAT: Start with one plain-English sentence answering the question. "
+    "Do NOT begin with a URL, a label (e.g., 'UNAIDS AIDSinfo'), or a list. "
+    "Only after that sentence, you may add brief details. "
+    "Do not include raw URLs in the body—tools may attach sources separately."
+)
+_TALK_PLAIN_INSTRUCTIONS = (
+    "Answer helpfully and accurately. If information is missing, say what would help."
+)
+
+
+def _runtime_answer_rules() -> str:
+    """Static per runtime-KB version, so it belongs in the cached system prefix."""
+    rules = "\n".join((_RUNTIME_KB or {}).get("style", {}).get("answer_rules", [])[:3])
+    return f"<answer_rules>\n{rules}\n</answer_rules>" if rules else ""
 
 
 def _build_runtime_context(prompt: str) -> str:
     try:
-        rules = "\n".join((_RUNTIME_KB or {}).get("style", {}).get("answer_rules", [])[:3])
         picks = _runtime_relevant_resources(prompt, top_n=4)
         lines = []
         for r in picks:
@@ -1263,11 +3163,10 @@ def _build_runtime_context(prompt: str) -> str:
                 lines.append(f"- {name} — {joined} (URL: {url})")
             else:
                 lines.append(f"- {name} — {joined}")
-        rules_block = f"<answer_rules>\n{rules}\n</answer_rules>\n" if rules else ""
-        picks_block = "\n".join(lines) if lines else ""
-        if not (rules_block or picks_block):
+        if not lines:
             return ""
-        return f"{rules_block}<runtime_resource_map>\n{picks_block}\n</runtime_resource_map>"
+        picks_block = "\n".join(lines)
+        return f"<runtime_resource_map>\n{picks_block}\n</runtime_resource_map>"
     except Exception:
         return ""
 
@@ -1287,37 +3186,33 @@ def _talk_with_optional_kb(
         except Exception:
             ref_url = None
 
-    runtime_ctx = _build_runtime_context(prompt) if use_kb else ""
+    with _span("runtime_context"):
+        runtime_ctx = _build_runtime_context(prompt) if use_kb else ""
     kb_text, kb_sources = ("", [])
+    retrieval = _KbRetrieval()
     if use_kb:
-        kb_text, kb_sources = _kb_retrieve(prompt, cfg.KNOWLEDGE_BASE_ID)
-
+        # One Retrieve (k=20) feeds the answer context (top 10), the source
+        # list and the per-document snippets for relevance reasons.
+        with _span("retrieve"):
+            retrieval = _kb_retrieve_once(prompt, cfg.KNOWLEDGE_BASE_ID, k=20)
+            kb_text, kb_sources = retrieval.context(k=10)
+
+    # Cached prefix: system prompt + CORE_CONTEXT + instructions (+ answer rules).
+    # Only the resource map, excerpts and question change per request.
     if runtime_ctx or kb_text:
+        system = _cached_system(
+            cfg.SYSTEM_PROMPT, CORE_CONTEXT, _TALK_KB_INSTRUCTIONS, _runtime_answer_rules()
+        )
         user_text = (
-            f"{CORE_CONTEXT}\n\n"  # <--- INJECT DEFINITIONS HERE
-            "Use the following runtime routing map and brief bios to choose the right data source/tool. "
-            "If helpful, consult the provided excerpts. "
-            "Do not mention internal tools. "
-            "CRITICAL FORMAT: Start with one plain-English sentence answering the question. "
-            "Do NOT begin with a URL, a label (e.g., 'UNAIDS AIDSinfo'), or a list. "
-            "Only after that sentence, you may add brief details. "
-            "Do not include raw URLs in the body—tools may attach sources separately.\n"
             f"{runtime_ctx}\n"
             f"<doc_excerpts>\n{kb_text}\n</doc_excerpts>\n\n"
             f"User question: {prompt}"
         )
     else:
-        user_text = (
-            f"{CORE_CONTEXT}\n\n"  # <--- INJECT HERE AS WELL
-            "Answer helpfully and accurately. If information is missing, say what would help.\n\n"
-            f"User question: {prompt}"
-        )
+        system = _cached_system(cfg.SYSTEM_PROMPT, CORE_CONTEXT, _TALK_PLAIN_INSTRUCTIONS)
+        user_text = f"User question: {prompt}"
 
-    messages: list[dict] = []
-    if history_messages:
-        messages.extend(history_messages)
-    messages.append({"role": "user", "content": [{"text": user_text}]})
-    system = [{"text": cfg.SYSTEM_PROMPT}] if cfg.SYSTEM_PROMPT else None
+    messages = _messages_with_history(history_messages, user_text, "talk")
 
     # Precompute a candidate URL for sentence-level footnotes:
     # 1) first KB source (if any)
@@ -1337,11 +3232,55 @@ def _talk_with_optional_kb(
     if not footnote_url:
         footnote_url = FOOTNOTE_FALLBACK_URL
 
-    # Buffer full model output, then format + annotate with sentence footnotes
-    full_answer_raw_parts: list[str] = []
+    # The sources block depends only on the prompt and retrieval, so its model
+    # calls start now and run alongside converse_stream.
+    # Do NOT show the first source – it's reserved for the [1] link.
+    visible_sources = pre_sources[1:] if len(pre_sources) > 1 else []
+    cancel = _Cancellation(connection_id)
+    enrichment = _Enrichment(cancel)
+    if visible_sources:
+        doc_snips_all = (
+            _collect_doc_snippets(prompt, k=20, retrieval=retrieval) if use_kb else {}
+        )
+        want_keys = set()
+        for s in visible_sources:
+            url = (s.get("url") or "").strip()
+            if url:
+                want_keys.add(_basename_from_url(url).lower())
+        doc_snips = {k: v for k, v in doc_snips_all.items() if k in want_keys}
+        if doc_snips:
+            enrichment.add("reasons", _gen_relevance_reasons_via_model, prompt, doc_snips)
+        if want_keys:
+            enrichment.add("leadin", _pick_sources_leadin, prompt)
+    enrichment.start()
+
+    # Format + annotate with the sentence footnote as the answer streams in
+    formatter = _MarkdownStreamTransformer(footnote_url, start_index=1)
+    answer_parts: list[str] = []
+    raw_parts: list[str] = []
+
+    def _send_answer_text(text: str):
+        if not text:
+            return
+        answer_parts.append(text)
+        _send_ws(
+            connection_id,
+            {
+                "type": "delta",
+                "statusCode": 200,
+                "format": "markdown",
+                "text": text,
+            },
+        )
 
+    if cancel.is_set():
+        _abort_generation("talk", cancel, None, "", enrichment)
+        return
+    t_stream = time.perf_counter()
     try:
-        resp = brt.converse_stream(modelId=MODEL_ID, messages=messages, system=system)
+        resp = _MODEL_GATEWAY.converse_stream(
+            modelId=MODEL_ID, messages=_resume_stream(messages, formatter), system=system
+        )
     except ClientError as e:
         logger.error(f"Bedrock ClientError: {e}")
         _end_with_error(
@@ -1357,13 +3296,22 @@ def _talk_with_optional_kb(
         return
 
     for ev in stream:
+        if cancel.is_set():
+            _abort_generation(
+                "talk", cancel, stream, "".join(raw_parts), enrichment,
+                model_id=resp.get("servedModelId", MODEL_ID),
+            )
+            return
         if "contentBlockDelta" in ev:
             delta = (ev["contentBlockDelta"].get("delta") or {}).get("text") or ""
             if delta:
-                full_answer_raw_parts.append(delta)
+                if not raw_parts:
+                    _trace_mark("model_first_token")
+                raw_parts.append(delta)
+                _send_answer_text(formatter.feed(_note_model_text(delta)))
 
-        elif "messageStop" in ev:
-            break
+        elif "metadata" in ev:
+            _record_model_usage("talk", resp.get("servedModelId", MODEL_ID), ev["metadata"])
         elif (
             "internalServerException" in ev
             or "modelStreamErrorException" in ev
@@ -1380,29 +3328,15 @@ def _talk_with_optional_kb(
             _end_with_error(connection_id, "Model streaming error.", 500)
             return
 
-    full_answer_raw = "".join(full_answer_raw_parts)
-
-    # Existing formatting: linkify bare URLs + emphasize stats
-    full_summary = _linkify_bare_urls(full_answer_raw)
-    full_summary = _emphasize_stats(full_summary)
-
-    # Add a single clickable marker [[1]](first-source-url) on the 2nd or 3rd sentence
-    full_summary, _ = _annotate_sentences_with_links(
-        full_summary,
-        footnote_url,
-        start_index=1,
-    )
-
-    # Send formatted answer text
-    _send_ws(
-        connection_id,
-        {
-            "type": "delta",
-            "statusCode": 200,
-            "format": "markdown",
-            "text": full_summary,
-        },
-    )
+    _trace_since("model_stream", t_stream)
+    # Flush the tail (and the footnote, if it was waiting on a 3rd sentence)
+    _send_answer_text(_finish_stream(formatter))
+    full_summary = "".join(answer_parts)
+    if cancel.is_set():
+        # Answer finished (its usage is already recorded) but nobody is
+        # listening: skip the enrichment calls that have not started.
+        _abort_generation("talk", cancel, None, "", enrichment)
+        return
 
     # --- Inline suggestion of main ref_url (separate from footnotes) ---
     try:
@@ -1437,31 +3371,18 @@ def _talk_with_optional_kb(
         logger.warning(f"Inline suggested reference append error: {e}")
 
     # Build final sources block (may include more than first source)
-    sources_to_send = []
-    if use_kb and kb_sources:
-        sources_to_send.extend(kb_sources)
-    if use_kb and ref_url and not sources_to_send:
-        sources_to_send.append(
-            {"url": ref_url, "label": _title_for_url(ref_url)}
-        )
-    sources_to_send = _dedupe_sources_best(sources_to_send)
-
-    # Do NOT show the first one – it's reserved for the [1] link.
-    visible_sources = sources_to_send[1:] if len(sources_to_send) > 1 else []
-
+    t_sources = time.perf_counter()
+    # One budget for both waits, so a slow reasons call leaves the lead-in less.
+    enrich_deadline = time.monotonic() + ENRICH_WAIT_SECONDS
     if visible_sources:
-        doc_snips_all = _collect_doc_snippets(prompt, k=20) if use_kb else {}
-        want_keys = set()
-        for s in visible_sources:
-            url = (s.get("url") or "").strip()
-            if url:
-                want_keys.add(_basename_from_url(url).lower())
-        doc_snips = {k: v for k, v in doc_snips_all.items() if k in want_keys}
-        reasons = (
-            _gen_relevance_reasons_via_model(prompt, doc_snips)
-            if doc_snips else
-            {}
-        )
+        try:
+            reasons = enrichment.result("reasons", enrich_deadline) or {}
+        except TimeoutError:
+            logger.warning(f"Relevance reasons not ready within {ENRICH_WAIT_SECONDS}s; sending sources without them")
+            reasons = {}
+        except Exception as e:
+            logger.warning(f"Relevance reasons generation failed: {e}")
+            reasons = {}
 
         inline_lines = []
         for s in visible_sources:
@@ -1483,7 +3404,13 @@ def _talk_with_optional_kb(
 
         if inline_lines:
             try:
-                lead_in = _pick_sources_leadin(prompt)
+                lead_in = (
+                    enrichment.result("leadin", enrich_deadline) if enrichment.has("leadin")
+                    else _pick_sources_leadin(prompt)
+                ) or _random_sources_leadin()
+            except TimeoutError:
+                logger.warning(f"Lead-in not ready within {ENRICH_WAIT_SECONDS}s, using random fallback")
+                lead_in = _random_sources_leadin()
             except Exception as e:
                 logger.warning(
                     f"Lead-in generation failed, using random fallback: {e}"
@@ -1511,13 +3438,110 @@ def _talk_with_optional_kb(
                     "text": sources_block,
                 },
             )
+    _trace_since("sources_block", t_sources)
 
     _send_ws(connection_id, {"type": "end", "statusCode": 200})
 
 
-# ---------- Handler ----------
+# ---------- COUNT (OpenSearch aggregations) ----------
+OS_COUNT_TOP_DOCS = int(os.environ.get("OS_COUNT_TOP_DOCS", "10"))
+OS_COUNT_TOP_PAGES = int(os.environ.get("OS_COUNT_TOP_PAGES", "5"))
+# Counts only change when the KB is re-ingested (see _refresh_kb_version).
+# Holds the raw aggregations: the answer embeds presigned links, so it is
+# formatted (and presigned via _PRESIGN_CACHE) on every read.
+_COUNT_CACHE = _TtlLruCache(
+    int(os.environ.get("OS_COUNT_CACHE_MAX_ENTRIES", "256")),
+    float(os.environ.get("OS_COUNT_CACHE_TTL_SECONDS", "3600")),
+)
+
+
+def _os_count_query(keyword: str) -> dict:
+    """size=0 search: phrase match, distinct-document count, top documents with top pages."""
+    return {
+        "size": 0,
+        "track_total_hits": True,
+        "query": {"match_phrase": {cfg.OPENSEARCH_TEXT_FIELD: keyword}},
+        "aggs": {
+            "doc_count": {
+                "cardinality": {
+                    "field": cfg.OPENSEARCH_DOC_ID_FIELD,
+                    "precision_threshold": 40000,
+                }
+            },
+            "top_docs": {
+                "terms": {"field": cfg.OPENSEARCH_DOC_ID_FIELD, "size": OS_COUNT_TOP_DOCS},
+                "aggs": {
+                    "pages": {
+                        "terms": {"field": cfg.OPENSEARCH_PAGE_FIELD, "size": OS_COUNT_TOP_PAGES}
+                    }
+                },
+            },
+        },
+    }
+
+
+def _page_number(key) -> int | None:
+    """Page bucket key as an int; keyword-mapped page fields come back as strings ("12")."""
+    if isinstance(key, bool):
+        return None
+    try:
+        return int(float(key))
+    except (TypeError, ValueError, OverflowError):
+        return None
+
+
+def _format_count_result(keyword: str, resp: dict) -> tuple[str, str, int]:
+    aggs = resp.get("aggregations") or {}
+    count = int((aggs.get("doc_count") or {}).get("value") or 0)
+    if not count:
+        return f'No documents mention "{keyword}".', "", 0
+
+    noun = "document mentions" if count == 1 else "documents mention"
+    summary = f'**{count}** {noun} "{keyword}".'
+    lines = []
+    for bucket in (aggs.get("top_docs") or {}).get("buckets") or []:
+        src = str(bucket.get("key") or "")
+        if not src:
+            continue
+        pages = sorted({
+            n for n in (_page_number(p.get("key")) for p in (bucket.get("pages") or {}).get("buckets") or [])
+            if n is not None
+        })
+        hits = int(bucket.get("doc_count") or 0)
+        line = f"- {_md_link(_doc_url_from_s3_uri(src), _clean_filename(src))}"
+        if pages:
+            line += f" — page{'s' if len(pages) > 1 else ''} {', '.join(str(p) for p in pages)}"
+        line += f" ({hits} matching passage{'s' if hits != 1 else ''})"
+        lines.append(line)
+    details_md = ""
+    if lines:
+        shown = f"Top {len(lines)}" if count > len(lines) else "Documents"
+        details_md = f"{shown} by matching passages:\n" + "\n".join(lines)
+    return summary, details_md, count
+
+
 def _os_count_keyword(keyword: str):
-    return "Document counting is not implemented in this build.", "", 0
+    """
+    Count documents whose chunks contain `keyword` as a phrase. Only
+    aggregations come back (size=0); they are cached per keyword until the
+    TTL expires or a new ingestion job completes.
+    """
+    keyword = " ".join((keyword or "").split())
+    _refresh_kb_version(cfg.KNOWLEDGE_BASE_ID)
+    cache_key = (cfg.OPENSEARCH_INDEX, " ".join(_norm(keyword).split()))
+    aggs = _COUNT_CACHE.get(cache_key)
+    if aggs is not None:
+        logger.info(f"COUNT cache hit keyword={keyword!r} stats={_COUNT_CACHE.stats()}")
+        return _format_count_result(keyword, {"aggregations": aggs})
+    client = _get_opensearch()
+    if client is None:
+        return "Document counting is not configured.", "", 0
+    resp = client.search(index=cfg.OPENSEARCH_INDEX, body=_os_count_query(keyword))
+    aggs = resp.get("aggregations") or {}
+    _COUNT_CACHE.put(cache_key, aggs)
+    result = _format_count_result(keyword, {"aggregations": aggs})
+    logger.info(f"COUNT keyword={keyword!r} docs={result[2]} stats={_COUNT_CACHE.stats()}")
+    return result
 
 
 # ---------- Feedback Handler ----------
@@ -1573,53 +3597,12 @@ def _handle_feedback(event, connection_id):
         return {"statusCode": 500, "body": "Feedback save failed"}
 
 
-def lambda_handler(event, _context):
-    try:
-        connection_id = event.get("connectionId")
-
-        if not connection_id:
-            return {"statusCode": 400, "body": "Missing connectionId"}
-
-        # Check for feedback action BEFORE checking for prompt
-        action = event.get("action")
-        if action == "submitFeedback":
-            return _handle_feedback(event, connection_id)
-
-        # Now check for prompt (only needed for non-feedback actions)
-        prompt = (event.get("prompt") or "").strip()
-        if not prompt:
-            _end_with_error(connection_id, "Please provide a prompt.", 400)
-            return {"statusCode": 400, "body": "Empty prompt"}
-
-        # HARDCODED SUPPORT QUESTION
-        prompt_lower = prompt.lower()
-        if any(
-            term in prompt_lower
-            for term in [
-                "contact for support",
-                "who can i contact",
-                "support contact",
-                "contact info",
-                "support email",
-                "who do i contact",
-            ]
-        ):
-            answer = (
-                "The i2i team is here anytime! Please contact us at "
-                "info.i2i@genesis-analytics.com"
-            )
-            _send_ws(
-                connection_id,
-                {
-                    "type": "delta",
-                    "statusCode": 200,
-                    "format": "markdown",
-                    "text": answer,
-                },
-            )
-            _send_ws(connection_id, {"type": "end", "statusCode": 200})
-            return {"statusCode": 200, "body": "SUPPORT_CONTACT_OK"}
-
+# ---------- Handler ----------
+def _route_prompt(connection_id: str, prompt: str, history_raw: list) -> dict:
+    # Support / personal / link-only answers. web-socket-handler answers these
+    # inline when it can; this covers events forwarded without that fast path.
+    hit = intercepts.support_answer(prompt)
+    if hit is None:
         try:
             logger.info(
                 f"START event meta: has_connection_id={bool(connection_id)}, "
@@ -1628,137 +3611,172 @@ def lambda_handler(event, _context):
         except Exception:
             pass
 
-        _ensure_config_loaded()
+        with _span("config"):
+            _ensure_config_loaded()
 
-        # 1) Personal intercepts
-        phit = _match_personal(prompt)
-        if phit:
-            answer = phit.get("answer_template") or "Got it."
-            _send_ws(
+        with _span("intercepts"):
+            phit = _match_personal(prompt)
+            hit = intercepts.kb_answer(phit, None if phit else _match_runtime(prompt))
+    if hit:
+        _trace_route(hit.route)
+        _send_ws(
+            connection_id,
+            {
+                "type": "delta",
+                "statusCode": 200,
+                "format": "markdown",
+                "text": hit.text,
+            },
+        )
+        _send_ws(connection_id, {"type": "end", "statusCode": 200})
+        return {"statusCode": 200, "body": hit.body}
+
+    # 2.5) Summarization flow
+    if any(
+        t in (prompt or "").lower()
+        for t in (
+            "summarize",
+            "summary of",
+            "sum up",
+            "tl;dr",
+            "key findings",
+            "key points",
+            "what are the findings",
+            "what are the main points",
+        )
+    ):
+        _trace_route("summary")
+        history_msgs = _normalize_history_items(history_raw)
+        first_url = _extract_first_url_from_history(history_raw)
+        if not first_url:
+            _end_with_error(
                 connection_id,
-                {
-                    "type": "delta",
-                    "statusCode": 200,
-                    "format": "markdown",
-                    "text": answer,
-                },
+                "I couldn’t find a prior link to summarize. Please paste the link "
+                "or ask again after I share one.",
+                400,
             )
-            _send_ws(connection_id, {"type": "end", "statusCode": 200})
-            return {"statusCode": 200, "body": "PERSONAL_KB_OK"}
-
-        # 2) Runtime routing: link-only
-        rhit = _match_runtime(prompt)
-        if rhit and rhit.get("link_only"):
-            url = (rhit.get("source_url") or "").strip()
-            name = (rhit.get("primary_source") or "Link").strip()
-            text = (
-                f"{rhit.get('answer_text') or 'Here’s the best source:'}\n\n[{name}]({url})"
-                if url else
-                (rhit.get("answer_text") or "Here’s the best source.")
+            return {"statusCode": 400, "body": "No prior link in history"}
+        _stream_summary_from_chunks(
+            connection_id, prompt, first_url, history_messages=history_msgs
+        )
+        return {"statusCode": 200, "body": "SUMMARY_OK"}
+
+    # 3) COUNT flow
+    if _looks_like_count(prompt):
+        _trace_route("count")
+        if not (
+            cfg.OPENSEARCH_INDEX
+            and cfg.OPENSEARCH_TEXT_FIELD
+            and cfg.OPENSEARCH_DOC_ID_FIELD
+            and cfg.OPENSEARCH_PAGE_FIELD
+            and _get_opensearch()
+        ):
+            _end_with_error(
+                connection_id, "Document counting is not configured.", 501
             )
+            return {"statusCode": 501, "body": "COUNT not configured"}
+        keyword = _extract_keyword(prompt)
+        if not keyword:
+            _end_with_error(
+                connection_id,
+                'I couldn\'t find the keyword to count. Try: '
+                'how many papers mention "cats"?',
+                400,
+            )
+            return {"statusCode": 400, "body": "No keyword extracted"}
+        try:
+            with _span("count_query"):
+                summary, details_md, _ = _os_count_keyword(keyword=keyword)
             _send_ws(
                 connection_id,
                 {
                     "type": "delta",
                     "statusCode": 200,
                     "format": "markdown",
-                    "text": text,
+                    "text": summary + "\n\n" + details_md,
                 },
             )
             _send_ws(connection_id, {"type": "end", "statusCode": 200})
-            return {"statusCode": 200, "body": "RUNTIME_LINK_ONLY_OK"}
-
-        # 2.5) Summarization flow
-        if any(
-            t in (prompt or "").lower()
-            for t in (
-                "summarize",
-                "summary of",
-                "sum up",
-                "tl;dr",
-                "key findings",
-                "key points",
-                "what are the findings",
-                "what are the main points",
-            )
-        ):
-            history_raw = event.get("history") or []
-            history_msgs = _normalize_history_items(history_raw)
-            first_url = _extract_first_url_from_history(history_raw)
-            if not first_url:
-                _end_with_error(
-                    connection_id,
-                    "I couldn’t find a prior link to summarize. Please paste the link "
-                    "or ask again after I share one.",
-                    400,
-                )
-                return {"statusCode": 400, "body": "No prior link in history"}
-            _stream_summary_from_chunks(
-                connection_id, prompt, first_url, history_messages=history_msgs
+            return {"statusCode": 200, "body": "COUNT OK"}
+        except Exception as e:
+            logger.error(f"COUNT error: {e}", exc_info=True)
+            _end_with_error(
+                connection_id,
+                "There was a problem counting documents.",
+                500,
             )
-            return {"statusCode": 200, "body": "SUMMARY_OK"}
-
-        # 3) COUNT flow
-        if _looks_like_count(prompt):
-            if not (
-                _os
-                and cfg.OPENSEARCH_INDEX
-                and cfg.OPENSEARCH_TEXT_FIELD
-                and cfg.OPENSEARCH_DOC_ID_FIELD
-                and cfg.OPENSEARCH_PAGE_FIELD
-            ):
-                _end_with_error(
-                    connection_id, "Document counting is not configured.", 501
-                )
-                return {"statusCode": 501, "body": "COUNT not configured"}
-            keyword = _extract_keyword(prompt)
-            if not keyword:
-                _end_with_error(
-                    connection_id,
-                    'I couldn\'t find the keyword to count. Try: '
-                    'how many papers mention "cats"?',
-                    400,
-                )
-                return {"statusCode": 400, "body": "No keyword extracted"}
-            try:
-                summary, details_md, _ = _os_count_keyword(keyword=keyword)
-                _send_ws(
-                    connection_id,
-                    {
-                        "type": "delta",
-                        "statusCode": 200,
-                        "format": "markdown",
-                        "text": summary + "\n\n" + details_md,
-                    },
-                )
-                _send_ws(connection_id, {"type": "end", "statusCode": 200})
-                return {"statusCode": 200, "body": "COUNT OK"}
-            except Exception as e:
-                logger.error(f"COUNT error: {e}", exc_info=True)
-                _end_with_error(
-                    connection_id,
-                    "There was a problem counting documents.",
-                    500,
-                )
-                return {"statusCode": 500, "body": "COUNT error"}
+            return {"statusCode": 500, "body": "COUNT error"}
 
-        # 4) Normal talk
-        history_raw = event.get("history") or []
-        history_msgs = _normalize_history_items(history_raw)
-        try:
-            logger.info(
-                f"History received: items={len(history_raw)}, "
-                f"used_text_turns={len(history_msgs)}"
-            )
-        except Exception:
-            pass
+    # 4) Normal talk
+    _trace_route("talk")
+    history_msgs = _normalize_history_items(history_raw)
+    try:
+        logger.info(
+            f"History received: items={len(history_raw)}, "
+            f"used_text_turns={len(history_msgs)}"
+        )
+    except Exception:
+        pass
+
+    _talk_with_optional_kb(connection_id, prompt, history_messages=history_msgs)
+    return {"statusCode": 200, "body": "OK"}
+
+
+def lambda_handler(event, context):
+    global _REPLY_PARTS, _TRACE, _USAGE
+    _TRACE = _Trace(event.get("connectionId") or "")
+    _USAGE = _UsageLedger()
+    try:
+        connection_id = event.get("connectionId")
 
-        _talk_with_optional_kb(connection_id, prompt, history_messages=history_msgs)
-        return {"statusCode": 200, "body": "OK"}
+        if not connection_id:
+            return {"statusCode": 400, "body": "Missing connectionId"}
+
+        # Check for feedback action BEFORE checking for prompt
+        action = event.get("action")
+        if action == "submitFeedback":
+            _trace_route("feedback")
+            return _handle_feedback(event, connection_id)
+
+        # Now check for prompt (only needed for non-feedback actions)
+        prompt = (event.get("prompt") or "").strip()
+        if not prompt:
+            _end_with_error(connection_id, "Please provide a prompt.", 400)
+            return {"statusCode": 400, "body": "Empty prompt"}
+
+        if _idempotency_claim(event, context) == "duplicate":
+            _trace_route("duplicate")
+            return {"statusCode": 200, "body": "DUPLICATE_SKIPPED"}
+
+        history_raw = _session_history(event)
+        # A resumed attempt starts from the text the client already has.
+        run = _IDEMPOTENT_RUN
+        _REPLY_PARTS = [run.delivered_prefix] if run and run.delivered_prefix else []
+        result = {"statusCode": 500}
+        try:
+            if run and run.stream_done:
+                _trace_route("resumed_close")
+                result = _close_resumed(connection_id)
+            else:
+                result = _route_prompt(connection_id, prompt, history_raw)
+            return result
+        finally:
+            reply, _REPLY_PARTS = "".join(_REPLY_PARTS), None
+            _save_session_turn(event, prompt, reply)
+            _idempotency_complete(int((result or {}).get("statusCode") or 200))
 
     except Exception as e:
         logger.error(f"Fatal handler error: {e}", exc_info=True)
         cid = event.get("connectionId")
         if cid:
             _end_with_error(cid, "Internal error.", 500)
-        return {"statusCode": 500, "body": "Internal error"}
\ No newline at end of file
+        return {"statusCode": 500, "body": "Internal error"}
+    finally:
+        _close_ws_senders()
+        _log_usage_summary(_TRACE.route)
+        _TRACE.emit()
+        _TRACE, _USAGE = None, None
+
+
+_IMPORT_PROFILE["total"] = round((time.perf_counter() - _COLD_START_T0) * 1000, 2)
+logger.info(f"Cold start import profile (ms): {json.dumps(_IMPORT_PROFILE)}")
@@ -0,0 +1,192 @@
+# lambda/shared/python/intercepts.py
+"""
+Canned-answer intercepts, shared by web-socket-handler (answers them inline,
+skipping the async hop to lambdaXbedrock) and lambdaXbedrock (answers the
+same way for anything forwarded to it). Deployed to both functions as a
+Lambda layer, so /opt/python puts this module on the import path.
+
+Order is support-contact terms, then personal-KB qna, then runtime-KB
+link-only qna.
+"""
+from __future__ import annotations
+
+import json
+import logging
+import time
+from typing import NamedTuple
+
+from botocore.exceptions import ClientError
+
+logger = logging.getLogger(__name__)
+
+SUPPORT_TERMS = (
+    "contact for support",
+    "who can i contact",
+    "support contact",
+    "contact info",
+    "support email",
+    "who do i contact",
+)
+SUPPORT_ANSWER = (
+    "The i2i team is here anytime! Please contact us at "
+    "info.i2i@genesis-analytics.com"
+)
+
+
+class Intercept(NamedTuple):
+    route: str  # trace route name
+    text: str   # markdown answer, sent as a single delta
+    body: str   # handler response body
+
+
+def norm(s: str) -> str:
+    return (s or "").lower().strip()
+
+
+class QnaMatcher:
+    """
+    Compiled form of a KB's `qna` list: an exact-question hash map plus an
+    Aho-Corasick automaton over every normalized pattern.
+
+    match() is linear in the prompt length and returns the same item as the
+    old scan: the first item (in file order) whose question_exact equals the
+    prompt or one of whose patterns occurs in it.
+    """
+
+    _NO_MATCH = float("inf")
+
+    def __init__(self, kb: dict | None):
+        self.kb = kb
+        self.items = list((kb or {}).get("qna", []) or [])
+        self.exact: dict[str, int] = {}
+        self._goto: list[dict[str, int]] = [{}]
+        self._fail: list[int] = [0]
+        # lowest item index of any pattern ending at this node or its suffixes
+        self._best: list[float] = [self._NO_MATCH]
+
+        for idx, item in enumerate(self.items):
+            self.exact.setdefault(norm(item.get("question_exact")), idx)
+            for p in item.get("patterns", []) or []:
+                if not p:
+                    continue
+                node = 0
+                for ch in norm(p):
+                    nxt = self._goto[node].get(ch)
+                    if nxt is None:
+                        nxt = len(self._goto)
+                        self._goto[node][ch] = nxt
+                        self._goto.append({})
+                        self._fail.append(0)
+                        self._best.append(self._NO_MATCH)
+                    node = nxt
+                # an all-whitespace pattern normalizes to "" and matches everything
+                self._best[node] = min(self._best[node], idx)
+
+        queue = list(self._goto[0].values())
+        for node in queue:
+            for ch, nxt in self._goto[node].items():
+                f = self._fail[node]
+                while f and ch not in self._goto[f]:
+                    f = self._fail[f]
+                fail = self._goto[f].get(ch, 0)
+                self._fail[nxt] = fail if fail != nxt else 0
+                queue.append(nxt)
+            # BFS order: the fail target is already final
+            if self._best[self._fail[node]] < self._best[node]:
+                self._best[node] = self._best[self._fail[node]]
+
+    def match(self, prompt: str):
+        q = norm(prompt)
+        top = min(self.exact.get(q, self._NO_MATCH), self._best[0])
+        goto, fail, best = self._goto, self._fail, self._best
+        node = 0
+        for ch in q:
+            if top == 0:
+                break
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            if best[node] < top:
+                top = best[node]
+        return self.items[top] if top != self._NO_MATCH else None
+
+
+def matcher_for(kb: dict | None, matcher: QnaMatcher | None) -> QnaMatcher:
+    """Reuse the compiled matcher unless the KB object was swapped out."""
+    if matcher is not None and matcher.kb is kb:
+        return matcher
+    return QnaMatcher(kb)
+
+
+def support_answer(prompt: str) -> Intercept | None:
+    q = (prompt or "").lower()
+    if any(term in q for term in SUPPORT_TERMS):
+        return Intercept("support", SUPPORT_ANSWER, "SUPPORT_CONTACT_OK")
+    return None
+
+
+def kb_answer(personal_hit: dict | None, runtime_hit: dict | None) -> Intercept | None:
+    """Answer for a personal-KB hit, else a link-only runtime-KB hit; None forwards to the model."""
+    if personal_hit:
+        return Intercept("personal", personal_hit.get("answer_template") or "Got it.", "PERSONAL_KB_OK")
+    if runtime_hit and runtime_hit.get("link_only"):
+        url = (runtime_hit.get("source_url") or "").strip()
+        name = (runtime_hit.get("primary_source") or "Link").strip()
+        text = (
+            f"{runtime_hit.get('answer_text') or 'Here’s the best source:'}\n\n[{name}]({url})"
+            if url else
+            (runtime_hit.get("answer_text") or "Here’s the best source.")
+        )
+        return Intercept("runtime_link", text, "RUNTIME_LINK_ONLY_OK")
+    return None
+
+
+class InterceptKbs:
+    """
+    Personal/runtime KB matchers for callers without lambdaXbedrock's config
+    loader. Loaded from S3 on first use, then re-checked with conditional
+    GETs every `refresh_seconds`; a failed read keeps the previous version.
+    """
+
+    def __init__(self, s3, bucket: str, personal_key: str = "", runtime_key: str = "",
+                 refresh_seconds: float = 300.0):
+        self.s3 = s3
+        self.bucket = bucket
+        self.keys = {name: key for name, key in (("personal", personal_key), ("runtime", runtime_key)) if key}
+        self.refresh_seconds = refresh_seconds
+        self.matchers: dict[str, QnaMatcher] = {}
+        self._etags: dict[str, str] = {}
+        self._checked_at: float | None = None
+
+    def refresh(self):
+        now = time.monotonic()
+        if not (self.s3 and self.bucket and self.keys):
+            return
+        if self._checked_at is not None and now - self._checked_at < self.refresh_seconds:
+            return
+        self._checked_at = now
+        for name, key in self.keys.items():
+            kwargs = {"Bucket": self.bucket, "Key": key}
+            if name in self._etags:
+                kwargs["IfNoneMatch"] = f'"{self._etags[name]}"'
+            try:
+                obj = self.s3.get_object(**kwargs)
+                self.matchers[name] = QnaMatcher(json.loads(obj["Body"].read().decode("utf-8")))
+                self._etags[name] = (obj.get("ETag") or "").strip('"')
+                logger.info(f"Loaded {name} intercepts key={key} etag={self._etags[name]}")
+            except ClientError as e:
+                if str(e.response.get("Error", {}).get("Code")) not in ("304", "NotModified"):
+                    logger.error(f"Failed to read intercepts {key}: {e}")
+            except Exception as e:
+                logger.error(f"Failed to load intercepts {key}: {e}")
+
+    def match(self, prompt: str) -> Intercept | None:
+        hit = support_answer(prompt)
+        if hit:
+            return hit
+        self.refresh()
+        personal, runtime = self.matchers.get("personal"), self.matchers.get("runtime")
+        return kb_answer(
+            personal.match(prompt) if personal else None,
+            runtime.match(prompt) if runtime else None,
+        )
@@ -1,16 +1,122 @@
 # /home/zvallarino/AI_AWS_PC/Drugs-Side-Effect-Classification/cdk_backend/lambda/web-socket-handler/index.py
 import os
 import json
+import time
+import uuid
 import boto3
 import logging
 
+from intercepts import InterceptKbs
+
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
 lambda_client = boto3.client('lambda')
 
+# When set, lambdaXbedrock keeps the conversation in this table and only the
+# new prompt plus a session reference is forwarded (Event payloads cap at 256 KB).
+SESSION_TABLE_NAME = os.environ.get('SESSION_TABLE_NAME', '')
+DISCONNECT_MARKER_TTL_SECONDS = int(os.environ.get('DISCONNECT_MARKER_TTL_SECONDS', '3600'))
+dynamodb = boto3.client('dynamodb') if SESSION_TABLE_NAME else None
+SESSION_TTL_SECONDS = int(os.environ.get('SESSION_TTL_SECONDS', str(7 * 24 * 3600)))
+
+# Support / personal-KB / link-only answers are pure lookups: answer them here
+# and skip the async hop to lambdaXbedrock. Same rules as lambdaXbedrock's
+# (shared intercepts layer), so turning this off only changes latency.
+INLINE_INTERCEPTS = os.environ.get('INLINE_INTERCEPTS', 'true').lower() in ('1', 'true', 'yes')
+S3_BUCKET_NAME = os.environ.get('S3_BUCKET_NAME', '')
+intercept_kbs = InterceptKbs(
+    boto3.client('s3') if S3_BUCKET_NAME else None,
+    S3_BUCKET_NAME,
+    personal_key=os.environ.get('PERSONAL_KB_KEY', ''),
+    runtime_key=os.environ.get('RUNTIME_KB_KEY', ''),
+    refresh_seconds=float(os.environ.get('KB_REFRESH_SECONDS', '300')),
+)
+_ws_clients = {}
+
+
+def ws_client(event):
+    """apigatewaymanagementapi client for the stage this event came from (or URL)."""
+    ctx = event.get('requestContext', {})
+    endpoint = os.environ.get('URL') or f"https://{ctx.get('domainName')}/{ctx.get('stage')}"
+    if endpoint not in _ws_clients:
+        _ws_clients[endpoint] = boto3.client('apigatewaymanagementapi', endpoint_url=endpoint)
+    return _ws_clients[endpoint]
+
+
+def record_turn(session_id, prompt, reply):
+    """Append an inline-answered turn to the session table in lambdaXbedrock's item shape (session#<id> key)."""
+    if not dynamodb:
+        return
+    expires_at = str(int(time.time()) + SESSION_TTL_SECONDS)
+    base = time.time_ns()
+    pending = {SESSION_TABLE_NAME: [
+        {"PutRequest": {"Item": {
+            "sessionId": {"S": f"session#{session_id}"},
+            "seq": {"N": str(base + i)},
+            "sentBy": {"S": sent_by},
+            "message": {"S": message},
+            "expiresAt": {"N": expires_at},
+        }}}
+        for i, (sent_by, message) in enumerate((("USER", prompt), ("BOT", reply)))
+    ]}
+    try:
+        for attempt in range(3):
+            if attempt:
+                time.sleep(0.05 * 2 ** attempt)
+            pending = dynamodb.batch_write_item(RequestItems=pending).get("UnprocessedItems") or {}
+            if not pending:
+                return
+        logger.error(f"Dropped {sum(len(v) for v in pending.values())} unprocessed inline turn item(s) for {session_id}")
+    except Exception as e:
+        logger.error(f"Failed to record inline turn for {session_id}: {e}")
+
+
+def answer_inline(event, connection_id, prompt):
+    """Post an intercept answer straight to the client and return it; None means forward as usual."""
+    if not INLINE_INTERCEPTS or not prompt:
+        return None
+    hit = intercept_kbs.match(prompt)
+    if not hit:
+        return None
+    client = ws_client(event)
+    try:
+        client.post_to_connection(
+            ConnectionId=connection_id,
+            Data=json.dumps({"type": "delta", "statusCode": 200, "format": "markdown", "text": hit.text}),
+        )
+    except Exception as e:
+        # Nothing reached the client yet, so lambdaXbedrock can still answer it.
+        logger.error(f"Inline answer failed for {connection_id}, forwarding: {e}")
+        return None
+    try:
+        client.post_to_connection(
+            ConnectionId=connection_id,
+            Data=json.dumps({"type": "end", "statusCode": 200}),
+        )
+    except Exception as e:
+        logger.error(f"Failed to post end frame to {connection_id}: {e}")
+    logger.info(f"Answered inline: route={hit.route} connection={connection_id}")
+    return hit.text
+
+
+def record_disconnect(connection_id):
+    """Cancellation marker read by lambdaXbedrock to stop generating for a closed tab."""
+    if not dynamodb:
+        return
+    try:
+        dynamodb.put_item(
+            TableName=SESSION_TABLE_NAME,
+            Item={
+                "sessionId": {"S": f"disconnect#{connection_id}"},
+                "seq": {"N": "0"},
+                "expiresAt": {"N": str(int(time.time()) + DISCONNECT_MARKER_TTL_SECONDS)},
+            },
+        )
+    except Exception as e:
+        logger.error(f"Failed to record disconnect for {connection_id}: {e}")
+
 def handle_message(event, connection_id):
-    logger.info(f"handle_message called with event: {json.dumps(event)}")
     response_function_arn = os.environ['RESPONSE_FUNCTION_ARN']
 
     try:
@@ -25,19 +131,39 @@ def handle_message(event, connection_id):
             logger.warning(f"Expected 'history' to be a list, but got {type(history)}. Setting history to an empty list.")
             history = []
 
+        # Server-side history needs a client sessionId that survives reconnects;
+        # without one, keep using the history the client uploads.
+        session_id = body.get('sessionId')
+        server_history = bool(SESSION_TABLE_NAME and session_id)
+
+        reply = answer_inline(event, connection_id, prompt)
+        if reply:
+            if server_history:
+                record_turn(session_id, prompt, reply)
+            return {'statusCode': 200, 'body': json.dumps({'message': 'Answered inline'})}
+
         input_payload = {
             "prompt": prompt,
             "connectionId": connection_id,
-            "history": history,
+            "sessionId": session_id or connection_id,
+            # Idempotency key: async invoke retries reuse this payload, so
+            # lambdaXbedrock can skip or resume a message it already started.
+            "messageId": body.get('messageId') or str(uuid.uuid4()),
             "role": selected_role
         }
+        if not server_history:
+            input_payload["history"] = history
 
-        logger.info(f"Invoking lambdaXbedrock with payload: {json.dumps(input_payload)}")
+        payload_str = json.dumps(input_payload)
+        logger.info(
+            f"Invoking lambdaXbedrock: session={input_payload['sessionId']} message={input_payload['messageId']} "
+            f"history_items={len(input_payload.get('history', []))} bytes={len(payload_str)}"
+        )
 
         lambda_client.invoke(
             FunctionName=response_function_arn,
             InvocationType='Event',
-            Payload=json.dumps(input_payload)
+            Payload=payload_str
         )
 
         return {'statusCode': 200, 'body': json.dumps({'message': 'Message forwarded successfully'})}
@@ -84,7 +210,8 @@ def handle_feedback(event):
 
 
 def lambda_handler(event, context):
-    logger.info(f"lambda_handler called with event: {json.dumps(event)}")
+    request_context = event.get('requestContext', {})
+    logger.info(f"lambda_handler called: routeKey={request_context.get('routeKey')} connectionId={request_context.get('connectionId')}")
     
     # Check if this is a feedback event (action is at root level)
     if event.get('action') == 'submitFeedback':
@@ -113,6 +240,7 @@ def lambda_handler(event, context):
          return {'statusCode': 200, 'body': 'Connect successful.'}
     elif route_key == '$disconnect':
          logger.info(f"Handling $disconnect for connectionId: {connection_id}")
+         record_disconnect(connection_id)
          return {'statusCode': 200, 'body': 'Disconnect successful.'}
     elif route_key == 'sendMessage':
         logger.info(f"Handling sendMessage for connectionId: {connection_id}")
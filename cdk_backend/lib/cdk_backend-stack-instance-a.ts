@@ -47,6 +47,13 @@ export class CdkBackendStackInstanceA extends cdk.Stack {
 
     const webSocketApiArn = `arn:aws:execute-api:${this.region}:${this.account}:${webSocketApi.apiId}/${webSocketStage.stageName}/POST/@connections/*`;
 
+    // Shared intercepts.py (imported by lambdaXbedrock and web-socket-handler)
+    const interceptsLayer = new lambda.LayerVersion(this, 'intercepts-layer-instanceA', {
+      code: lambda.Code.fromAsset('lambda/shared'),
+      compatibleRuntimes: [lambda.Runtime.PYTHON_3_12],
+      description: 'intercepts.py shared by web-socket-handler and lambdaXbedrock',
+    });
+
     const lambdaXbedrock = new lambda.Function(this, 'lambda-bedrock-instanceA', {
       runtime: lambda.Runtime.PYTHON_3_12,
       handler: 'index.lambda_handler',
@@ -55,6 +62,7 @@ export class CdkBackendStackInstanceA extends cdk.Stack {
         URL: webSocketStage.callbackUrl,
         KNOWLEDGE_BASE_ID: kb.knowledgeBaseId,
       },
+      layers: [interceptsLayer],
     });
 
     lambdaXbedrock.addToRolePolicy(new iam.PolicyStatement({
@@ -69,6 +77,7 @@ export class CdkBackendStackInstanceA extends cdk.Stack {
       environment: {
         RESPONSE_FUNCTION_ARN: lambdaXbedrock.functionArn,
       },
+      layers: [interceptsLayer],
     });
 
     lambdaXbedrock.grantInvoke(webSocketHandler);
@@ -90,6 +90,13 @@ export class CdkBackendStackInstanceB extends cdk.Stack {
     // --- Retrieve the OpenSearch Python Layer ---
     const openSearchLayer = lambda.LayerVersion.fromLayerVersionArn(this, 'OpenSearchLayer', OPENSEARCH_LAYER_ARN);
 
+    // Shared intercepts.py (imported by lambdaXbedrock and web-socket-handler)
+    const interceptsLayer = new lambda.LayerVersion(this, 'intercepts-layer-instanceB', {
+      code: lambda.Code.fromAsset('lambda/shared'),
+      compatibleRuntimes: [lambda.Runtime.PYTHON_3_12],
+      description: 'intercepts.py shared by web-socket-handler and lambdaXbedrock',
+    });
+
     // --- Main Processing Lambda (lambdaXbedrock) ---
     const lambdaXbedrock = new lambda.Function(this, 'lambda-bedrock-instanceB', {
       runtime: lambda.Runtime.PYTHON_3_12,
@@ -110,7 +117,7 @@ export class CdkBackendStackInstanceB extends cdk.Stack {
       },
       timeout: cdk.Duration.seconds(60), // Allow time for OS query or LLM call
       memorySize: 256, // Increased slightly for libraries
-      layers: [openSearchLayer], // Attach the opensearch-py library
+      layers: [openSearchLayer, interceptsLayer], // opensearch-py + shared intercepts
     });
 
     // --- Grant IAM Permissions to lambdaXbedrock ---
@@ -151,8 +158,10 @@ export class CdkBackendStackInstanceB extends cdk.Stack {
       code: lambda.Code.fromAsset('lambda/web-socket-handler'), // Ensure this path is correct
       environment: {
         RESPONSE_FUNCTION_ARN: lambdaXbedrock.functionArn, // Pass ARN of function to invoke
+        INLINE_INTERCEPTS: 'false', // no ManageConnections here; lambdaXbedrock answers intercepts
       },
       timeout: cdk.Duration.seconds(10), // Should be quick, just invokes asynchronously
+      layers: [interceptsLayer],
     });
 
     // Grant the handler function permission to invoke the main processing function
@@ -9,6 +9,7 @@ import { bedrock } from '@cdklabs/generative-ai-cdk-constructs';
 import * as amplify from '@aws-cdk/aws-amplify-alpha';
 import * as secretsmanager from 'aws-cdk-lib/aws-secretsmanager';
 import * as codebuild from 'aws-cdk-lib/aws-codebuild';
+import * as dynamodb from 'aws-cdk-lib/aws-dynamodb';
 import { Construct } from 'constructs';
 
 // ========================================================================
@@ -23,6 +24,9 @@ const OPENSEARCH_TEXT_FIELD = 'AMAZON_BEDROCK_TEXT_CHUNK';
 const OPENSEARCH_DOC_ID_FIELD = 'x-amz-bedrock-kb-source-uri.keyword';
 const OPENSEARCH_LAYER_ARN = 'arn:aws:lambda:us-east-1:887585754747:layer:OpenSearchPythonLayer:1';
 const S3_BUCKET_NAME_CONST = 'cdkbackendstack-instanceb-litigationbdocbucket15a6-4leqsqspqrxj'; // optional
+// Runtime/personal JSON KBs in the doc bucket (empty = disabled), e.g. 'runtime/personal_kb.json'
+const RUNTIME_KB_KEY = '';
+const PERSONAL_KB_KEY = '';
 
 // ---- MODEL CONFIG ----
 // (Keep MODEL_ID for reference; it's unused when USE_CRI=true)
@@ -73,7 +77,7 @@ export class CdkBackendStackInstanceC extends cdk.Stack {
     });
 
     // --- KB Data Source ---
-    new bedrock.S3DataSource(this, 'datasource-instanceC', {
+    const dataSourceC = new bedrock.S3DataSource(this, 'datasource-instanceC', {
       bucket: bucketC,
       knowledgeBase: kb,
       chunkingStrategy: bedrock.ChunkingStrategy.DEFAULT,
@@ -96,7 +100,6 @@ export class CdkBackendStackInstanceC extends cdk.Stack {
           connectHandler
         ),
       },
-      disconnectRouteOptions: { integration: new apigatewayv2_integrations.WebSocketMockIntegration('disconnect') },
       defaultRouteOptions: { integration: new apigatewayv2_integrations.WebSocketMockIntegration('default') },
     });
 
@@ -109,6 +112,22 @@ export class CdkBackendStackInstanceC extends cdk.Stack {
     // --- OpenSearch Python Layer (kept for later) ---
     const openSearchLayer = lambda.LayerVersion.fromLayerVersionArn(this, 'OpenSearchLayer', OPENSEARCH_LAYER_ARN);
 
+    // --- Shared intercepts (support / personal / link-only answers) for both Lambdas ---
+    const interceptsLayer = new lambda.LayerVersion(this, 'intercepts-layer-instanceC', {
+      code: lambda.Code.fromAsset('lambda/shared'),
+      compatibleRuntimes: [lambda.Runtime.PYTHON_3_12],
+      description: 'intercepts.py shared by web-socket-handler and lambdaXbedrock',
+    });
+
+    // --- Conversation turns (server-side history, expired via TTL) ---
+    const sessionTable = new dynamodb.Table(this, 'sessions-instanceC', {
+      partitionKey: { name: 'sessionId', type: dynamodb.AttributeType.STRING },
+      sortKey: { name: 'seq', type: dynamodb.AttributeType.NUMBER },
+      billingMode: dynamodb.BillingMode.PAY_PER_REQUEST,
+      timeToLiveAttribute: 'expiresAt',
+      removalPolicy: cdk.RemovalPolicy.DESTROY,
+    });
+
     // --- Main Processing Lambda (lambdaXbedrock) — TALK ONLY ---
     const lambdaXbedrock = new lambda.Function(this, 'lambda-bedrock-instanceC', {
       runtime: lambda.Runtime.PYTHON_3_12,
@@ -117,6 +136,7 @@ export class CdkBackendStackInstanceC extends cdk.Stack {
       environment: {
         URL: webSocketStage.callbackUrl,
         KNOWLEDGE_BASE_ID: kb.knowledgeBaseId, // not used yet
+        DATA_SOURCE_ID: dataSourceC.dataSourceId, // ingestion jobs invalidate cached retrievals/counts
 
         // OpenSearch (not used yet in talk-only path)
         OPENSEARCH_ENDPOINT: OPENSEARCH_COLLECTION_ENDPOINT,
@@ -127,6 +147,8 @@ export class CdkBackendStackInstanceC extends cdk.Stack {
 
         // S3
         S3_BUCKET_NAME: bucketC.bucketName,
+        RUNTIME_KB_KEY: RUNTIME_KB_KEY,
+        PERSONAL_KB_KEY: PERSONAL_KB_KEY,
 
         // Model selection for index.py:
         // constants.py prefers INFERENCE_PROFILE_ID (3.7) when non-empty
@@ -135,10 +157,18 @@ export class CdkBackendStackInstanceC extends cdk.Stack {
 
         // Optional: quick tone control
         SYSTEM_PROMPT: 'You are a concise, helpful assistant.',
+
+        // Server-side conversation history
+        SESSION_TABLE_NAME: sessionTable.tableName,
+
+        // Prompt caching needs a >= 1024-token system prefix on Sonnet 4;
+        // the current prefix is ~800 tokens, so leave it off until it grows.
+        PROMPT_CACHE_ENABLED: 'false',
+        PROMPT_CACHE_MIN_TOKENS: '1024',
       },
       timeout: cdk.Duration.seconds(60),
       memorySize: 256,
-      layers: [openSearchLayer],
+      layers: [openSearchLayer, interceptsLayer],
     });
 
     // --- WebSocket handler that invokes the main Lambda ---
@@ -148,8 +178,16 @@ export class CdkBackendStackInstanceC extends cdk.Stack {
       code: lambda.Code.fromAsset('lambda/web-socket-handler'),
       environment: {
         RESPONSE_FUNCTION_ARN: lambdaXbedrock.functionArn,
+        SESSION_TABLE_NAME: sessionTable.tableName, // forward prompt + sessionId only
+
+        // Intercept hits are answered here without invoking lambdaXbedrock
+        URL: webSocketStage.callbackUrl,
+        S3_BUCKET_NAME: bucketC.bucketName,
+        RUNTIME_KB_KEY: RUNTIME_KB_KEY,
+        PERSONAL_KB_KEY: PERSONAL_KB_KEY,
       },
       timeout: cdk.Duration.seconds(10),
+      layers: [interceptsLayer],
     });
 
     // Allow WS handler to invoke main
@@ -163,6 +201,24 @@ export class CdkBackendStackInstanceC extends cdk.Stack {
       ),
     });
 
+    // Route: $disconnect -> webSocketHandler (writes the cancellation marker)
+    webSocketApi.addRoute('$disconnect', {
+      integration: new apigatewayv2_integrations.WebSocketLambdaIntegration(
+        'ws-disconnect-integration-instanceC',
+        webSocketHandler
+      ),
+    });
+    sessionTable.grantWriteData(webSocketHandler);
+
+    // Inline intercept answers: read the JSON KBs and post to the connection
+    bucketC.grantRead(webSocketHandler, 'runtime/*');
+    webSocketHandler.addToRolePolicy(new iam.PolicyStatement({
+      actions: ['execute-api:ManageConnections'],
+      resources: [
+        `arn:aws:execute-api:${this.region}:${this.account}:${webSocketApi.apiId}/${webSocketStage.stageName}/POST/@connections/*`,
+      ],
+    }));
+
     // --- IAM for lambdaXbedrock ---
 
     // 1) KB Retrieve (future; harmless now)
@@ -171,6 +227,12 @@ export class CdkBackendStackInstanceC extends cdk.Stack {
       resources: [kb.knowledgeBaseArn],
     }));
 
+    // 1b) Ingestion job status, so a finished sync drops the warm caches
+    lambdaXbedrock.addToRolePolicy(new iam.PolicyStatement({
+      actions: ['bedrock:ListIngestionJobs'],
+      resources: [kb.knowledgeBaseArn],
+    }));
+
     // 2) Inference permissions
     if (!USE_CRI) {
       // On-demand model (e.g., 3.5 Sonnet)
@@ -206,7 +268,10 @@ export class CdkBackendStackInstanceC extends cdk.Stack {
       resources: [OPENSEARCH_COLLECTION_ARN],
     }));
 
-      // 5) S3 GetObject (for presigned URLs later)
+    // 5) Session history read/append
+    sessionTable.grantReadWriteData(lambdaXbedrock);
+
+      // 6) S3 GetObject (for presigned URLs later)
   lambdaXbedrock.addToRolePolicy(new iam.PolicyStatement({
     actions: ['s3:GetObject', 's3:PutObject'],  // <-- Added PutObject
     resources: [bucketC.arnForObjects('*')],
@@ -63,6 +63,13 @@ export class CdkBackendStack extends cdk.Stack {
 
     const webSocketApiArn = `arn:aws:execute-api:${this.region}:${this.account}:${webSocketApi.apiId}/${webSocketStage.stageName}/POST/@connections/*`;
 
+    // Shared intercepts.py (imported by lambdaXbedrock and web-socket-handler)
+    const interceptsLayer = new lambda.LayerVersion(this, 'intercepts-layer-pc', {
+      code: lambda.Code.fromAsset('lambda/shared'),
+      compatibleRuntimes: [lambda.Runtime.PYTHON_3_12],
+      description: 'intercepts.py shared by web-socket-handler and lambdaXbedrock',
+    });
+
     // lambdaXbedrock Lambda function
     const lambdaXbedrock = new lambda.Function(this, 'pc-get-response-from-bedrock', {
       runtime: lambda.Runtime.PYTHON_3_12,
@@ -73,7 +80,8 @@ export class CdkBackendStack extends cdk.Stack {
         KNOWLEDGE_BASE_ID: kb.knowledgeBaseId,
       },
       timeout: cdk.Duration.seconds(300),
-      memorySize: 256
+      memorySize: 256,
+      layers: [interceptsLayer],
     });
 
     lambdaXbedrock.addToRolePolicy(new iam.PolicyStatement({
@@ -107,7 +115,8 @@ export class CdkBackendStack extends cdk.Stack {
       handler: 'index.lambda_handler',
       environment: {
         RESPONSE_FUNCTION_ARN: lambdaXbedrock.functionArn
-      }
+      },
+      layers: [interceptsLayer],
     });
 
     lambdaXbedrock.grantInvoke(webSocketHandler);
@@ -84,7 +84,7 @@ function UserReply({ message }) {
 }
 
 function ChatBody({ onFileUpload, showLeftNav, setLeftNav }) {
-  const { messageList, addMessage } = useMessage();
+  const { messageList, addMessage, sessionId } = useMessage();
   const { questionAsked, setQuestionAsked } = useQuestion();
   const { processing, setProcessing } = useProcessing();
   const { selectedRole } = useRole();
@@ -149,7 +149,7 @@ function ChatBody({ onFileUpload, showLeftNav, setLeftNav }) {
       setQuestionAsked(true);
 
       const historyToSend = ALLOW_CHAT_HISTORY ? messageList.slice(-20) : [];
-      const messagePayload = { action: 'sendMessage', prompt: trimmedMessage, role: selectedRole, history: historyToSend };
+      const messagePayload = { action: 'sendMessage', prompt: trimmedMessage, role: selectedRole, history: historyToSend, sessionId };
       websocket.current.send(JSON.stringify(messagePayload));
     } else if (!trimmedMessage) {
       console.warn("Attempted to send an empty message.");
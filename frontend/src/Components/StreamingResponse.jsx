@@ -42,6 +42,10 @@ const StreamingResponse = ({ websocket, onStreamComplete }) => {
 
         if ((jsonData.type === "delta" || jsonData.type === "text") && jsonData.text) {
           if (showLoading) setShowLoading(false);
+          // A retried answer restarts at its last checkpoint: drop what came after it.
+          if (typeof jsonData.offset === "number" && jsonData.offset < accumulatedText.length) {
+            accumulatedText = accumulatedText.slice(0, jsonData.offset);
+          }
           accumulatedText += jsonData.text;
           setCurrentStreamText(accumulatedText);
         } else if (jsonData.type === "sources") {
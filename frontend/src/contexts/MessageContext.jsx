@@ -3,14 +3,22 @@ import React, { createContext, useContext, useState } from 'react';
 
 const MessageContext = createContext();
 
+// One id per conversation: the backend keys server-side history by it, so it
+// must outlive websocket reconnects (each of which gets a new connectionId).
+const newSessionId = () =>
+  (window.crypto && window.crypto.randomUUID)
+    ? window.crypto.randomUUID()
+    : `${Date.now().toString(36)}-${Math.random().toString(36).slice(2)}`;
+
 export const MessageProvider = ({ children }) => {
   const [messageList, setMessageList] = useState([]);
+  const [sessionId] = useState(newSessionId);
 
   const addMessage = (message) => {
     setMessageList((prevList) => [...prevList, message]);
   };
 
-  const value = { messageList, addMessage };
+  const value = { messageList, addMessage, sessionId };
 
   return (
     <MessageContext.Provider value={value}>